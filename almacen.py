@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import queue
+import shutil
+import sqlite3
+import argparse
+import datetime
+import tempfile
+import threading
+
+import numpy as np
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS detecciones (
+    instante REAL NOT NULL,
+    camara TEXT NOT NULL,
+    frame INTEGER,
+    clase TEXT NOT NULL,
+    confianza REAL NOT NULL,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL,
+    track_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS detecciones_instante ON detecciones (instante);
+CREATE INDEX IF NOT EXISTS detecciones_clase ON detecciones (clase, instante);
+CREATE INDEX IF NOT EXISTS detecciones_camara ON detecciones (camara, instante);
+
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    camara TEXT NOT NULL,
+    track_id INTEGER NOT NULL,
+    clase TEXT,
+    inicio REAL NOT NULL,
+    fin REAL NOT NULL,
+    frames INTEGER,
+    mejor_confianza REAL,
+    evento TEXT
+);
+CREATE INDEX IF NOT EXISTS tracks_inicio ON tracks (inicio);
+CREATE INDEX IF NOT EXISTS tracks_clase ON tracks (clase, inicio);
+CREATE INDEX IF NOT EXISTS tracks_camara ON tracks (camara, inicio);
+
+CREATE TABLE IF NOT EXISTS eventos (
+    id INTEGER PRIMARY KEY,
+    instante REAL NOT NULL,
+    camara TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    nombre TEXT,
+    track_id INTEGER,
+    clase TEXT,
+    confianza REAL,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL,
+    imagen TEXT,
+    imagen_bbox TEXT,
+    imagen_hd TEXT,
+    clip TEXT
+);
+CREATE INDEX IF NOT EXISTS eventos_instante ON eventos (instante);
+CREATE INDEX IF NOT EXISTS eventos_clase ON eventos (clase, instante);
+CREATE INDEX IF NOT EXISTS eventos_camara ON eventos (camara, instante);
+CREATE INDEX IF NOT EXISTS eventos_nombre ON eventos (nombre);
+"""
+
+_INSERTS = {
+    "detecciones": "INSERT INTO detecciones (instante, camara, frame, clase, confianza, "
+                   "x1, y1, x2, y2, track_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "tracks": "INSERT INTO tracks (camara, track_id, clase, inicio, fin, frames, mejor_confianza, "
+              "evento) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    "eventos": "INSERT INTO eventos (instante, camara, tipo, nombre, track_id, clase, confianza, "
+               "x1, y1, x2, y2, imagen, imagen_bbox, imagen_hd, clip) "
+               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+}
+
+# Columna de tiempo de cada tabla para los filtros desde/hasta
+_COLUMNA_TIEMPO = {"detecciones": "instante", "tracks": "inicio", "eventos": "instante"}
+
+
+def abrir(path, solo_lectura=False):
+    """Conexión con WAL y el esquema creado; solo_lectura no crea nada
+
+    WAL deja leer mientras el hilo escritor inserta: los lectores ven la
+    última transacción confirmada sin bloquear al escritor.
+    """
+    if solo_lectura:
+        conexion = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=5.0)
+        conexion.execute("PRAGMA query_only=ON")
+        return conexion
+    conexion = sqlite3.connect(path, timeout=5.0)
+    conexion.execute("PRAGMA journal_mode=WAL")
+    # NORMAL con WAL: un corte de luz puede perder la última transacción, no corromper la base
+    conexion.execute("PRAGMA synchronous=NORMAL")
+    conexion.execute("PRAGMA temp_store=MEMORY")
+    conexion.executescript(_ESQUEMA)
+    return conexion
+
+
+def _caja(caja):
+    if caja is None:
+        return (None, None, None, None)
+    return tuple(float(v) for v in caja[:4])
+
+
+class AlmacenDetecciones:
+    """Base SQLite con detecciones, tracks y eventos, escrita por un hilo en lotes
+
+    Los métodos registrar_* no bloquean: arman las filas y las encolan. El hilo
+    escritor junta lo que llegó en intervalo segundos (o lote filas) y lo
+    inserta con executemany en una sola transacción. Si la cola se llena las
+    filas nuevas se descartan y se cuentan; el hilo de streaming nunca espera
+    al disco.
+    """
+
+    def __init__(self, path, camara="", lote=5000, intervalo=0.5, max_cola=1024):
+        self.path = path
+        self.camara = camara
+        self.lote = lote
+        self.intervalo = intervalo
+        self.cola = queue.Queue(maxsize=max_cola)
+        self._activo = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+
+        # Contadores
+        self.encoladas = 0
+        self.descartadas = 0
+        self.escritas = 0
+        self.transacciones = 0
+        self.errores = 0
+
+        carpeta = os.path.dirname(os.path.abspath(path))
+        os.makedirs(carpeta, exist_ok=True)
+        # Crear el esquema acá: los lectores pueden abrir la base apenas arranca
+        abrir(path).close()
+
+    def iniciar(self):
+        if self._activo.is_set():
+            return
+        self._activo.set()
+        self._hilo = threading.Thread(target=self._bucle, name="almacen_escritor", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=10.0):
+        """Insertar lo pendiente y cerrar la conexión del escritor"""
+        self._activo.clear()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+            self._hilo = None
+
+    def _encolar(self, tabla, filas):
+        if not filas:
+            return True
+        try:
+            self.cola.put_nowait((tabla, filas))
+        except queue.Full:
+            with self._lock:
+                self.descartadas += len(filas)
+            return False
+        with self._lock:
+            self.encoladas += len(filas)
+        return True
+
+    def registrar_detecciones(self, instante, detecciones, cajas=None, frame=None, track_ids=None):
+        """Una fila por detección; cajas (xyxy, p.ej. en píxeles de la cámara) reemplaza a detecciones.xyxy"""
+        if not len(detecciones):
+            return True
+        cajas = detecciones.xyxy if cajas is None else cajas
+        if track_ids is None:
+            track_ids = detecciones.track_id
+        n = len(detecciones)
+        columnas = np.asarray(cajas, dtype=np.float64).reshape(n, 4).T.tolist()
+        ids = [int(t) or None for t in np.asarray(track_ids).tolist()]
+        filas = list(zip([instante] * n, [self.camara] * n, [frame] * n, detecciones.etiquetas(),
+                         detecciones.confianza.astype(np.float64).tolist(), *columnas, ids))
+        return self._encolar("detecciones", filas)
+
+    def registrar_evento(self, instante, tipo, nombre=None, track_id=None, clase=None,
+                         confianza=None, caja=None, imagen=None, imagen_bbox=None,
+                         imagen_hd=None, clip=None):
+        """Un evento (captura, detección guardada...) con las referencias a sus archivos"""
+        fila = (instante, self.camara, tipo, nombre, track_id, clase, confianza, *_caja(caja),
+                imagen, imagen_bbox, imagen_hd, clip)
+        return self._encolar("eventos", [fila])
+
+    def registrar_track(self, track_id, clase, inicio, fin, frames=None, mejor_confianza=None,
+                        evento=None):
+        """Resumen de un track; evento es el nombre del evento de su captura"""
+        fila = (self.camara, int(track_id), clase, inicio, fin, frames, mejor_confianza, evento)
+        return self._encolar("tracks", [fila])
+
+    def _bucle(self):
+        conexion = abrir(self.path)
+        pendientes = {}
+        filas = 0
+        limite = time.monotonic() + self.intervalo
+        try:
+            while self._activo.is_set() or not self.cola.empty():
+                try:
+                    tabla, nuevas = self.cola.get(timeout=max(0.0, limite - time.monotonic()))
+                    pendientes.setdefault(tabla, []).extend(nuevas)
+                    filas += len(nuevas)
+                except queue.Empty:
+                    pass
+                if filas >= self.lote or time.monotonic() >= limite:
+                    self._volcar(conexion, pendientes)
+                    pendientes, filas = {}, 0
+                    limite = time.monotonic() + self.intervalo
+            self._volcar(conexion, pendientes)
+        finally:
+            conexion.close()
+
+    def _volcar(self, conexion, pendientes):
+        if not pendientes:
+            return
+        total = sum(len(filas) for filas in pendientes.values())
+        try:
+            with conexion:
+                for tabla, filas in pendientes.items():
+                    conexion.executemany(_INSERTS[tabla], filas)
+        except sqlite3.Error as e:
+            print(f"⚠️ No se pudo escribir en {self.path}: {e}")
+            with self._lock:
+                self.errores += total
+            return
+        with self._lock:
+            self.escritas += total
+            self.transacciones += 1
+
+    def estadisticas(self):
+        return {
+            "encoladas": self.encoladas,
+            "descartadas": self.descartadas,
+            "escritas": self.escritas,
+            "transacciones": self.transacciones,
+            "errores": self.errores,
+            "en_cola": self.cola.qsize(),
+        }
+
+
+# -----------------------------------------------------------------------------------------------
+# Consultas
+# -----------------------------------------------------------------------------------------------
+def _filtros(tabla, clase=None, desde=None, hasta=None, camara=None):
+    columna = _COLUMNA_TIEMPO[tabla]
+    condiciones, parametros = [], []
+    if clase is not None:
+        condiciones.append("clase = ?")
+        parametros.append(clase)
+    if camara is not None:
+        condiciones.append("camara = ?")
+        parametros.append(camara)
+    if desde is not None:
+        condiciones.append(f"{columna} >= ?")
+        parametros.append(desde)
+    if hasta is not None:
+        condiciones.append(f"{columna} < ?")
+        parametros.append(hasta)
+    donde = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    return donde, parametros
+
+
+def contar(conexion, tabla="eventos", clase=None, desde=None, hasta=None, camara=None):
+    """Filas de tabla que cumplen los filtros (instantes en segundos epoch, hasta excluido)"""
+    donde, parametros = _filtros(tabla, clase, desde, hasta, camara)
+    return conexion.execute(f"SELECT COUNT(*) FROM {tabla}{donde}", parametros).fetchone()[0]
+
+
+def por_clase(conexion, tabla="eventos", desde=None, hasta=None, camara=None):
+    """[(clase, cantidad)] ordenado de mayor a menor"""
+    donde, parametros = _filtros(tabla, None, desde, hasta, camara)
+    return conexion.execute(f"SELECT clase, COUNT(*) AS n FROM {tabla}{donde} "
+                            f"GROUP BY clase ORDER BY n DESC", parametros).fetchall()
+
+
+def por_hora(conexion, tabla="eventos", clase=None, desde=None, hasta=None, camara=None):
+    """[(hora local 'YYYY-MM-DD HH:00', cantidad)]"""
+    columna = _COLUMNA_TIEMPO[tabla]
+    donde, parametros = _filtros(tabla, clase, desde, hasta, camara)
+    return conexion.execute(
+        f"SELECT strftime('%Y-%m-%d %H:00', {columna}, 'unixepoch', 'localtime') AS hora, COUNT(*) "
+        f"FROM {tabla}{donde} GROUP BY hora ORDER BY hora", parametros).fetchall()
+
+
+def eventos(conexion, clase=None, desde=None, hasta=None, camara=None, limite=20):
+    """Últimos eventos con sus archivos, del más reciente al más viejo"""
+    donde, parametros = _filtros("eventos", clase, desde, hasta, camara)
+    cursor = conexion.execute(
+        f"SELECT instante, camara, tipo, track_id, clase, confianza, imagen, imagen_hd, clip "
+        f"FROM eventos{donde} ORDER BY instante DESC LIMIT ?", parametros + [limite])
+    columnas = [d[0] for d in cursor.description]
+    return [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
+
+
+def instante_desde_texto(texto):
+    """'YYYY-MM-DD HH:MM[:SS]' o 'HH:MM' (hoy) en hora local -> segundos epoch"""
+    try:
+        return datetime.datetime.fromisoformat(texto).timestamp()
+    except ValueError:
+        pass
+    try:
+        hora = datetime.time.fromisoformat(texto)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Fecha no válida: {texto!r} (usar 'YYYY-MM-DD HH:MM' o 'HH:MM')")
+    return datetime.datetime.combine(datetime.date.today(), hora).timestamp()
+
+
+def _texto_instante(instante):
+    return datetime.datetime.fromtimestamp(instante).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--db', metavar='PATH',
+                        help='Guardar detecciones, tracks y eventos en esta base SQLite')
+    parser.add_argument('--db-detecciones', action='store_true',
+                        help='Guardar también cada detección de cada frame (no solo eventos y tracks)')
+
+
+def desde_argumentos(args, camara=""):
+    if not args.db:
+        return None
+    return AlmacenDetecciones(args.db, camara=camara)
+
+
+# -----------------------------------------------------------------------------------------------
+# CLI: consulta y benchmark
+# -----------------------------------------------------------------------------------------------
+def _consultar(args):
+    if not os.path.exists(args.db):
+        print(f"❌ No existe la base {args.db}")
+        sys.exit(1)
+    conexion = abrir(args.db, solo_lectura=True)
+    filtros = dict(desde=args.desde, hasta=args.hasta, camara=args.camara)
+    try:
+        total = contar(conexion, args.tabla, clase=args.clase, **filtros)
+        rango = f"{_texto_instante(args.desde) if args.desde else '-∞'} → " \
+                f"{_texto_instante(args.hasta) if args.hasta else 'ahora'}"
+        print(f"📊 {args.tabla}{f' de {args.clase}' if args.clase else ''} ({rango}): {total}")
+        if args.clase is None:
+            for clase, n in por_clase(conexion, args.tabla, **filtros):
+                print(f"   {clase}: {n}")
+        if args.por_hora:
+            for hora, n in por_hora(conexion, args.tabla, clase=args.clase, **filtros):
+                print(f"   {hora}  {n}")
+        if args.listar:
+            for evento in eventos(conexion, clase=args.clase, limite=args.listar, **filtros):
+                print(f"   {_texto_instante(evento['instante'])} {evento['camara']} {evento['tipo']} "
+                      f"#{evento['track_id']} {evento['clase']} {evento['confianza'] or 0:.2f} "
+                      f"{evento['imagen'] or ''} {evento['imagen_hd'] or ''} {evento['clip'] or ''}")
+    finally:
+        conexion.close()
+
+
+class _DeteccionesSinteticas:
+    """Lo mínimo de detecciones.Detecciones que usa registrar_detecciones"""
+
+    def __init__(self, etiquetas, confianza, xyxy, track_id):
+        self._etiquetas = etiquetas
+        self.confianza = confianza
+        self.xyxy = xyxy
+        self.track_id = track_id
+
+    def __len__(self):
+        return len(self.confianza)
+
+    def etiquetas(self):
+        return self._etiquetas
+
+
+def _benchmark(args):
+    clases = ["car", "truck", "bus", "motorbike"]
+    rng = np.random.default_rng(0)
+    directorio = tempfile.mkdtemp(prefix="bench_almacen_")
+    path = os.path.join(directorio, "detecciones.db")
+    frames = args.filas // args.por_frame
+    # Un día de tráfico comprimido en frames equiespaciados, a partir de hoy a las 00:00
+    inicio_dia = datetime.datetime.combine(datetime.date.today(), datetime.time()).timestamp()
+    paso = 86400.0 / frames
+
+    # Frames sintéticos precalculados: el benchmark mide la base, no a NumPy
+    variantes = []
+    for _ in range(64):
+        xy = rng.uniform(0, 600, (args.por_frame, 2))
+        variantes.append(_DeteccionesSinteticas(
+            [clases[i] for i in rng.integers(0, len(clases), args.por_frame)],
+            rng.uniform(0.3, 1.0, args.por_frame).astype(np.float32),
+            np.hstack([xy, xy + rng.uniform(20, 200, (args.por_frame, 2))]).astype(np.float32),
+            rng.integers(1, 1000, args.por_frame)))
+
+    almacen = AlmacenDetecciones(path, camara="/dev/video0", lote=args.lote,
+                                 max_cola=args.max_cola)
+    almacen.iniciar()
+    t_llamadas = 0.0
+    inicio = time.perf_counter()
+    try:
+        for f in range(frames):
+            instante = inicio_dia + f * paso
+            detecciones = variantes[f % len(variantes)]
+            t0 = time.perf_counter()
+            almacen.registrar_detecciones(instante, detecciones, frame=f)
+            if f % args.eventos_cada == 0:
+                clase = detecciones.etiquetas()[0]
+                nombre = datetime.datetime.fromtimestamp(instante).strftime('%Y%m%d_%H%M%S_%f')
+                almacen.registrar_evento(instante, "captura", nombre, track_id=f, clase=clase,
+                                         confianza=0.9, caja=detecciones.xyxy[0],
+                                         imagen=f"frame_{f:04d}_{clase}_0.900.jpg",
+                                         imagen_hd=f"captura_hd_{nombre}.jpg")
+                almacen.registrar_track(f, clase, instante - 2.0, instante, 30, 0.9, nombre)
+            t_llamadas += time.perf_counter() - t0
+            while almacen.cola.full():
+                # El benchmark mide el ritmo sostenido: no descartar, esperar al escritor
+                time.sleep(0.001)
+        almacen.detener(timeout=600)
+        t_total = time.perf_counter() - inicio
+
+        estadisticas = almacen.estadisticas()
+        print(f"📊 Inserción: {estadisticas['escritas']} filas en {t_total:.2f} s "
+              f"({estadisticas['escritas'] / t_total:,.0f} filas/s, "
+              f"{estadisticas['transacciones']} transacciones)")
+        print(f"📊 Llamada en el callback: {t_llamadas * 1e6 / frames:.1f} µs/frame "
+              f"({args.por_frame} detecciones)")
+        print(f"📊 Base: {os.path.getsize(path) / 1e6:.1f} MB "
+              f"(+{os.path.getsize(path + '-wal') / 1e6 if os.path.exists(path + '-wal') else 0:.1f} MB WAL)")
+
+        conexion = abrir(path, solo_lectura=True)
+        ocho, nueve = inicio_dia + 8 * 3600, inicio_dia + 9 * 3600
+        consultas = [
+            ("camiones 8-9 h (detecciones)",
+             lambda: contar(conexion, "detecciones", "truck", ocho, nueve)),
+            ("camiones 8-9 h (eventos)", lambda: contar(conexion, "eventos", "truck", ocho, nueve)),
+            ("camiones 8-9 h (tracks)", lambda: contar(conexion, "tracks", "truck", ocho, nueve)),
+            ("por clase 8-9 h (detecciones)", lambda: por_clase(conexion, "detecciones", ocho, nueve)),
+            ("por hora del día (eventos)", lambda: por_hora(conexion, "eventos")),
+            ("últimos 20 eventos de bus", lambda: eventos(conexion, "bus", limite=20)),
+        ]
+        for nombre, consulta in consultas:
+            t0 = time.perf_counter()
+            resultado = consulta()
+            ms = (time.perf_counter() - t0) * 1000
+            resumen = resultado if isinstance(resultado, int) else f"{len(resultado)} filas"
+            print(f"📊 {nombre}: {resumen} en {ms:.2f} ms")
+        conexion.close()
+        ok = estadisticas["escritas"] == estadisticas["encoladas"] and not estadisticas["errores"]
+        print("✅ Todas las filas insertadas" if ok else f"❌ Faltan filas: {estadisticas}")
+        return ok
+    finally:
+        almacen.detener()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Base SQLite de detecciones: consultas y benchmark')
+    subparsers = parser.add_subparsers(dest='accion', required=True)
+
+    consulta = subparsers.add_parser('consulta', help='Contar y listar detecciones, tracks o eventos')
+    consulta.add_argument('--db', required=True)
+    consulta.add_argument('--tabla', default='eventos', choices=list(_COLUMNA_TIEMPO),
+                          help='eventos y tracks cuentan vehículos; detecciones cuenta cajas por frame')
+    consulta.add_argument('--clase', help='car, truck, bus...')
+    consulta.add_argument('--camara')
+    consulta.add_argument('--desde', type=instante_desde_texto, help="'YYYY-MM-DD HH:MM' o 'HH:MM' (hoy)")
+    consulta.add_argument('--hasta', type=instante_desde_texto)
+    consulta.add_argument('--por-hora', action='store_true', help='Desglose por hora')
+    consulta.add_argument('--listar', type=int, default=0, metavar='N',
+                          help='Mostrar los últimos N eventos con sus archivos')
+
+    benchmark = subparsers.add_parser('benchmark', help='Throughput de inserción y consultas')
+    benchmark.add_argument('--filas', type=int, default=2_000_000, help='Detecciones a insertar')
+    benchmark.add_argument('--por-frame', type=int, default=4, help='Detecciones por frame')
+    benchmark.add_argument('--eventos-cada', type=int, default=50,
+                           help='Un evento y un track cada N frames')
+    benchmark.add_argument('--lote', type=int, default=5000)
+    benchmark.add_argument('--max-cola', type=int, default=1024)
+    args = parser.parse_args()
+
+    if args.accion == 'consulta':
+        _consultar(args)
+    else:
+        sys.exit(0 if _benchmark(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import platform
+import argparse
+import tempfile
+import importlib
+import tracemalloc
+
+import numpy as np
+
+from detecciones import ROISimulado, DeteccionSimulada, CLASES_COCO
+from tracker import cargar_secuencia, generar_secuencia
+
+# -----------------------------------------------------------------------------------------------
+# Entorno simulado: sin cámara, sin NPU y, si hace falta, sin GStreamer
+# -----------------------------------------------------------------------------------------------
+def _hailo_simulado():
+    """Módulo hailo mínimo: el ROI viaja dentro del buffer simulado"""
+    modulo = types.ModuleType("hailo")
+    modulo.HAILO_DETECTION = "HAILO_DETECTION"
+    modulo.HAILO_UNIQUE_ID = "HAILO_UNIQUE_ID"
+    modulo.get_roi_from_buffer = lambda buffer: buffer.roi
+    return modulo
+
+
+def _gi_simulado():
+    """Paquete gi mínimo con las constantes de Gst que usan los callbacks"""
+    gst = types.SimpleNamespace(
+        PadProbeReturn=types.SimpleNamespace(OK=0, DROP=1, PASS=2),
+        PadProbeType=types.SimpleNamespace(BUFFER=1),
+        MapFlags=types.SimpleNamespace(READ=1),
+        CLOCK_TIME_NONE=2 ** 64 - 1,
+        init=lambda argv: None,
+    )
+    repositorio = types.ModuleType("gi.repository")
+    repositorio.Gst = gst
+    repositorio.GLib = types.SimpleNamespace()
+    repositorio.GstVideo = None
+    gi = types.ModuleType("gi")
+    gi.require_version = lambda nombre, version: None
+    gi.repository = repositorio
+    return gi, repositorio
+
+
+def preparar_entorno():
+    """Instalar hailo (y gi si no está) simulados antes de importar los scripts"""
+    if "hailo" not in sys.modules:
+        try:
+            import hailo  # noqa: F401
+        except ImportError:
+            sys.modules["hailo"] = _hailo_simulado()
+    try:
+        import gi  # noqa: F401
+        from gi.repository import Gst  # noqa: F401
+    except (ImportError, ValueError):
+        gi, repositorio = _gi_simulado()
+        sys.modules["gi"] = gi
+        sys.modules["gi.repository"] = repositorio
+
+
+class _MapInfo:
+    def __init__(self, data):
+        self.data = data
+
+
+class BufferSimulado:
+    """Imita Gst.Buffer: map/unmap sobre el frame y el ROI de hailo adjunto"""
+
+    def __init__(self, frame, roi, pts):
+        self.frame = frame
+        self.roi = roi
+        self.pts = pts
+
+    def map(self, flags):
+        return True, _MapInfo(memoryview(self.frame).cast("B"))
+
+    def unmap(self, map_info):
+        pass
+
+
+class _Estructura:
+    def __init__(self, formato, ancho, alto):
+        self._valores = {"format": formato, "width": ancho, "height": alto}
+
+    def get_string(self, nombre):
+        return self._valores[nombre]
+
+    def get_int(self, nombre):
+        return True, self._valores[nombre]
+
+
+class _Caps:
+    def __init__(self, formato, ancho, alto):
+        self._estructura = _Estructura(formato, ancho, alto)
+
+    def get_structure(self, indice):
+        return self._estructura
+
+
+class PadSimulado:
+    def __init__(self, formato="RGB", ancho=640, alto=640):
+        self._caps = _Caps(formato, ancho, alto)
+
+    def get_current_caps(self):
+        return self._caps
+
+
+class InfoSimulada:
+    def __init__(self, buffer):
+        self._buffer = buffer
+
+    def get_buffer(self):
+        return self._buffer
+
+
+# -----------------------------------------------------------------------------------------------
+# Fuentes de frames y de detecciones
+# -----------------------------------------------------------------------------------------------
+def frames_sinteticos(cantidad=16, ancho=640, alto=640, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 255, (alto, ancho, 3), dtype=np.uint8) for _ in range(cantidad)]
+
+
+def frames_de_video(path, maximo=300, ancho=640, alto=640):
+    """Leer un video grabado y llevarlo al formato que ve el callback (RGB 640x640)"""
+    import cv2
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < maximo:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frame = cv2.resize(frame, (ancho, alto))
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    cap.release()
+    if not frames:
+        raise ValueError(f"No se pudieron leer frames de {path}")
+    return frames
+
+
+_IDS_COCO = {nombre: cid for cid, nombre in CLASES_COCO.items()}
+
+
+def rois_de_secuencia(secuencia):
+    """Convertir una secuencia [x1, y1, x2, y2, confianza, clase] por frame en ROIs simulados"""
+    rois = []
+    for dets in secuencia:
+        rois.append(ROISimulado([
+            DeteccionSimulada(d[5], _IDS_COCO.get(d[5], 0), d[4], (d[0], d[1], d[2] - d[0], d[3] - d[1]))
+            for d in dets
+        ]))
+    return rois
+
+
+# -----------------------------------------------------------------------------------------------
+# Cronometraje por etapa
+# -----------------------------------------------------------------------------------------------
+class Etapas:
+    """Acumula tiempo de CPU del hilo por etapa envolviendo funciones de un módulo"""
+
+    def __init__(self):
+        self.tiempos = {}
+        self.llamadas = {}
+        self._originales = []
+
+    def envolver(self, objeto, nombre, etapa=None):
+        original = getattr(objeto, nombre, None)
+        if original is None:
+            return
+        etapa = etapa or nombre
+        tiempos = self.tiempos
+        llamadas = self.llamadas
+        tiempos.setdefault(etapa, 0)
+        llamadas.setdefault(etapa, 0)
+
+        def cronometrada(*args, **kwargs):
+            inicio = time.thread_time_ns()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                tiempos[etapa] += time.thread_time_ns() - inicio
+                llamadas[etapa] += 1
+
+        setattr(objeto, nombre, cronometrada)
+        self._originales.append((objeto, nombre, original))
+
+    def restaurar(self):
+        for objeto, nombre, original in reversed(self._originales):
+            setattr(objeto, nombre, original)
+        self._originales = []
+
+
+class EscritorNulo:
+    """Sustituto del pool de escritura cuando el guardado está desactivado"""
+
+    def __init__(self):
+        self.encolados = 0
+
+    def encolar(self, frame, detecciones, carpeta, copiar=True):
+        self.encolados += 1
+        return True
+
+    def detener(self):
+        pass
+
+    def estadisticas(self):
+        return {"encolados": self.encolados}
+
+
+# -----------------------------------------------------------------------------------------------
+# Escenarios: un callback real con su user_data configurado
+# -----------------------------------------------------------------------------------------------
+def escenario_detection(config, directorio):
+    """app_callback de detection.py"""
+    detection = importlib.import_module("detection")
+    from escritor_imagenes import EscritorImagenes
+    from tracker import RastreadorIoU
+
+    user_data = detection.app_callback_class()
+    user_data.use_frame = config.get("frames", True)
+    user_data.confidence_threshold = config.get("umbral", 0.3)
+    user_data.carpeta = os.path.join(directorio, "detections")
+    if config.get("guardar", True):
+        user_data.escritor = EscritorImagenes()
+        user_data.escritor.iniciar()
+    else:
+        user_data.escritor = EscritorNulo()
+    if config.get("modo", "por_vehiculo") == "por_vehiculo":
+        user_data.rastreador = RastreadorIoU()
+
+    etapas = Etapas()
+    etapas.envolver(detection, "mapear_frame", "extraccion_frame")
+    etapas.envolver(detection, "extraer_detecciones", "detecciones")
+    etapas.envolver(detection, "guardar_por_vehiculo", "tracker_y_guardado")
+    etapas.envolver(detection, "guardar_cada_deteccion", "guardado")
+    etapas.envolver(user_data.escritor, "encolar", "encolar_escritor")
+
+    def cerrar():
+        if user_data.rastreador is not None:
+            for track in user_data.rastreador.finalizar():
+                detection.emitir_captura(track, user_data)
+        user_data.escritor.detener()
+        etapas.restaurar()
+        return user_data.escritor.estadisticas()
+
+    return detection.app_callback, user_data, etapas, cerrar
+
+
+def escenario_simple(config, directorio):
+    """app_callback de simple_hailo_test.py"""
+    simple = importlib.import_module("simple_hailo_test")
+    user_data = simple.user_app_callback_class()
+    user_data.use_frame = config.get("frames", False)
+    user_data.confidence_threshold = config.get("umbral", 0.3)
+
+    etapas = Etapas()
+    etapas.envolver(simple, "get_numpy_from_buffer", "extraccion_frame")
+    etapas.envolver(simple, "extraer_detecciones", "detecciones")
+
+    def cerrar():
+        etapas.restaurar()
+        return {"detecciones": user_data.detection_count}
+
+    return simple.app_callback, user_data, etapas, cerrar
+
+
+ESCENARIOS = {
+    "detection": escenario_detection,
+    "simple": escenario_simple,
+}
+
+CONFIGURACIONES = [
+    {"nombre": "detection_completo", "script": "detection", "frames": True, "guardar": True},
+    {"nombre": "detection_sin_guardar", "script": "detection", "frames": True, "guardar": False},
+    {"nombre": "detection_sin_frames", "script": "detection", "frames": False, "guardar": False},
+    {"nombre": "detection_cada_deteccion", "script": "detection", "frames": True, "guardar": True,
+     "modo": "cada_deteccion"},
+    {"nombre": "detection_umbral_0.6", "script": "detection", "frames": True, "guardar": True,
+     "umbral": 0.6},
+    {"nombre": "simple_sin_frames", "script": "simple", "frames": False},
+    {"nombre": "simple_con_frames", "script": "simple", "frames": True},
+]
+
+
+def ejecutar(config, frames, rois, repeticiones=1, medir_memoria=True):
+    """Reproducir frames y detecciones por el callback y devolver las métricas"""
+    directorio = tempfile.mkdtemp(prefix="bench_callback_")
+    pad = PadSimulado("RGB", frames[0].shape[1], frames[0].shape[0])
+    total = len(rois) * repeticiones
+    buffers = (BufferSimulado(frames[i % len(frames)], rois[i % len(rois)], i * 66_666_666)
+               for i in range(total))
+    try:
+        callback, user_data, etapas, cerrar = ESCENARIOS[config["script"]](config, directorio)
+        cpu_inicio = time.process_time()
+        inicio = time.perf_counter()
+        for buffer in buffers:
+            callback(pad, InfoSimulada(buffer), user_data)
+        duracion = time.perf_counter() - inicio
+        cpu = time.process_time() - cpu_inicio
+        extra = cerrar()
+
+        resultado = {
+            "nombre": config["nombre"],
+            "config": config,
+            "callbacks": total,
+            "callbacks_por_segundo": round(total / duracion, 1),
+            "us_por_callback": round(duracion * 1e6 / total, 2),
+            "cpu_proceso_us_por_callback": round(cpu * 1e6 / total, 2),
+            "cpu_por_etapa_us": {
+                etapa: round(ns / 1000 / total, 2) for etapa, ns in etapas.tiempos.items()
+            },
+            "llamadas_por_etapa": dict(etapas.llamadas),
+            "resultado": extra,
+        }
+        if medir_memoria:
+            resultado.update(_medir_memoria(config, frames, rois, directorio))
+        return resultado
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def _medir_memoria(config, frames, rois, directorio):
+    """Segunda pasada con tracemalloc (lo hace más lento, por eso va aparte)"""
+    pad = PadSimulado("RGB", frames[0].shape[1], frames[0].shape[0])
+    callback, user_data, etapas, cerrar = ESCENARIOS[config["script"]](config, directorio)
+    tracemalloc.start()
+    antes = tracemalloc.take_snapshot()
+    for i, roi in enumerate(rois):
+        callback(pad, InfoSimulada(BufferSimulado(frames[i % len(frames)], roi, i)), user_data)
+    despues = tracemalloc.take_snapshot()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    cerrar()
+    diferencias = despues.compare_to(antes, "filename")
+    bloques = sum(d.count_diff for d in diferencias)
+    return {
+        "pico_memoria_kib": round(pico / 1024, 1),
+        "bloques_netos_por_callback": round(bloques / len(rois), 2),
+    }
+
+
+def comparar(actual, base, tolerancia):
+    """Listar las configuraciones cuyo costo por callback empeoró más que la tolerancia"""
+    previos = {r["nombre"]: r for r in base.get("resultados", [])}
+    regresiones = []
+    for r in actual["resultados"]:
+        previo = previos.get(r["nombre"])
+        if previo is None:
+            continue
+        cambio = r["us_por_callback"] / previo["us_por_callback"] - 1.0
+        if cambio > tolerancia:
+            regresiones.append({"nombre": r["nombre"], "antes_us": previo["us_por_callback"],
+                                "ahora_us": r["us_por_callback"], "cambio": round(cambio, 3)})
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline de los callbacks (sin cámara ni NPU)')
+    parser.add_argument('--video', help='Video grabado a reproducir (por defecto, frames sintéticos)')
+    parser.add_argument('--detecciones', help='JSONL de detecciones por frame (por defecto, sintéticas)')
+    parser.add_argument('--frames', type=int, default=600, help='Frames de la secuencia sintética')
+    parser.add_argument('--repeticiones', type=int, default=1)
+    parser.add_argument('--config', action='append',
+                        help='Nombre de configuración a correr (se puede repetir; por defecto, todas)')
+    parser.add_argument('--sin-memoria', action='store_true', help='Omitir la pasada con tracemalloc')
+    parser.add_argument('--salida', help='Archivo JSON del reporte (por defecto, stdout)')
+    parser.add_argument('--comparar', help='Reporte anterior contra el cual buscar regresiones')
+    parser.add_argument('--tolerancia', type=float, default=0.10,
+                        help='Empeoramiento relativo admitido antes de marcar regresión')
+    args = parser.parse_args()
+
+    preparar_entorno()
+    from eventos import configurar_eventos
+    configurar_eventos("off")
+
+    frames = frames_de_video(args.video) if args.video else frames_sinteticos()
+    if args.detecciones:
+        secuencia = cargar_secuencia(args.detecciones)
+    else:
+        secuencia = generar_secuencia(vehiculos=max(1, args.frames // 30), frames=args.frames,
+                                      duracion=min(45, max(1, args.frames // 2)))
+    rois = rois_de_secuencia(secuencia)
+
+    configuraciones = [c for c in CONFIGURACIONES if not args.config or c["nombre"] in args.config]
+    reporte = {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "maquina": platform.machine(),
+        "frames": len(rois),
+        "detecciones": sum(len(d) for d in secuencia),
+        "resultados": [],
+    }
+    for config in configuraciones:
+        print(f"⏱️  {config['nombre']}...", file=sys.stderr)
+        reporte["resultados"].append(
+            ejecutar(config, frames, rois, args.repeticiones, not args.sin_memoria))
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            reporte["regresiones"] = comparar(reporte, json.load(f), args.tolerancia)
+
+    texto = json.dumps(reporte, indent=1, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w") as f:
+            f.write(texto)
+    else:
+        print(texto)
+    if reporte.get("regresiones"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Encabezado global del segmento
+_MAGICO = 0x48424653  # "HBFS"
+_VERSION = 1
+_GLOBAL = np.dtype([("magico", "<u4"), ("version", "<u4"), ("slots", "<u4"), ("ancho", "<u4"),
+                    ("alto", "<u4"), ("canales", "<u4"), ("max_detecciones", "<u4"),
+                    ("tam_slot", "<u4"), ("ultimo", "<u8")])
+# Encabezado de cada slot. secuencia es un seqlock: 2n-1 mientras se escribe el frame n, 2n al terminar
+_SLOT = np.dtype([("secuencia", "<u8"), ("pts", "<i8"), ("instante", "<f8"), ("alto", "<u4"),
+                  ("ancho", "<u4"), ("canales", "<u4"), ("detecciones", "<u4")])
+# Cada detección: x1, y1, x2, y2, confianza, class_id, track_id
+COLUMNAS = 7
+
+POLITICAS = ("ultimo", "secuencial")
+
+
+def _alinear(valor, multiplo=64):
+    return (valor + multiplo - 1) // multiplo * multiplo
+
+
+def _diseno(ancho, alto, canales, max_detecciones):
+    """Offsets dentro de un slot: encabezado, detecciones y frame (alineados a 64 bytes)"""
+    o_detecciones = _alinear(_SLOT.itemsize)
+    o_frame = _alinear(o_detecciones + max_detecciones * COLUMNAS * 4)
+    return o_detecciones, o_frame, _alinear(o_frame + ancho * alto * canales)
+
+
+def _adjuntar(nombre):
+    """Abrir un segmento existente sin registrarlo en el resource_tracker
+
+    Antes de Python 3.13 abrir un segmento lo registra como propio y el
+    tracker lo borra al salir el suscriptor (bpo-39959); desregistrarlo
+    después rompe al publicador si comparten tracker (procesos hijos).
+    """
+    try:
+        return shared_memory.SharedMemory(name=nombre, track=False)
+    except TypeError:
+        pass
+    from multiprocessing import resource_tracker
+    registrar = resource_tracker.register
+    resource_tracker.register = lambda *args, **kwargs: None
+    try:
+        return shared_memory.SharedMemory(name=nombre)
+    finally:
+        resource_tracker.register = registrar
+
+
+class _Segmento:
+    """Vistas de NumPy sobre el segmento compartido (encabezado y slots)"""
+
+    def __init__(self, shm, slots, ancho, alto, canales, max_detecciones):
+        self.shm = shm
+        self.slots = slots
+        o_detecciones, o_frame, self.tam_slot = _diseno(ancho, alto, canales, max_detecciones)
+        base = _alinear(_GLOBAL.itemsize)
+        self.global_ = np.ndarray((), dtype=_GLOBAL, buffer=shm.buf)
+        self.encabezados = []
+        self.detecciones = []
+        self.frames = []
+        for i in range(slots):
+            inicio = base + i * self.tam_slot
+            self.encabezados.append(np.ndarray((), dtype=_SLOT, buffer=shm.buf, offset=inicio))
+            self.detecciones.append(np.ndarray((max_detecciones, COLUMNAS), dtype=np.float32,
+                                               buffer=shm.buf, offset=inicio + o_detecciones))
+            self.frames.append(np.ndarray((alto, ancho, canales), dtype=np.uint8,
+                                          buffer=shm.buf, offset=inicio + o_frame))
+
+    @staticmethod
+    def tamano(slots, ancho, alto, canales, max_detecciones):
+        return _alinear(_GLOBAL.itemsize) + slots * _diseno(ancho, alto, canales, max_detecciones)[2]
+
+    def liberar(self):
+        # Las vistas tienen que desaparecer antes de cerrar el mmap
+        self.global_ = None
+        self.encabezados = self.detecciones = self.frames = []
+
+
+def matriz_detecciones(detecciones):
+    """Detecciones (o un array Nx4..7) -> float32 Nx7 como se publica"""
+    if detecciones is None:
+        return np.zeros((0, COLUMNAS), dtype=np.float32)
+    if hasattr(detecciones, "xyxy"):
+        matriz = np.empty((len(detecciones), COLUMNAS), dtype=np.float32)
+        matriz[:, :4] = detecciones.xyxy
+        matriz[:, 4] = detecciones.confianza
+        matriz[:, 5] = detecciones.class_id
+        matriz[:, 6] = detecciones.track_id
+        return matriz
+    matriz = np.zeros((len(detecciones), COLUMNAS), dtype=np.float32)
+    datos = np.asarray(detecciones, dtype=np.float32).reshape(len(detecciones), -1)
+    matriz[:, :datos.shape[1]] = datos[:, :COLUMNAS]
+    return matriz
+
+
+class PublicadorFrames:
+    """Publica frames y detecciones en un anillo de memoria compartida
+
+    Un solo proceso publica; nunca espera a los suscriptores: si uno se atrasa
+    más que la cantidad de slots, pierde frames (ver SuscriptorFrames). Cada
+    publicación copia el frame una vez al slot; los suscriptores lo leen sin copiar.
+    """
+
+    def __init__(self, nombre="hailo_frames", ancho=640, alto=640, canales=3, slots=8,
+                 max_detecciones=64):
+        self.nombre = nombre
+        self.max_detecciones = max_detecciones
+        tamano = _Segmento.tamano(slots, ancho, alto, canales, max_detecciones)
+        try:
+            self.shm = shared_memory.SharedMemory(name=nombre, create=True, size=tamano)
+        except FileExistsError:
+            # Segmento de una ejecución anterior que no se cerró bien
+            viejo = _adjuntar(nombre)
+            viejo.close()
+            viejo.unlink()
+            self.shm = shared_memory.SharedMemory(name=nombre, create=True, size=tamano)
+        self.segmento = _Segmento(self.shm, slots, ancho, alto, canales, max_detecciones)
+        g = self.segmento.global_
+        g["slots"], g["ancho"], g["alto"], g["canales"] = slots, ancho, alto, canales
+        g["max_detecciones"], g["tam_slot"], g["ultimo"] = max_detecciones, self.segmento.tam_slot, 0
+        g["version"] = _VERSION
+        # El número mágico va al final: un suscriptor que lo ve puede confiar en el resto
+        g["magico"] = _MAGICO
+        self.publicados = 0
+        self.recortadas = 0
+
+    def publicar(self, frame, detecciones=None, pts=0, instante=None):
+        """Copiar el frame (alto x ancho x canales, o menor) y las detecciones al próximo slot"""
+        n = self.publicados + 1
+        indice = (n - 1) % self.segmento.slots
+        encabezado = self.segmento.encabezados[indice]
+        matriz = matriz_detecciones(detecciones)
+        if len(matriz) > self.max_detecciones:
+            self.recortadas += len(matriz) - self.max_detecciones
+            matriz = matriz[:self.max_detecciones]
+
+        alto, ancho = frame.shape[:2]
+        canales = frame.shape[2] if frame.ndim == 3 else 1
+        destino = self.segmento.frames[indice]
+        if alto > destino.shape[0] or ancho > destino.shape[1] or canales != destino.shape[2]:
+            raise ValueError(f"Frame {frame.shape} no entra en el slot {destino.shape}")
+
+        encabezado["secuencia"] = 2 * n - 1
+        destino[:alto, :ancho] = frame.reshape(alto, ancho, canales)
+        self.segmento.detecciones[indice][:len(matriz)] = matriz
+        encabezado["pts"] = pts
+        encabezado["instante"] = time.time() if instante is None else instante
+        encabezado["alto"], encabezado["ancho"], encabezado["canales"] = alto, ancho, canales
+        encabezado["detecciones"] = len(matriz)
+        encabezado["secuencia"] = 2 * n
+        self.segmento.global_["ultimo"] = n
+        self.publicados = n
+        return n
+
+    def cerrar(self):
+        self.segmento.liberar()
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class FrameCompartido:
+    """Frame leído del bus: vistas sin copia sobre el slot
+
+    Las vistas pueden quedar pisadas si el publicador da la vuelta al anillo;
+    valida() dice si el slot todavía tiene este frame (chequear después de usarlo)
+    y copiar() devuelve arrays propios o None si ya se pisó.
+    """
+
+    __slots__ = ("secuencia", "pts", "instante", "frame", "detecciones", "_encabezado")
+
+    def __init__(self, secuencia, pts, instante, frame, detecciones, encabezado):
+        self.secuencia = secuencia
+        self.pts = pts
+        self.instante = instante
+        self.frame = frame
+        self.detecciones = detecciones
+        self._encabezado = encabezado
+
+    def valida(self):
+        return int(self._encabezado["secuencia"]) == 2 * self.secuencia
+
+    def copiar(self):
+        frame, detecciones = self.frame.copy(), self.detecciones.copy()
+        return (frame, detecciones) if self.valida() else None
+
+
+class SuscriptorFrames:
+    """Lector de un PublicadorFrames desde otro proceso
+
+    politica="ultimo" entrega siempre el frame más nuevo (un lector lento
+    saltea los intermedios); "secuencial" entrega todos en orden mientras el
+    lector no quede más de slots - 1 frames atrás, y si queda, salta al más
+    viejo que sigue en el anillo. En ambos casos perdidos cuenta los salteados.
+    """
+
+    def __init__(self, nombre="hailo_frames", politica="ultimo", espera=0.0005):
+        if politica not in POLITICAS:
+            raise ValueError(f"Política no válida: {politica}")
+        self.politica = politica
+        self.espera = espera
+        self.shm = _adjuntar(nombre)
+        g = np.ndarray((), dtype=_GLOBAL, buffer=self.shm.buf)
+        if int(g["magico"]) != _MAGICO or int(g["version"]) != _VERSION:
+            self.shm.close()
+            raise RuntimeError(f"{nombre} no es un bus de frames compatible")
+        self.segmento = _Segmento(self.shm, int(g["slots"]), int(g["ancho"]), int(g["alto"]),
+                                  int(g["canales"]), int(g["max_detecciones"]))
+        del g
+        self.siguiente_secuencia = int(self.segmento.global_["ultimo"]) + 1
+        self.leidos = 0
+        self.perdidos = 0
+        self.pisados = 0
+
+    def _leer(self, n):
+        """Seqlock: encabezado estable antes y después; None si el slot no tiene el frame n"""
+        indice = (n - 1) % self.segmento.slots
+        encabezado = self.segmento.encabezados[indice]
+        if int(encabezado["secuencia"]) != 2 * n:
+            return None
+        alto, ancho = int(encabezado["alto"]), int(encabezado["ancho"])
+        lectura = FrameCompartido(n, int(encabezado["pts"]), float(encabezado["instante"]),
+                                  self.segmento.frames[indice][:alto, :ancho],
+                                  self.segmento.detecciones[indice][:int(encabezado["detecciones"])],
+                                  encabezado)
+        return lectura if lectura.valida() else None
+
+    def siguiente(self, timeout=None):
+        """Próximo frame según la política, o None si no llegó ninguno antes del timeout"""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ultimo = int(self.segmento.global_["ultimo"])
+            if ultimo >= self.siguiente_secuencia:
+                if self.politica == "ultimo":
+                    n = ultimo
+                else:
+                    n = max(self.siguiente_secuencia, ultimo - self.segmento.slots + 2)
+                lectura = self._leer(n)
+                if lectura is not None:
+                    self.perdidos += n - self.siguiente_secuencia
+                    self.siguiente_secuencia = n + 1
+                    self.leidos += 1
+                    return lectura
+                # El publicador pisó el slot mientras lo leíamos: reintentar con el estado nuevo
+                self.pisados += 1
+                continue
+            if limite is not None and time.monotonic() >= limite:
+                return None
+            time.sleep(self.espera)
+
+    def estadisticas(self):
+        return {"leidos": self.leidos, "perdidos": self.perdidos, "pisados": self.pisados}
+
+    def cerrar(self):
+        self.segmento.liberar()
+        self.shm.close()
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--bus-frames', metavar='NOMBRE',
+                        help='Publicar frames y detecciones en memoria compartida para otros procesos')
+    parser.add_argument('--bus-slots', type=int, default=8,
+                        help='Frames que guarda el anillo compartido')
+
+
+# -----------------------------------------------------------------------------------------------
+# Benchmark: publicación y consumo con frames RGB sintéticos de 640x640
+# -----------------------------------------------------------------------------------------------
+def _suscriptor(nombre, politica, trabajo_ms, segundos, resultados, indice):
+    suscriptor = SuscriptorFrames(nombre, politica)
+    fin = time.monotonic() + segundos
+    pisados_tras_uso = 0
+    suma = 0
+    try:
+        while time.monotonic() < fin:
+            lectura = suscriptor.siguiente(timeout=0.5)
+            if lectura is None:
+                continue
+            # "Análisis" sobre la vista sin copiar
+            suma += int(lectura.frame[::64, ::64, 0].sum()) + len(lectura.detecciones)
+            if trabajo_ms:
+                time.sleep(trabajo_ms / 1000)
+            if not lectura.valida():
+                pisados_tras_uso += 1
+        estadisticas = suscriptor.estadisticas()
+        estadisticas["fps"] = round(suscriptor.leidos / segundos, 1)
+        estadisticas["pisados_tras_uso"] = pisados_tras_uso
+        estadisticas["politica"] = politica
+        estadisticas["trabajo_ms"] = trabajo_ms
+        resultados[indice] = estadisticas
+    finally:
+        suscriptor.cerrar()
+
+
+def _baseline_cola(frames, segundos):
+    """multiprocessing.Queue con pickle: lo que costaría mandar cada frame copiado"""
+    import multiprocessing as mp
+    cola = mp.Queue(maxsize=8)
+    consumidor = mp.Process(target=_consumir_cola, args=(cola,))
+    consumidor.start()
+    enviados = 0
+    fin = time.monotonic() + segundos
+    while time.monotonic() < fin:
+        cola.put(frames[enviados % len(frames)])
+        enviados += 1
+    cola.put(None)
+    consumidor.join()
+    return enviados / segundos
+
+
+def _consumir_cola(cola):
+    while cola.get() is not None:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Publicación y consumo del bus de frames en memoria compartida')
+    parser.add_argument('--segundos', type=float, default=3.0)
+    parser.add_argument('--fps', type=float, default=0, help='Ritmo de publicación (0 = lo más rápido posible)')
+    parser.add_argument('--slots', type=int, default=8)
+    parser.add_argument('--lentos', type=int, default=1, help='Suscriptores con 50 ms de trabajo por frame')
+    parser.add_argument('--rapidos', type=int, default=2, help='Suscriptores sin trabajo extra')
+    args = parser.parse_args()
+
+    import multiprocessing as mp
+    nombre = f"bench_bus_{os.getpid()}"
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (640, 640, 3), dtype=np.uint8) for _ in range(4)]
+    detecciones = rng.uniform(0, 1, (10, COLUMNAS)).astype(np.float32)
+
+    publicador = PublicadorFrames(nombre, 640, 640, 3, args.slots)
+    gestor = mp.Manager()
+    resultados = gestor.dict()
+    configuracion = ([("secuencial", 0)] * args.rapidos + [("ultimo", 50)] * args.lentos
+                     + [("secuencial", 50)] * args.lentos)
+    procesos = [mp.Process(target=_suscriptor, args=(nombre, politica, trabajo, args.segundos,
+                                                     resultados, i))
+                for i, (politica, trabajo) in enumerate(configuracion)]
+    for proceso in procesos:
+        proceso.start()
+    time.sleep(0.5)
+
+    try:
+        periodo = 1.0 / args.fps if args.fps > 0 else 0.0
+        tiempo_publicar = 0.0
+        inicio = time.monotonic()
+        while time.monotonic() - inicio < args.segundos:
+            t0 = time.perf_counter()
+            publicador.publicar(frames[publicador.publicados % len(frames)], detecciones,
+                                pts=publicador.publicados)
+            tiempo_publicar += time.perf_counter() - t0
+            if periodo:
+                time.sleep(periodo)
+        duracion = time.monotonic() - inicio
+        for proceso in procesos:
+            proceso.join()
+    finally:
+        publicador.cerrar()
+
+    reporte = {
+        "publicados_fps": round(publicador.publicados / duracion, 1),
+        "us_por_publicacion": round(tiempo_publicar * 1e6 / publicador.publicados, 1),
+        "suscriptores": [resultados.get(i) for i in range(len(procesos))],
+        "cola_pickle_fps": round(_baseline_cola(frames, min(args.segundos, 2.0)), 1),
+    }
+    print(json.dumps(reporte, indent=1, ensure_ascii=False))
+    ok = all(r is not None and r["leidos"] > 0 for r in reporte["suscriptores"])
+    print("✅ Todos los suscriptores recibieron frames" if ok else "❌ Algún suscriptor no recibió frames")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
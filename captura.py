@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import argparse
+
+import letterbox
+import pipelines
+
+# GStreamer es opcional: armar los caminos y elegir por caps no lo necesita hasta validar
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+except (ImportError, ValueError):
+    Gst = None
+
+# Caminos de captura, del más barato al más caro para la CPU. Cada uno es
+# (formato pedido a la cámara, decodificador, conversión+escala en una pasada).
+# NV12 pesa 12 bits por píxel contra 16 de YUY2; videoconvertscale convierte y
+# escala en una sola pasada por el frame en lugar de dos; v4l2jpegdec decodifica
+# MJPEG en hardware donde existe. Los "clásicos" son para GStreamer < 1.22.
+CAMINOS = {
+    "nv12": ("NV12", None, True),
+    "yuy2": ("YUY2", None, True),
+    "mjpeg_hw": ("MJPEG", "v4l2jpegdec", True),
+    "nv12_clasico": ("NV12", None, False),
+    "yuy2_clasico": ("YUY2", None, False),
+    "mjpeg": ("MJPEG", "jpegdec", False),
+}
+
+
+def caps_camara(formato, ancho=640, alto=480, fps=15):
+    if formato == "MJPEG":
+        return f"image/jpeg,width={ancho},height={alto},framerate={fps}/1"
+    return f"video/x-raw,format={formato},width={ancho},height={alto},framerate={fps}/1"
+
+
+def camino(nombre, ancho=640, alto=480, fps=15):
+    """(caps de la cámara, elementos del preproceso hasta los caps del modelo)"""
+    formato, decodificador, combinado = CAMINOS[nombre]
+    preproceso = [decodificador] if decodificador else []
+    preproceso += letterbox.elementos_letterbox(combinado=combinado)
+    return caps_camara(formato, ancho, alto, fps), preproceso
+
+
+def candidatos(nombre, fuente, modo="auto", ancho=640, alto=480, fps=15, **kwargs):
+    """EspecPipeline por camino, en orden de costo (o solo el pedido); kwargs van a EspecPipeline"""
+    nombres = list(CAMINOS) if modo == "auto" else [modo]
+    caps_modelo = kwargs.pop("caps_modelo", None) or letterbox.caps_modelo(640, 640)
+    especs = []
+    for camino_nombre in nombres:
+        caps_fuente, preproceso = camino(camino_nombre, ancho, alto, fps)
+        especs.append(pipelines.EspecPipeline(
+            f"{nombre} ({camino_nombre})", fuente, caps_fuente=caps_fuente, preproceso=preproceso,
+            caps_modelo=caps_modelo, **kwargs))
+    return especs
+
+
+def elegir(especs):
+    """La primera especificación que pasa pipelines.validar
+
+    validar abre la cámara en READY y cruza sus caps con los pedidos, así que
+    un camino cuyo formato la cámara no ofrece (o cuyo elemento no está
+    instalado) se descarta sin negociar el pipeline completo.
+    """
+    for espec in especs:
+        error = pipelines.validar(espec)
+        if error is None:
+            return espec
+        print(f"⏭️  {espec.nombre}: {error}")
+    raise RuntimeError("Ningún camino de captura disponible")
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--captura', default='auto', choices=['auto'] + list(CAMINOS),
+                        help='Formato de la cámara y conversión: auto elige el más barato que '
+                             'ofrezca la cámara (NV12/YUY2 con videoconvertscale, MJPEG...)')
+
+
+# -----------------------------------------------------------------------------------------------
+# Benchmark sobre videotestsrc: fps y CPU de cada camino
+# -----------------------------------------------------------------------------------------------
+def _fuente_prueba(nombre, ancho, alto, frames):
+    """videotestsrc en el formato del camino; para MJPEG, codificado con jpegenc"""
+    formato, _, _ = CAMINOS[nombre]
+    fuente = f"videotestsrc num-buffers={frames} pattern=ball"
+    if formato == "MJPEG":
+        return [fuente, caps_camara("I420", ancho, alto, 30), "jpegenc", caps_camara("MJPEG", ancho, alto, 30)]
+    return [fuente, caps_camara(formato, ancho, alto, 30)]
+
+
+def _correr(cadena):
+    """(segundos de pared, segundos de CPU del proceso) hasta el EOS"""
+    pipeline = Gst.parse_launch(cadena)
+    bus = pipeline.get_bus()
+    pared, cpu = time.perf_counter(), time.process_time()
+    pipeline.set_state(Gst.State.PLAYING)
+    mensaje = bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pared, cpu = time.perf_counter() - pared, time.process_time() - cpu
+    pipeline.set_state(Gst.State.NULL)
+    if mensaje.type == Gst.MessageType.ERROR:
+        err, _ = mensaje.parse_error()
+        raise RuntimeError(err.message)
+    return pared, cpu
+
+
+def medir_camino(nombre, ancho, alto, frames, hilos=0, fps_objetivo=15):
+    """fps sin límite y CPU por frame del preproceso, descontando lo que cuesta la fuente de prueba"""
+    fuente = _fuente_prueba(nombre, ancho, alto, frames)
+    _, preproceso = camino(nombre, ancho, alto)
+    sink = "fakesink sync=false"
+    base = " ! ".join(fuente + [sink])
+    completa = " ! ".join(fuente + preproceso + [letterbox.caps_modelo(640, 640), sink])
+    completa = pipelines.insertar_colas(completa, colas=False, hilos_conversion=hilos)
+
+    _, cpu_base = _correr(base)
+    pared, cpu = _correr(completa)
+    neto_ms = max(0.0, cpu - cpu_base) * 1000 / frames
+    return {
+        "fps": round(frames / pared, 1),
+        "cpu_ms_frame": round(neto_ms, 3),
+        # Una CPU = 100 %; a fps_objetivo por cámara
+        f"cpu_pct_a_{fps_objetivo}fps": round(neto_ms * fps_objetivo / 10, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU y fps de cada camino de captura sobre videotestsrc')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--resolucion', default='640x480', help='Resolución de la "cámara"')
+    parser.add_argument('--hilos', type=int, nargs='*', default=[0, 4],
+                        help='Valores de n-threads a probar en la conversión')
+    parser.add_argument('--fps-objetivo', type=int, default=15)
+    parser.add_argument('--dispositivo', help='Además, mostrar qué camino elegiría auto en esta cámara')
+    args = parser.parse_args()
+
+    if Gst is None:
+        raise SystemExit("❌ GStreamer (gi) no está disponible")
+    Gst.init(None)
+    ancho, alto = (int(v) for v in args.resolucion.lower().split("x"))
+
+    resultados = {}
+    for nombre in CAMINOS:
+        fuente = _fuente_prueba(nombre, ancho, alto, args.frames)
+        _, preproceso = camino(nombre, ancho, alto)
+        faltan = [e.split()[0] for e in fuente + preproceso
+                  if "/" not in e.split()[0] and Gst.ElementFactory.find(e.split()[0]) is None]
+        if faltan:
+            print(f"⏭️  {nombre}: falta {', '.join(faltan)}")
+            continue
+        for hilos in args.hilos:
+            clave = f"{nombre}" + (f" n-threads={hilos}" if hilos else "")
+            try:
+                resultados[clave] = medir_camino(nombre, ancho, alto, args.frames, hilos,
+                                                 args.fps_objetivo)
+            except RuntimeError as e:
+                print(f"❌ {clave}: {e}")
+                continue
+            print(f"⏱️  {clave}: {resultados[clave]}")
+
+    if resultados:
+        mejor = min(resultados, key=lambda c: resultados[c]["cpu_ms_frame"])
+        print(f"🏁 Menor CPU por frame: {mejor}")
+    print(json.dumps(resultados, indent=1, ensure_ascii=False))
+
+    if args.dispositivo:
+        espec = elegir(candidatos("prueba", [f"v4l2src device={args.dispositivo}"],
+                                  ancho=ancho, alto=alto))
+        print(f"📷 {args.dispositivo}: {espec.nombre} -> {espec.caps_fuente}")
+    sys.exit(0 if resultados else 1)
+
+
+if __name__ == "__main__":
+    main()
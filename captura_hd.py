@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import queue
+import threading
+import logging
+import argparse
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+# GStreamer es opcional: el modo opencv y la prueba sintética no lo necesitan
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst, GLib
+except (ImportError, ValueError):
+    Gst = None
+    GLib = None
+
+from captura import caps_camara
+from eventos import registro, agregar_argumentos as agregar_argumentos_eventos, configurar_desde_args
+from frame_handle import FrameHandle
+from pipelines import agregar_rama
+
+POLITICAS_DESCARTE = ("descartar_nuevo", "descartar_antiguo")
+
+# rama: la cámara HD es una segunda fuente del pipeline y sus frames llevan el
+# PTS del reloj compartido; opencv: cv2.VideoCapture en un hilo, con time.time()
+MODOS = ("rama", "opencv")
+# Formatos que el anillo guarda tal cual (sin convertir a BGR hasta escribir)
+_FORMATOS_ANILLO = "video/x-raw,format={NV12,I420,YUY2,BGR}"
+
+
+def caja_recorte(forma, caja, ancho, alto, margen=0.1):
+    """(x1, y1, x2, y2) enteros del recorte en píxeles del frame de forma (alto, ancho, ...), o None
+
+    caja es xyxy en píxeles de ancho x alto; si el frame real tiene otra
+    resolución (p.ej. un archivo de prueba), la caja se reescala a la del frame.
+    """
+    alto_frame, ancho_frame = forma[:2]
+    x1, y1, x2, y2 = (float(v) for v in caja)
+    sx, sy = ancho_frame / ancho, alto_frame / alto
+    mx, my = (x2 - x1) * margen, (y2 - y1) * margen
+    x1 = max(0, int((x1 - mx) * sx))
+    y1 = max(0, int((y1 - my) * sy))
+    x2 = min(ancho_frame, int(round((x2 + mx) * sx)))
+    y2 = min(alto_frame, int(round((y2 + my) * sy)))
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+
+def recortar(frame, caja, ancho, alto, margen=0.1):
+    """Recorte (vista, sin copia) de la caja xyxy con un margen, o None si queda vacío"""
+    recorte = caja_recorte(frame.shape, caja, ancho, alto, margen)
+    if recorte is None:
+        return None
+    x1, y1, x2, y2 = recorte
+    return frame[y1:y2, x1:x2]
+
+
+def ampliar(recorte, lado):
+    """Escalar el recorte (solo hacia arriba) hasta que su lado mayor mida lado píxeles"""
+    import cv2
+    mayor = max(recorte.shape[:2])
+    if not lado or mayor >= lado:
+        return recorte
+    factor = lado / mayor
+    return cv2.resize(recorte, (max(1, round(recorte.shape[1] * factor)),
+                                max(1, round(recorte.shape[0] * factor))),
+                      interpolation=cv2.INTER_CUBIC)
+
+
+def _a_bgr(frame):
+    """El anillo guarda arrays BGR (opencv) o FrameCopia en el formato de la cámara (rama)"""
+    return frame.a_bgr() if hasattr(frame, "a_bgr") else frame
+
+
+class CapturadorHD:
+    """Mantiene abierta la cámara HD y guarda un anillo de frames recientes.
+
+    En modo "rama" la cámara HD es una segunda fuente del mismo pipeline: cada
+    frame entra al anillo con su PTS, que comparte reloj con el de la cámara
+    de detección, y el callback pide el frame HD por el PTS de su buffer
+    (instante_de). En modo "opencv" un hilo lee con cv2.VideoCapture y los
+    frames se marcan con time.time() al leerlos.
+
+    El callback de GStreamer solo llama a solicitar(), que nunca bloquea: la
+    solicitud se encola y un segundo hilo elige el frame más cercano al
+    instante pedido y lo escribe a disco.
+    """
+
+    def __init__(self, dispositivo="/dev/video2", ancho=1920, alto=1080,
+                 max_frames=30, max_solicitudes=8, politica="descartar_nuevo",
+                 carpeta="capturas_hd", fps_archivo=15, espera_maxima=0.5,
+                 modo="opencv", formato="MJPEG", fps=15, lado_recorte=0):
+        if politica not in POLITICAS_DESCARTE:
+            raise ValueError(f"Política de descarte no válida: {politica}")
+        if modo not in MODOS:
+            raise ValueError(f"Modo no válido: {modo}")
+        self.dispositivo = dispositivo
+        self.ancho = ancho
+        self.alto = alto
+        self.carpeta = carpeta
+        self.politica = politica
+        self.fps_archivo = fps_archivo
+        self.espera_maxima = espera_maxima
+        self.modo = modo
+        self.formato = formato
+        self.fps = fps
+        self.lado_recorte = lado_recorte
+
+        # Anillo de (timestamp, frame) y cola acotada de solicitudes
+        self.anillo = deque(maxlen=max_frames)
+        self.solicitudes = queue.Queue(maxsize=max_solicitudes)
+        self._cond = threading.Condition()
+        self._activo = threading.Event()
+        self._hilos = []
+        # al_escribir(path, bytes) se llama tras cada archivo escrito (p.ej. GestorDisco.registrar)
+        self.al_escribir = None
+
+        # Contadores
+        self.frames_leidos = 0
+        self.solicitadas = 0
+        self.descartadas = 0
+        self.guardadas = 0
+        self.fallidas = 0
+        self.desfase_max = 0.0
+        self._desfase_total = 0.0
+        self._elegidos = 0
+
+    # -------------------------------------------------------------------------
+    # Apertura del dispositivo
+    # -------------------------------------------------------------------------
+    def _es_pipeline(self):
+        return "!" in self.dispositivo
+
+    def _es_archivo(self):
+        return os.path.isfile(self.dispositivo)
+
+    def _abrir(self):
+        """Abrir la fuente: dispositivo V4L2, archivo de video o pipeline GStreamer"""
+        # OpenCV se importa en los hilos del capturador, no al importar el módulo
+        import cv2
+        if self._es_pipeline():
+            # Ej: "videotestsrc ! videoconvert ! appsink" como sustituto del dispositivo
+            cap = cv2.VideoCapture(self.dispositivo, cv2.CAP_GSTREAMER)
+        else:
+            cap = cv2.VideoCapture(self.dispositivo)
+        if not cap.isOpened():
+            return None
+        if not self._es_pipeline() and not self._es_archivo():
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.ancho)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.alto)
+            # Evitar que el driver acumule frames viejos
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    # -------------------------------------------------------------------------
+    # Rama del pipeline (modo "rama")
+    # -------------------------------------------------------------------------
+    def elementos_rama(self):
+        """Fuente HD y appsink; dispositivo puede ser una cadena de prueba (con o sin appsink final)"""
+        if self._es_pipeline():
+            fuente = [e.strip() for e in self.dispositivo.split("!")]
+            if fuente[-1].split()[0] == "appsink":
+                fuente = fuente[:-1]
+        else:
+            fuente = [f"v4l2src device={self.dispositivo}",
+                      caps_camara(self.formato, self.ancho, self.alto, self.fps)]
+            if self.formato == "MJPEG":
+                fuente.append("jpegdec")
+        # videoconvert queda en passthrough si la fuente ya da uno de los formatos del anillo
+        return fuente + ["videoconvert", _FORMATOS_ANILLO,
+                         "appsink name=hd emit-signals=true sync=false max-buffers=2 drop=true"]
+
+    def instalar(self, pipeline):
+        """Agregar la fuente HD como segunda rama del pipeline (todavía en NULL)"""
+        appsink = agregar_rama(pipeline, self.elementos_rama())
+        appsink.connect("new-sample", self._nueva_muestra)
+        return appsink
+
+    def _nueva_muestra(self, appsink):
+        muestra = appsink.emit("pull-sample")
+        if muestra is None:
+            return Gst.FlowReturn.OK
+        buffer = muestra.get_buffer()
+        if buffer.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.FlowReturn.OK
+        caps = muestra.get_caps()
+        estructura = caps.get_structure(0)
+        try:
+            # Una copia en el formato de la cámara: la conversión a BGR se paga solo al guardar
+            with FrameHandle(buffer, estructura.get_string("format"), estructura.get_int("width")[1],
+                             estructura.get_int("height")[1], caps) as frame:
+                copia = frame.copiar()
+        except (RuntimeError, ValueError):
+            return Gst.FlowReturn.OK
+        self.agregar(buffer.pts / Gst.SECOND, copia)
+        return Gst.FlowReturn.OK
+
+    # -------------------------------------------------------------------------
+    # Hilos
+    # -------------------------------------------------------------------------
+    def iniciar(self):
+        """Arrancar el hilo de escritura y, en modo opencv, el de lectura"""
+        if self._activo.is_set():
+            return
+        self._activo.set()
+        self._hilos = [
+            threading.Thread(target=self._bucle_escritura, name="captura_hd_escritor", daemon=True),
+        ]
+        if self.modo == "opencv":
+            self._hilos.append(
+                threading.Thread(target=self._bucle_lectura, name="captura_hd_lector", daemon=True))
+        for hilo in self._hilos:
+            hilo.start()
+
+    def detener(self, timeout=2.0):
+        """Detener los hilos y liberar la cámara"""
+        self._activo.clear()
+        with self._cond:
+            self._cond.notify_all()
+        for hilo in self._hilos:
+            hilo.join(timeout)
+        self._hilos = []
+
+    def _bucle_lectura(self):
+        import cv2
+        cap = None
+        es_archivo = self._es_archivo()
+        periodo = 1.0 / self.fps_archivo if es_archivo and self.fps_archivo else 0
+        try:
+            while self._activo.is_set():
+                if cap is None:
+                    cap = self._abrir()
+                    if cap is None:
+                        registro().evento("captura_hd", f"❌ No se pudo abrir {self.dispositivo}, "
+                                          "reintentando...", logging.ERROR, dispositivo=self.dispositivo)
+                        time.sleep(1.0)
+                        continue
+
+                ret, frame = cap.read()
+                if not ret:
+                    if es_archivo:
+                        # Repetir el archivo para simular una cámara continua
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    registro().evento("captura_hd", f"⚠️ No se pudo leer desde {self.dispositivo}, "
+                                      "reabriendo...", logging.WARNING, dispositivo=self.dispositivo)
+                    cap.release()
+                    cap = None
+                    continue
+
+                self.agregar(time.time(), frame)
+
+                if periodo:
+                    time.sleep(periodo)
+        finally:
+            if cap is not None:
+                cap.release()
+
+    def _bucle_escritura(self):
+        import cv2
+        while self._activo.is_set() or not self.solicitudes.empty():
+            try:
+                timestamp, nombre, frame, caja = self.solicitudes.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if frame is None:
+                frame = self._esperar_frame(timestamp)
+            if frame is None:
+                self.fallidas += 1
+                registro().evento("captura_hd", "⚠️ No hay imagen HD disponible para la detección",
+                                  logging.WARNING, nombre=nombre)
+                continue
+            frame = _a_bgr(frame)
+            Path(self.carpeta).mkdir(parents=True, exist_ok=True)
+            path = self.ruta(nombre)
+            if cv2.imwrite(path, frame):
+                self.guardadas += 1
+                self._avisar(path)
+                registro().evento("captura_hd", f"📸 Imagen HD capturada: {path}", path=path)
+            else:
+                self.fallidas += 1
+            if caja is not None:
+                recorte = recortar(frame, caja, self.ancho, self.alto)
+                path = self.ruta_recorte(nombre)
+                if recorte is not None and cv2.imwrite(path, ampliar(recorte, self.lado_recorte)):
+                    self._avisar(path)
+
+    def _avisar(self, path):
+        if self.al_escribir is not None:
+            self.al_escribir(path, os.path.getsize(path))
+
+    def _esperar_frame(self, timestamp):
+        """Esperar (acotado) a tener un frame posterior al timestamp y elegir el más cercano"""
+        limite = time.time() + self.espera_maxima
+        with self._cond:
+            while self._activo.is_set():
+                if self.anillo and self.anillo[-1][0] >= timestamp:
+                    break
+                restante = limite - time.time()
+                if restante <= 0:
+                    break
+                self._cond.wait(restante)
+            elegido = self._mas_cercano(timestamp)
+        if elegido is None:
+            return None
+        desfase = abs(elegido[0] - timestamp)
+        self.desfase_max = max(self.desfase_max, desfase)
+        self._desfase_total += desfase
+        self._elegidos += 1
+        return elegido[1]
+
+    # -------------------------------------------------------------------------
+    # API pública
+    # -------------------------------------------------------------------------
+    def agregar(self, instante, frame):
+        """Meter un frame al anillo (lo usan los lectores; sirve para probar con instantes sintéticos)"""
+        with self._cond:
+            self.anillo.append((instante, frame))
+            self.frames_leidos += 1
+            self._cond.notify_all()
+
+    def instante_de(self, buffer=None):
+        """Instante con el que pedir el frame HD de una detección
+
+        En modo rama es el PTS del buffer de la detección (mismo reloj que los
+        frames HD del anillo); en modo opencv, la hora actual.
+        """
+        if self.modo != "rama":
+            return time.time()
+        if buffer is not None and buffer.pts != Gst.CLOCK_TIME_NONE:
+            return buffer.pts / Gst.SECOND
+        # Sin PTS: el frame HD más reciente
+        with self._cond:
+            return self.anillo[-1][0] if self.anillo else 0.0
+
+    def _mas_cercano(self, timestamp):
+        """(instante, frame) del anillo más cercano al timestamp, o None; llamar con _cond tomado"""
+        if not self.anillo:
+            return None
+        return min(self.anillo, key=lambda item: abs(item[0] - timestamp))
+
+    def frame_en(self, timestamp):
+        """Devolver el frame del anillo más cercano al timestamp (o None)
+
+        El frame no se copia: cada lectura de la cámara (o cada muestra de la
+        rama) crea un objeto nuevo, así que guardar la referencia alcanza para
+        conservarlo.
+        """
+        with self._cond:
+            elegido = self._mas_cercano(timestamp)
+        return elegido[1] if elegido is not None else None
+
+    def ruta(self, nombre):
+        """Archivo donde se guarda (o se guardará) la captura nombre"""
+        return os.path.join(self.carpeta, f"captura_hd_{nombre}.jpg")
+
+    def ruta_recorte(self, nombre):
+        return os.path.join(self.carpeta, f"captura_hd_{nombre}_recorte.jpg")
+
+    def solicitar(self, timestamp, nombre, caja=None):
+        """Pedir una captura HD en el instante timestamp (no bloquea)
+
+        caja (xyxy en píxeles de ancho x alto) guarda además el recorte del
+        vehículo. Devuelve False si la solicitud se descartó por cola llena.
+        """
+        return self._encolar((timestamp, nombre, None, caja))
+
+    def guardar(self, frame, nombre, caja=None):
+        """Guardar un frame HD ya elegido (p.ej. con frame_en) sin bloquear"""
+        return self._encolar((time.time(), nombre, frame, caja))
+
+    def _encolar(self, solicitud):
+        self.solicitadas += 1
+        try:
+            self.solicitudes.put_nowait(solicitud)
+            return True
+        except queue.Full:
+            pass
+
+        self.descartadas += 1
+        if self.politica == "descartar_nuevo":
+            return False
+
+        # descartar_antiguo: sacar la solicitud más vieja y reintentar
+        try:
+            self.solicitudes.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.solicitudes.put_nowait(solicitud)
+            return True
+        except queue.Full:
+            return False
+
+    def estadisticas(self):
+        return {
+            "frames_leidos": self.frames_leidos,
+            "solicitadas": self.solicitadas,
+            "descartadas": self.descartadas,
+            "guardadas": self.guardadas,
+            "fallidas": self.fallidas,
+            "pendientes": self.solicitudes.qsize(),
+            "desfase_max_ms": round(self.desfase_max * 1000, 1),
+            "desfase_medio_ms": round(self._desfase_total * 1000 / max(1, self._elegidos), 1),
+        }
+
+
+# -----------------------------------------------------------------------------------------------
+# Pruebas: instantes sintéticos (sin cámara ni GStreamer) y dos videotestsrc en un pipeline
+# -----------------------------------------------------------------------------------------------
+def _frame_numerado(i, ancho, alto):
+    """Frame HD cuyo contenido es su número de secuencia (módulo 256)"""
+    return np.full((alto, ancho, 3), i % 256, dtype=np.uint8)
+
+
+def probar_sintetico(carpeta, fps_hd=30.0, fps_deteccion=15.0, segundos=4.0, jitter=0.004,
+                     latencia_apertura=0.25):
+    """Detecciones con PTS conocido contra un anillo HD con PTS conocidos
+
+    Verifica que cada detección obtiene el frame HD de su mismo instante (el
+    más cercano, a menos de medio período HD) y que el recorte sale ampliado.
+    Como referencia, calcula el desfase del camino viejo: abrir la cámara al
+    detectar y quedarse con el primer frame que llegue.
+    """
+    import cv2
+    rng = np.random.default_rng(0)
+    ancho, alto = 320, 180
+    n_hd = int(segundos * fps_hd)
+    # El anillo alcanza para toda la prueba: los frames llegan más rápido que en tiempo real
+    capturador = CapturadorHD(carpeta=carpeta, ancho=ancho, alto=alto, modo="rama",
+                              max_frames=n_hd, max_solicitudes=256, espera_maxima=0.0,
+                              lado_recorte=128)
+    # PTS de la cámara HD con algo de jitter de captura
+    pts_hd = np.arange(n_hd) / fps_hd + rng.uniform(-jitter, jitter, n_hd)
+    capturador.iniciar()
+    esperados, desfases_viejo = {}, []
+    siguiente_hd = 0
+    for j in range(int(segundos * fps_deteccion)):
+        pts = j / fps_deteccion + 0.01
+        # El anillo va un poco adelantado respecto de la detección (como la cámara HD real)
+        while siguiente_hd < n_hd and pts_hd[siguiente_hd] <= pts + 0.05:
+            capturador.agregar(float(pts_hd[siguiente_hd]), _frame_numerado(siguiente_hd, ancho, alto))
+            siguiente_hd += 1
+        if j % 5:
+            continue
+        nombre = f"sintetico_{j:04d}"
+        esperados[nombre] = int(np.argmin(np.abs(pts_hd - pts)))
+        capturador.solicitar(pts, nombre, (100, 60, 140, 90))
+        # Camino viejo: el primer frame que llega después de abrir el dispositivo
+        viejo = np.searchsorted(pts_hd, pts + latencia_apertura)
+        if viejo < n_hd:
+            desfases_viejo.append(pts_hd[viejo] - pts)
+    capturador.detener()
+
+    errores = []
+    for nombre, indice in esperados.items():
+        imagen = cv2.imread(capturador.ruta(nombre))
+        recorte = cv2.imread(capturador.ruta_recorte(nombre))
+        if imagen is None or recorte is None:
+            errores.append(f"{nombre}: falta la imagen o el recorte")
+            continue
+        if int(imagen[0, 0, 0]) != indice % 256:
+            errores.append(f"{nombre}: frame HD {int(imagen[0, 0, 0])}, esperado {indice % 256}")
+        if max(recorte.shape[:2]) != capturador.lado_recorte:
+            errores.append(f"{nombre}: recorte de {recorte.shape[1]}x{recorte.shape[0]}")
+    estadisticas = capturador.estadisticas()
+    print(f"📊 {estadisticas}")
+    print(f"📊 Camino viejo (abrir y tomar el siguiente): desfase medio "
+          f"{np.mean(desfases_viejo) * 1000:.1f} ms, máximo {np.max(desfases_viejo) * 1000:.1f} ms")
+    if estadisticas["desfase_max_ms"] > 1000 / fps_hd / 2 + jitter * 1000:
+        errores.append(f"desfase máximo {estadisticas['desfase_max_ms']} ms")
+    for error in errores:
+        print(f"❌ {error}")
+    return not errores
+
+
+def probar_videotestsrc(carpeta, fuente_hd, segundos=4.0, cada=5):
+    """Cámara de detección y cámara HD como dos videotestsrc del mismo pipeline
+
+    Cada cada frames de la rama de detección se pide el frame HD por el PTS
+    del buffer; el desfase con el frame elegido debe quedar por debajo de un
+    período de la cámara HD.
+    """
+    pipeline = Gst.parse_launch(
+        "videotestsrc is-live=true pattern=ball ! video/x-raw,width=640,height=480,framerate=15/1 "
+        "! identity name=deteccion ! fakesink sync=false")
+    capturador = CapturadorHD(fuente_hd, carpeta=carpeta, ancho=1280, alto=720, modo="rama",
+                              lado_recorte=256)
+    capturador.instalar(pipeline)
+    capturador.iniciar()
+    contador = [0]
+
+    def probe(pad, info):
+        contador[0] += 1
+        if contador[0] % cada == 0:
+            capturador.solicitar(capturador.instante_de(info.get_buffer()),
+                                 f"videotestsrc_{contador[0]:04d}", (500, 300, 700, 420))
+        return Gst.PadProbeReturn.OK
+
+    pipeline.get_by_name("deteccion").get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, probe)
+    loop = GLib.MainLoop()
+    GLib.timeout_add(int(segundos * 1000), loop.quit)
+    pipeline.set_state(Gst.State.PLAYING)
+    loop.run()
+    pipeline.set_state(Gst.State.NULL)
+    capturador.detener()
+
+    estadisticas = capturador.estadisticas()
+    print(f"📊 {estadisticas}")
+    return (estadisticas["guardadas"] == estadisticas["solicitadas"] > 0
+            and estadisticas["desfase_max_ms"] <= 1000 / 30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba del capturador HD en segundo plano')
+    parser.add_argument('--device', default='/dev/video2',
+                        help='Dispositivo, archivo de video o pipeline GStreamer terminado en appsink')
+    parser.add_argument('--solicitudes', type=int, default=20,
+                        help='Cantidad de capturas a solicitar')
+    parser.add_argument('--intervalo', type=float, default=0.1,
+                        help='Segundos entre solicitudes')
+    parser.add_argument('--carpeta', default='capturas_hd')
+    parser.add_argument('--prueba', choices=['sintetica', 'videotestsrc'],
+                        help='sintetica: anillo con PTS conocidos (sin cámara ni GStreamer); '
+                             'videotestsrc: detección y HD como dos fuentes del mismo pipeline')
+    agregar_argumentos_eventos(parser)
+    args = parser.parse_args()
+    configurar_desde_args(args)
+
+    if args.prueba == 'sintetica':
+        ok = probar_sintetico(args.carpeta)
+        print("✅ Cada detección obtuvo el frame HD de su instante" if ok else "❌ Prueba sintética fallida")
+        sys.exit(0 if ok else 1)
+    if args.prueba == 'videotestsrc':
+        if Gst is None:
+            raise SystemExit("❌ GStreamer (gi) no está disponible")
+        Gst.init(None)
+        fuente = args.device if "!" in args.device else (
+            "videotestsrc is-live=true pattern=smpte ! video/x-raw,width=1280,height=720,framerate=30/1")
+        ok = probar_videotestsrc(args.carpeta, fuente)
+        print("✅ Capturas HD sincronizadas por PTS" if ok else "❌ Faltan capturas o el desfase es alto")
+        sys.exit(0 if ok else 1)
+
+    capturador = CapturadorHD(args.device, carpeta=args.carpeta)
+    capturador.iniciar()
+    try:
+        peor = 0.0
+        for i in range(args.solicitudes):
+            inicio = time.perf_counter()
+            capturador.solicitar(time.time(), f"prueba_{i:04d}")
+            peor = max(peor, time.perf_counter() - inicio)
+            time.sleep(args.intervalo)
+        print(f"⏱️  Peor tiempo de solicitar(): {peor * 1000:.3f} ms")
+    finally:
+        capturador.detener()
+    print(f"📊 {capturador.estadisticas()}")
+
+
+if __name__ == "__main__":
+    main()
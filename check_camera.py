@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import subprocess
+import argparse
 import os
 
 def check_v4l2_device(device="/dev/video0"):
@@ -74,6 +75,12 @@ def test_gstreamer_v4l2(device="/dev/video0"):
     except Exception as e:
         print(f"❌ Error ejecutando GStreamer: {e}")
 
+def main():
+    parser = argparse.ArgumentParser(description='Verificar la cámara V4L2 y GStreamer')
+    parser.add_argument('--device', default='/dev/video0')
+    args = parser.parse_args()
+    check_v4l2_device(args.device)
+    test_gstreamer_v4l2(args.device)
+
 if __name__ == "__main__":
-    check_v4l2_device("/dev/video0")
-    test_gstreamer_v4l2("/dev/video0")
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import queue
+import logging
+import argparse
+import threading
+from collections import deque
+from pathlib import Path
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst, GLib
+except (ImportError, ValueError):
+    Gst = None
+    GLib = None
+
+from eventos import registro, agregar_argumentos as agregar_argumentos_eventos, configurar_desde_args
+from pipelines import cola, crear_elemento, enlazar, derivar
+
+CODECS = ("h264", "mjpeg")
+
+# Codificador y caps de salida por codec (x264enc y jpegenc son software: alcanzan para probar)
+_CODIFICADORES = {
+    "h264": ["x264enc tune=zerolatency speed-preset=ultrafast bitrate={kbps} key-int-max={gop}",
+             "h264parse config-interval=-1",
+             "video/x-h264,stream-format=avc,alignment=au"],
+    "mjpeg": ["jpegenc quality=85", "image/jpeg"],
+}
+
+# Parser y muxer para escribir el clip sin recodificar
+_MUXERS = {
+    "h264": ("h264parse", "mp4mux", ".mp4"),
+    "mjpeg": ("jpegparse", "qtmux", ".mov"),
+}
+
+
+class Muestra:
+    """Un frame codificado del anillo"""
+
+    __slots__ = ("instante", "pts", "duracion", "datos", "clave")
+
+    def __init__(self, instante, pts, duracion, datos, clave):
+        self.instante = instante
+        self.pts = pts
+        self.duracion = duracion
+        self.datos = datos
+        self.clave = clave
+
+
+class AnilloCodificado:
+    """Últimos segundos del stream ya codificado, acotado por bytes
+
+    Al desalojar por tamaño se descarta hasta el próximo keyframe, así el
+    anillo siempre empieza en un frame decodificable. instante es el
+    time.time() de llegada de cada frame, que es lo que conocen los callbacks.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.muestras = deque()
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self.descartadas = 0
+
+    def agregar(self, muestra):
+        with self._lock:
+            self.muestras.append(muestra)
+            self.bytes += len(muestra.datos)
+            while self.bytes > self.max_bytes and len(self.muestras) > 1:
+                self._desalojar()
+                while self.muestras and not self.muestras[0].clave:
+                    self._desalojar()
+
+    def _desalojar(self):
+        vieja = self.muestras.popleft()
+        self.bytes -= len(vieja.datos)
+        self.descartadas += 1
+
+    def ventana(self, desde, hasta):
+        """Muestras entre desde y hasta (instantes), empezando en el keyframe anterior a desde"""
+        with self._lock:
+            muestras = list(self.muestras)
+        inicio = None
+        for i, muestra in enumerate(muestras):
+            if muestra.instante > desde:
+                break
+            if muestra.clave:
+                inicio = i
+        if inicio is None:
+            # El pre-evento ya no está completo: desde el primer keyframe disponible
+            inicio = next((i for i, m in enumerate(muestras) if m.clave), len(muestras))
+        return [m for m in muestras[inicio:] if m.instante <= hasta]
+
+    def segundos(self):
+        with self._lock:
+            if len(self.muestras) < 2:
+                return 0.0
+            return self.muestras[-1].instante - self.muestras[0].instante
+
+    def ultimo_instante(self):
+        with self._lock:
+            return self.muestras[-1].instante if self.muestras else None
+
+
+class GrabadorClips:
+    """Rama que codifica el stream en un anillo en memoria y guarda clips pre/post evento
+
+    disparar() no bloquea: registra el pedido y, cuando el anillo ya cubre el
+    post-evento, un hilo aparte arma el MP4 con appsrc -> parser -> muxer sin
+    recodificar.
+    """
+
+    def __init__(self, codec="h264", pre=5.0, post=5.0, max_bytes=64 * 1024 * 1024,
+                 carpeta="clips", kbps=2000, gop=15, max_pendientes=8, max_segundos=60.0):
+        if codec not in CODECS:
+            raise ValueError(f"Codec no válido: {codec}")
+        self.codec = codec
+        self.pre = pre
+        self.post = post
+        self.carpeta = carpeta
+        self.kbps = kbps
+        self.gop = gop
+        self.max_segundos = max_segundos
+        self.anillo = AnilloCodificado(max_bytes)
+        self.caps = None
+        self._pedidos = []
+        self._lock = threading.Lock()
+        self._trabajos = queue.Queue(maxsize=max_pendientes)
+        self._hilo = None
+        self._activo = threading.Event()
+        # al_escribir(path, bytes) se llama tras cada clip guardado (p.ej. GestorDisco.registrar)
+        self.al_escribir = None
+
+        # Contadores
+        self.disparados = 0
+        self.guardados = 0
+        self.descartados = 0
+        self.fallidos = 0
+
+    def elementos_rama(self):
+        codificador = [e.format(kbps=self.kbps, gop=self.gop) for e in _CODIFICADORES[self.codec]]
+        return ([cola("q_clips", 4), "videoconvert", "video/x-raw,format=I420"] + codificador
+                + ["appsink name=clips emit-signals=true sync=false max-buffers=8 drop=true"])
+
+    def instalar(self, pipeline, antes_de):
+        """Colgar la rama de codificación de un tee antes del elemento antes_de"""
+        appsink = derivar(pipeline, antes_de, self.elementos_rama(), "tee_clips")
+        appsink.connect("new-sample", self._nueva_muestra)
+        return appsink
+
+    def _nueva_muestra(self, appsink):
+        muestra = appsink.emit("pull-sample")
+        if muestra is None:
+            return Gst.FlowReturn.OK
+        if self.caps is None:
+            self.caps = muestra.get_caps().to_string()
+        buffer = muestra.get_buffer()
+        clave = not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT)
+        self.anillo.agregar(Muestra(time.time(), buffer.pts, buffer.duration,
+                                    buffer.extract_dup(0, buffer.get_size()), clave))
+        self._revisar_pedidos()
+        return Gst.FlowReturn.OK
+
+    def disparar(self, nombre, instante=None):
+        """Pedir un clip alrededor de instante (time.time(), por defecto ahora); no bloquea
+
+        Un evento que cae dentro de un clip pendiente lo extiende (hasta
+        max_segundos) en lugar de crear otro clip solapado; uno apenas anterior
+        a su comienzo (p.ej. la mejor observación de un track que ya terminó)
+        lo adelanta si entra en max_segundos. Si no, se pide un clip propio.
+        Devuelve el nombre del clip que contendrá el evento.
+        """
+        instante = time.time() if instante is None else instante
+        with self._lock:
+            for i in range(len(self._pedidos) - 1, -1, -1):
+                anterior, desde, hasta = self._pedidos[i]
+                if desde <= instante <= hasta:
+                    self._pedidos[i] = (anterior, desde, min(max(hasta, instante + self.post),
+                                                             desde + self.max_segundos))
+                    nombre = anterior
+                    break
+                if instante < desde and hasta - (instante - self.pre) <= self.max_segundos:
+                    self._pedidos[i] = (anterior, instante - self.pre, hasta)
+                    nombre = anterior
+                    break
+            else:
+                self._pedidos.append((nombre, instante - self.pre, instante + self.post))
+                self.disparados += 1
+        self._revisar_pedidos()
+        return nombre
+
+    def _revisar_pedidos(self):
+        ultimo = self.anillo.ultimo_instante()
+        if ultimo is None:
+            return
+        with self._lock:
+            listos = [p for p in self._pedidos if p[2] <= ultimo]
+            self._pedidos = [p for p in self._pedidos if p[2] > ultimo]
+        for nombre, desde, hasta in listos:
+            self._encolar(nombre, self.anillo.ventana(desde, hasta))
+
+    def _encolar(self, nombre, muestras):
+        if not muestras:
+            self.fallidos += 1
+            return
+        try:
+            self._trabajos.put_nowait((nombre, self.caps, muestras))
+        except queue.Full:
+            self.descartados += 1
+
+    # -------------------------------------------------------------------------
+    # Escritura fuera del hilo de streaming
+    # -------------------------------------------------------------------------
+    def iniciar(self):
+        if self._activo.is_set():
+            return
+        self._activo.set()
+        self._hilo = threading.Thread(target=self._bucle, name="clips", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=10.0):
+        """Guardar lo que haya de los clips pendientes y detener el hilo"""
+        with self._lock:
+            pendientes, self._pedidos = self._pedidos, []
+        for nombre, desde, hasta in pendientes:
+            self._encolar(nombre, self.anillo.ventana(desde, hasta))
+        self._activo.clear()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+            self._hilo = None
+
+    def _bucle(self):
+        while self._activo.is_set() or not self._trabajos.empty():
+            try:
+                nombre, caps, muestras = self._trabajos.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                path = self.escribir(nombre, caps, muestras)
+                self.guardados += 1
+                if self.al_escribir is not None:
+                    self.al_escribir(path, os.path.getsize(path))
+                registro().evento("clip", f"🎬 Clip guardado: {path} ({len(muestras)} frames)",
+                                  path=path, frames=len(muestras))
+            except Exception as e:
+                self.fallidos += 1
+                registro().evento("clip", f"⚠️ No se pudo guardar el clip {nombre}: {e}",
+                                  logging.WARNING, nombre=nombre, error=str(e))
+
+    def ruta(self, nombre):
+        """Archivo donde se guarda (o se guardará) el clip nombre"""
+        return os.path.join(self.carpeta, f"clip_{nombre}{_MUXERS[self.codec][2]}")
+
+    def escribir(self, nombre, caps, muestras):
+        """appsrc -> parser -> muxer -> filesink con los frames tal como salieron del codificador"""
+        parser, muxer, _ = _MUXERS[self.codec]
+        Path(self.carpeta).mkdir(parents=True, exist_ok=True)
+        path = self.ruta(nombre)
+
+        pipeline = Gst.Pipeline.new(f"clip_{nombre}")
+        appsrc = crear_elemento("appsrc name=origen format=time")
+        appsrc.set_property("caps", Gst.Caps.from_string(caps))
+        elementos = [appsrc, crear_elemento(parser), crear_elemento(muxer),
+                     crear_elemento(f"filesink location={path}")]
+        for elemento in elementos:
+            pipeline.add(elemento)
+        for anterior, elemento in zip(elementos, elementos[1:]):
+            enlazar(anterior, elemento)
+
+        pipeline.set_state(Gst.State.PLAYING)
+        base = muestras[0].pts
+        for muestra in muestras:
+            buffer = Gst.Buffer.new_wrapped(muestra.datos)
+            buffer.pts = muestra.pts - base
+            buffer.dts = buffer.pts
+            buffer.duration = muestra.duracion
+            if not muestra.clave:
+                buffer.set_flags(Gst.BufferFlags.DELTA_UNIT)
+            appsrc.emit("push-buffer", buffer)
+        appsrc.emit("end-of-stream")
+
+        mensaje = pipeline.get_bus().timed_pop_filtered(
+            10 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        pipeline.set_state(Gst.State.NULL)
+        if mensaje is None or mensaje.type == Gst.MessageType.ERROR:
+            error = mensaje.parse_error()[0] if mensaje is not None else "sin EOS"
+            raise RuntimeError(str(error))
+        return path
+
+    def estadisticas(self):
+        return {
+            "disparados": self.disparados,
+            "guardados": self.guardados,
+            "descartados": self.descartados,
+            "fallidos": self.fallidos,
+            "anillo_mb": round(self.anillo.bytes / 1e6, 2),
+            "anillo_segundos": round(self.anillo.segundos(), 1),
+            "pendientes": len(self._pedidos),
+        }
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--clips', action='store_true',
+                        help='Guardar un video con los segundos antes y después de cada captura')
+    parser.add_argument('--clip-codec', default='h264', choices=CODECS)
+    parser.add_argument('--clip-pre', type=float, default=5.0, help='Segundos antes del evento')
+    parser.add_argument('--clip-post', type=float, default=5.0, help='Segundos después del evento')
+    parser.add_argument('--clip-memoria-mb', type=float, default=64,
+                        help='Memoria máxima del anillo de video codificado')
+    parser.add_argument('--clip-carpeta', default='clips')
+
+
+def desde_argumentos(args):
+    if not args.clips:
+        return None
+    return GrabadorClips(args.clip_codec, args.clip_pre, args.clip_post,
+                         int(args.clip_memoria_mb * 1024 * 1024), args.clip_carpeta)
+
+
+# -----------------------------------------------------------------------------------------------
+# Prueba con videotestsrc y codificador por software
+# -----------------------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Clips pre/post evento sobre videotestsrc')
+    parser.add_argument('--codec', default='h264', choices=CODECS)
+    parser.add_argument('--pre', type=float, default=2.0)
+    parser.add_argument('--post', type=float, default=2.0)
+    parser.add_argument('--memoria-mb', type=float, default=8)
+    parser.add_argument('--segundos', type=float, default=8.0)
+    parser.add_argument('--eventos', type=int, default=2)
+    parser.add_argument('--carpeta', default='clips_prueba')
+    agregar_argumentos_eventos(parser)
+    args = parser.parse_args()
+    configurar_desde_args(args)
+
+    if Gst is None:
+        raise SystemExit("❌ GStreamer (gi) no está disponible")
+    Gst.init(None)
+
+    pipeline = Gst.parse_launch(
+        "videotestsrc is-live=true pattern=ball ! video/x-raw,width=640,height=480,framerate=15/1 "
+        "! videoconvert name=principal ! fakesink sync=false")
+    grabador = GrabadorClips(args.codec, args.pre, args.post,
+                             int(args.memoria_mb * 1024 * 1024), args.carpeta)
+    grabador.instalar(pipeline, "principal")
+    grabador.iniciar()
+
+    def disparar(i):
+        grabador.disparar(f"prueba_{i}")
+        return False
+
+    loop = GLib.MainLoop()
+    periodo = args.segundos / (args.eventos + 1)
+    for i in range(args.eventos):
+        GLib.timeout_add(int(periodo * (i + 1) * 1000), disparar, i)
+    GLib.timeout_add(int((args.segundos + args.post) * 1000), loop.quit)
+    pipeline.set_state(Gst.State.PLAYING)
+    loop.run()
+    pipeline.set_state(Gst.State.NULL)
+    grabador.detener()
+
+    estadisticas = grabador.estadisticas()
+    print(f"📊 {estadisticas}")
+    ok = estadisticas["guardados"] == args.eventos and estadisticas["anillo_mb"] <= args.memoria_mb
+    print("✅ Clips guardados" if ok else "❌ Faltan clips o el anillo pasó el límite")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
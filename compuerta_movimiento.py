@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+except (ImportError, ValueError):
+    Gst = None
+
+from pipelines import crear_elemento, enlazar, desde_args
+
+METODOS = ("diferencia", "fondo")
+
+
+class PuntajeMovimiento:
+    """Fracción de píxeles que cambiaron en una miniatura del frame
+
+    La miniatura se toma con un slicing con paso (sin interpolar) sobre el
+    canal verde, que alcanza como aproximación de la luminancia. "diferencia"
+    compara con el frame anterior; "fondo" con un promedio móvil, que ignora
+    mejor el ruido del sensor y los cambios lentos de luz.
+    """
+
+    def __init__(self, metodo="diferencia", paso=8, umbral_pixel=25, alfa=0.05):
+        if metodo not in METODOS:
+            raise ValueError(f"Método de movimiento no válido: {metodo}")
+        self.metodo = metodo
+        self.paso = paso
+        self.umbral_pixel = umbral_pixel
+        self.alfa = alfa
+        self._referencia = None
+
+    def miniatura(self, frame):
+        mini = frame[::self.paso, ::self.paso]
+        if mini.ndim == 3:
+            mini = mini[..., 1]
+        return mini.astype(np.float32)
+
+    def puntaje(self, frame):
+        mini = self.miniatura(frame)
+        if self._referencia is None or self._referencia.shape != mini.shape:
+            self._referencia = mini
+            return 1.0
+        diferencia = np.abs(mini - self._referencia)
+        if self.metodo == "diferencia":
+            self._referencia = mini
+        else:
+            self._referencia += self.alfa * (mini - self._referencia)
+        return np.count_nonzero(diferencia > self.umbral_pixel) / diferencia.size
+
+
+class PoliticaInferencia:
+    """Decide por frame si corre la inferencia
+
+    Con movimiento (puntaje >= umbral) se infiere cada frame y se sigue así
+    durante espera_reposo segundos después del último movimiento; en reposo
+    se infiere a fps_reposo. Un frame con movimiento vuelve a la tasa completa
+    en el mismo frame.
+    """
+
+    def __init__(self, umbral=0.01, fps_reposo=1.0, espera_reposo=2.0):
+        self.umbral = umbral
+        self.periodo_reposo = 1.0 / fps_reposo if fps_reposo > 0 else float("inf")
+        self.espera_reposo = espera_reposo
+        self._ultimo_movimiento = None
+        self._ultima_inferencia = None
+
+    def activa(self, ahora):
+        return (self._ultimo_movimiento is not None
+                and ahora - self._ultimo_movimiento <= self.espera_reposo)
+
+    def decidir(self, ahora, puntaje):
+        if puntaje >= self.umbral:
+            self._ultimo_movimiento = ahora
+        inferir = (self.activa(ahora) or self._ultima_inferencia is None
+                   or ahora - self._ultima_inferencia >= self.periodo_reposo)
+        if inferir:
+            self._ultima_inferencia = ahora
+        return inferir
+
+
+class CompuertaMovimiento:
+    """Etapa previa a hailonet: output-selector que manda cada frame al modelo o al desvío
+
+    Los frames desviados llegan igual al callback (por un funnel) y
+    saltado(pts) dice si ese frame se saltó la inferencia.
+    """
+
+    def __init__(self, puntaje=None, politica=None, max_pendientes=256):
+        self.puntaje = puntaje or PuntajeMovimiento()
+        self.politica = politica or PoliticaInferencia()
+        self.max_pendientes = max_pendientes
+        self._saltados = OrderedDict()
+        self._selector = None
+        self._pad_inferencia = None
+        self._pad_desvio = None
+        self.inferidos = 0
+        self.desviados = 0
+
+    def construir(self, espec, opciones=None):
+        """Pipeline de la especificación con la compuerta entre el preproceso y el modelo"""
+        previos = " ! ".join(espec.elementos_previos())
+        if opciones is not None:
+            previos = desde_args(previos, opciones)
+        pipeline = Gst.Pipeline.new(espec.nombre)
+
+        def cadena(textos, anterior=None):
+            primero = None
+            for texto in textos:
+                elemento = crear_elemento(texto)
+                pipeline.add(elemento)
+                if anterior is not None:
+                    enlazar(anterior, elemento)
+                primero = primero or elemento
+                anterior = elemento
+            return primero, anterior
+
+        _, ultimo_previo = cadena(previos.split(" ! "))
+        self._selector = crear_elemento("output-selector name=compuerta pad-negotiation-mode=all")
+        union = crear_elemento("funnel name=union_compuerta")
+        pipeline.add(self._selector)
+        pipeline.add(union)
+        enlazar(ultimo_previo, self._selector)
+
+        modelo = espec.elementos_modelo() or ["identity name=sin_modelo"]
+        entrada_modelo, salida_modelo = cadena(modelo, self._selector)
+        entrada_desvio, salida_desvio = cadena(["queue name=q_desvio max-size-buffers=4"],
+                                               self._selector)
+        enlazar(salida_modelo, union)
+        enlazar(salida_desvio, union)
+        cadena(espec.elementos_finales(), union)
+
+        self._pad_inferencia = entrada_modelo.get_static_pad("sink").get_peer()
+        self._pad_desvio = entrada_desvio.get_static_pad("sink").get_peer()
+        self._selector.set_property("active-pad", self._pad_inferencia)
+        self._selector.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self._probe)
+        return pipeline
+
+    def _probe(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer is None:
+            return Gst.PadProbeReturn.OK
+        # Import diferido: frame_handle solo hace falta con la compuerta activa
+        from frame_handle import mapear_frame
+        frame = mapear_frame(buffer, pad)
+        try:
+            puntaje = self.puntaje.puntaje(frame.array) if frame is not None else 1.0
+        finally:
+            if frame is not None:
+                frame.liberar()
+
+        if self.politica.decidir(time.monotonic(), puntaje):
+            self.inferidos += 1
+            destino = self._pad_inferencia
+        else:
+            self.desviados += 1
+            destino = self._pad_desvio
+            self._saltados[buffer.pts] = True
+            if len(self._saltados) > self.max_pendientes:
+                self._saltados.popitem(last=False)
+        if self._selector.get_property("active-pad") != destino:
+            self._selector.set_property("active-pad", destino)
+        return Gst.PadProbeReturn.OK
+
+    def saltado(self, pts):
+        """True si el frame con ese PTS no pasó por el modelo (consulta una sola vez por frame)"""
+        return self._saltados.pop(pts, False)
+
+    def estadisticas(self):
+        total = self.inferidos + self.desviados
+        return {"inferidos": self.inferidos, "saltados": self.desviados,
+                "ahorro": round(self.desviados / total, 3) if total else 0.0}
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--compuerta', action='store_true',
+                        help='Inferir a tasa completa solo con movimiento y a --fps-reposo sin él')
+    parser.add_argument('--compuerta-metodo', default='diferencia', choices=METODOS)
+    parser.add_argument('--compuerta-umbral', type=float, default=0.01,
+                        help='Fracción de píxeles cambiados de la miniatura que cuenta como movimiento')
+    parser.add_argument('--fps-reposo', type=float, default=1.0,
+                        help='Inferencias por segundo sin movimiento')
+    parser.add_argument('--espera-reposo', type=float, default=2.0,
+                        help='Segundos sin movimiento antes de bajar a --fps-reposo')
+
+
+def desde_argumentos(args):
+    if not args.compuerta:
+        return None
+    return CompuertaMovimiento(PuntajeMovimiento(args.compuerta_metodo),
+                               PoliticaInferencia(args.compuerta_umbral, args.fps_reposo,
+                                                  args.espera_reposo))
+
+
+# -----------------------------------------------------------------------------------------------
+# Evaluación offline: inferencias ahorradas vs. detecciones perdidas
+# -----------------------------------------------------------------------------------------------
+def video_sintetico(secuencia, ancho=320, alto=320, seed=0):
+    """Frames de fondo fijo con ruido de sensor y un rectángulo por cada detección"""
+    rng = np.random.default_rng(seed)
+    fondo = rng.integers(60, 120, (alto, ancho, 3), dtype=np.uint8)
+    for dets in secuencia:
+        frame = fondo.copy()
+        frame += rng.integers(0, 6, frame.shape, dtype=np.uint8)
+        for x1, y1, x2, y2, *_ in dets:
+            frame[int(max(y1, 0) * alto):int(min(y2, 1) * alto),
+                  int(max(x1, 0) * ancho):int(min(x2, 1) * ancho)] = (200, 40, 40)
+        yield frame
+
+
+def frames_video(path, ancho=320, alto=320):
+    import cv2
+    cap = cv2.VideoCapture(path)
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        yield cv2.resize(frame, (ancho, alto))
+    cap.release()
+
+
+def evaluar(frames, secuencia, puntaje, politica, fps=15.0):
+    """Simular la compuerta sobre frames grabados y sus detecciones de referencia
+
+    Las detecciones de referencia se agrupan en vehículos con el tracker; un
+    vehículo se pierde si ninguno de sus frames pasó por la inferencia.
+    """
+    from tracker import RastreadorIoU
+
+    rastreador = RastreadorIoU(min_hits=1)
+    inferidos = saltados = frames_con_det = saltados_con_det = 0
+    vistos_por_vehiculo = {}
+    tiempo_puntaje = 0.0
+    for n, (frame, dets) in enumerate(zip(frames, secuencia)):
+        inicio = time.perf_counter()
+        valor = puntaje.puntaje(frame)
+        tiempo_puntaje += time.perf_counter() - inicio
+        inferir = politica.decidir(n / fps, valor)
+        inferidos += inferir
+        saltados += not inferir
+
+        if dets:
+            datos = np.asarray([d[:5] for d in dets], dtype=np.float32)
+            ids, _ = rastreador.actualizar(datos[:, :4], datos[:, 4], np.asarray([d[5] for d in dets]))
+            frames_con_det += 1
+            saltados_con_det += not inferir
+            for track_id in ids:
+                vistos_por_vehiculo[track_id] = vistos_por_vehiculo.get(track_id, False) or inferir
+        else:
+            rastreador.actualizar(np.zeros((0, 4), np.float32), np.zeros(0, np.float32),
+                                  np.zeros(0, dtype=object))
+
+    total = inferidos + saltados
+    vehiculos = len(vistos_por_vehiculo)
+    perdidos = sum(1 for visto in vistos_por_vehiculo.values() if not visto)
+    return {
+        "frames": total,
+        "inferencias": inferidos,
+        "inferencias_ahorradas": round(saltados / total, 3) if total else 0.0,
+        "frames_con_deteccion_saltados": round(saltados_con_det / frames_con_det, 3) if frames_con_det else 0.0,
+        "vehiculos": vehiculos,
+        "vehiculos_perdidos": perdidos,
+        "tasa_perdidos": round(perdidos / vehiculos, 3) if vehiculos else 0.0,
+        "us_por_puntaje": round(tiempo_puntaje * 1e6 / total, 1) if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inferencias ahorradas y detecciones perdidas con la compuerta')
+    parser.add_argument('--video', help='Video grabado (por defecto, uno sintético)')
+    parser.add_argument('--detecciones', help='JSONL de detecciones de referencia por frame')
+    parser.add_argument('--frames', type=int, default=1800)
+    parser.add_argument('--vehiculos', type=int, default=15)
+    parser.add_argument('--fps', type=float, default=15.0)
+    agregar_argumentos(parser)
+    args = parser.parse_args()
+
+    from tracker import cargar_secuencia, generar_secuencia
+    if args.detecciones:
+        secuencia = cargar_secuencia(args.detecciones)
+    else:
+        secuencia = generar_secuencia(args.vehiculos, args.frames)
+
+    for metodo in METODOS:
+        for fps_reposo in (0.5, 1.0, 2.0):
+            frames = frames_video(args.video) if args.video else video_sintetico(secuencia)
+            resultado = evaluar(frames, secuencia, PuntajeMovimiento(metodo),
+                                PoliticaInferencia(args.compuerta_umbral, fps_reposo, args.espera_reposo),
+                                args.fps)
+            print(f"📊 {metodo:10s} reposo {fps_reposo:.1f} fps | ahorro "
+                  f"{resultado['inferencias_ahorradas'] * 100:5.1f}% | frames con detección saltados "
+                  f"{resultado['frames_con_deteccion_saltados'] * 100:5.1f}% | vehículos perdidos "
+                  f"{resultado['vehiculos_perdidos']}/{resultado['vehiculos']} | "
+                  f"{resultado['us_por_puntaje']} µs/frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import argparse
+from collections import deque
+
+import numpy as np
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst, GLib
+except (ImportError, ValueError):
+    Gst = None
+    GLib = None
+
+from eventos import registro, agregar_argumentos as agregar_argumentos_eventos, configurar_desde_args
+
+ZONA_TERMICA = "/sys/class/thermal/thermal_zone0/temp"
+
+
+def leer_temperatura(path=ZONA_TERMICA):
+    """Temperatura del SoC en °C (None si la zona térmica no existe, p.ej. fuera de la Pi)"""
+    try:
+        with open(path) as f:
+            return int(f.read().strip()) / 1000.0
+    except (OSError, ValueError):
+        return None
+
+
+class PoliticaTasa:
+    """Control AIMD de los fps de inferencia para sostener una latencia objetivo
+
+    Cada intervalo se mira el p95 de la latencia captura→callback, la
+    ocupación de las colas y la temperatura. Con cualquiera de ellos por
+    encima de su límite los fps bajan multiplicando por factor_baja (o por
+    objetivo/p95 si el exceso es mayor, sin bajar de la mitad); si todo está
+    holgado durante espera_subida segundos suben de a paso_subida. Tras un
+    cambio solo cuentan las latencias medidas con la tasa nueva.
+    """
+
+    def __init__(self, fps_max=15.0, fps_min=2.0, latencia_objetivo=0.2, max_cola=2,
+                 temp_max=80.0, histeresis=5.0, factor_baja=0.75, paso_subida=1.0,
+                 espera_subida=3.0, margen_subida=0.7, min_muestras=5, factor_vencido=2.0):
+        self.fps_max = fps_max
+        self.fps_min = fps_min
+        self.latencia_objetivo = latencia_objetivo
+        self.max_cola = max_cola
+        self.temp_max = temp_max
+        self.histeresis = histeresis
+        self.factor_baja = factor_baja
+        self.paso_subida = paso_subida
+        self.espera_subida = espera_subida
+        self.margen_subida = margen_subida
+        self.min_muestras = min_muestras
+        # Un frame que ya esperó factor_vencido veces la latencia objetivo se descarta sin procesar
+        self.factor_vencido = factor_vencido
+        self.fps = fps_max
+        self._ultimo_cambio = None
+
+    def presiones(self, p95, cola, temperatura):
+        """Motivos para bajar la tasa (lista vacía si no hay ninguno)"""
+        motivos = []
+        if p95 is not None and p95 > self.latencia_objetivo:
+            motivos.append("latencia")
+        if cola is not None and cola > self.max_cola:
+            motivos.append("cola")
+        if temperatura is not None and temperatura >= self.temp_max:
+            motivos.append("temperatura")
+        return motivos
+
+    def decidir(self, ahora, p95, cola=None, temperatura=None):
+        """(fps nuevos, motivos); p95 None significa que no hubo muestras suficientes"""
+        if self._ultimo_cambio is None:
+            self._ultimo_cambio = ahora
+        motivos = self.presiones(p95, cola, temperatura)
+        nuevo = self.fps
+        if motivos:
+            factor = self.factor_baja
+            if p95 is not None and p95 > self.latencia_objetivo:
+                factor = min(factor, max(0.5, self.latencia_objetivo / p95))
+            nuevo = max(self.fps_min, self.fps * factor)
+        elif (p95 is not None and p95 < self.latencia_objetivo * self.margen_subida
+              and (temperatura is None or temperatura < self.temp_max - self.histeresis)
+              and ahora - self._ultimo_cambio >= self.espera_subida):
+            nuevo = min(self.fps_max, self.fps + self.paso_subida)
+            motivos = ["holgura"]
+        if nuevo == self.fps:
+            return self.fps, []
+        self.fps = nuevo
+        self._ultimo_cambio = ahora
+        return nuevo, motivos
+
+    def vencido(self, espera):
+        return espera > self.latencia_objetivo * self.factor_vencido
+
+
+class ControladorTasa:
+    """Lazo cerrado sobre el max-rate de un videorate antes del preproceso
+
+    observar() recibe la latencia de cada frame (el probe de instalar() la
+    mide al salir del callback de Python); paso() junta los sensores, decide
+    con la política y aplica los fps. Mientras la tasa nueva hace efecto,
+    descartar(buffer) le dice al callback que saltee los frames que ya
+    llegaron vencidos, así la cola acumulada se vacía enseguida. Los sensores
+    de cola y temperatura y el reloj se pueden reemplazar para probarlo sin
+    GStreamer.
+    """
+
+    def __init__(self, politica=None, intervalo=1.0, leer_temperatura=leer_temperatura,
+                 leer_cola=None, aplicar=None, registro_metricas=None, reloj=time.monotonic,
+                 ventana=2):
+        self.politica = politica or PoliticaTasa()
+        self.intervalo = intervalo
+        self.leer_temperatura = leer_temperatura
+        self.leer_cola = leer_cola
+        self.aplicar = aplicar
+        self.registro_metricas = registro_metricas
+        self.reloj = reloj
+        # Latencias de los últimos ventana ciclos: el p95 refleja solo lo reciente
+        self._latencias = []
+        self._ventanas = deque(maxlen=ventana)
+        self._videorate = None
+        self._pipeline = None
+        self._colas = []
+        self._fuente_id = None
+
+        # Contadores
+        self.bajadas = 0
+        self.subidas = 0
+        self.vencidos = 0
+        self.ultimo = {}
+
+    def observar(self, latencia):
+        self._latencias.append(latencia)
+
+    def vencido(self, espera):
+        """True si un frame que esperó espera segundos ya no vale la pena procesarlo"""
+        if self.politica.vencido(espera):
+            self.vencidos += 1
+            return True
+        return False
+
+    def paso(self, ahora=None):
+        """Un ciclo de control; devuelve los fps vigentes"""
+        ahora = self.reloj() if ahora is None else ahora
+        self._ventanas.append(self._latencias)
+        self._latencias = []
+        muestras = [latencia for ventana in self._ventanas for latencia in ventana]
+        p95 = None
+        if len(muestras) >= self.politica.min_muestras:
+            p95 = float(np.percentile(muestras, 95))
+        cola = self.leer_cola() if self.leer_cola is not None else None
+        temperatura = self.leer_temperatura() if self.leer_temperatura is not None else None
+
+        anterior = self.politica.fps
+        fps, motivos = self.politica.decidir(ahora, p95, cola, temperatura)
+        self.ultimo = {"fps": round(fps, 2), "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                       "cola": cola, "temperatura": temperatura}
+        if motivos:
+            # Las latencias medidas con la tasa anterior ya no dicen nada de la nueva
+            self._ventanas.clear()
+            if fps < anterior:
+                self.bajadas += 1
+            else:
+                self.subidas += 1
+            if self.aplicar is not None:
+                self.aplicar(fps)
+            flecha = "⬇️" if fps < anterior else "⬆️"
+            registro().evento("control_tasa",
+                              f"{flecha} Tasa de inferencia {anterior:.1f} → {fps:.1f} fps "
+                              f"({', '.join(motivos)})",
+                              fps_anterior=round(anterior, 2), motivos=motivos, **self.ultimo)
+        self._publicar(motivos, fps < anterior)
+        return fps
+
+    def _publicar(self, motivos, bajada):
+        if self.registro_metricas is None:
+            return
+        self.registro_metricas.fijar("control_fps_objetivo", self.politica.fps)
+        if self.ultimo.get("p95_ms") is not None:
+            self.registro_metricas.fijar("control_latencia_p95_segundos", self.ultimo["p95_ms"] / 1000)
+        if self.ultimo.get("temperatura") is not None:
+            self.registro_metricas.fijar("control_temperatura_celsius", self.ultimo["temperatura"])
+        if self.ultimo.get("cola") is not None:
+            self.registro_metricas.fijar("control_cola_buffers", self.ultimo["cola"])
+        if motivos:
+            self.registro_metricas.incrementar("control_cambios_total",
+                                               etiquetas={"direccion": "baja" if bajada else "sube"})
+
+    # -------------------------------------------------------------------------
+    # GStreamer
+    # -------------------------------------------------------------------------
+    def instalar(self, pipeline, videorate="tasa", callback="identity_callback"):
+        """Conectar el videorate, las colas del pipeline y la medición de latencia"""
+        self._pipeline = pipeline
+        self._videorate = pipeline.get_by_name(videorate)
+        if self._videorate is None:
+            raise RuntimeError(f"No existe el elemento {videorate}")
+        self.aplicar = lambda fps: self._videorate.set_property("max-rate", max(1, int(round(fps))))
+        self._colas = [e for e in pipeline.iterate_recurse()
+                       if e.get_factory() is not None and e.get_factory().get_name() == "queue"]
+        if self.leer_cola is None and self._colas:
+            self.leer_cola = lambda: max(c.get_property("current-level-buffers") for c in self._colas)
+        # El probe va en el pad que sigue al callback: corre después del app_callback
+        salida = pipeline.get_by_name(callback).get_static_pad("src").get_peer()
+        salida.add_probe(Gst.PadProbeType.BUFFER, self._medir, pipeline)
+
+    def latencia_de(self, buffer, pipeline=None):
+        """Segundos desde la captura del buffer (None sin reloj o sin pts)"""
+        pipeline = pipeline or self._pipeline
+        reloj = pipeline.get_clock() if pipeline is not None else None
+        if reloj is None or buffer.pts == Gst.CLOCK_TIME_NONE:
+            return None
+        # En fuentes en vivo el pts es el running time de la captura
+        ahora = reloj.get_time() - pipeline.get_base_time()
+        return max(0, ahora - buffer.pts) / Gst.SECOND
+
+    def descartar(self, buffer):
+        """Para el callback: True si el frame llegó vencido y conviene saltearlo"""
+        espera = self.latencia_de(buffer)
+        return espera is not None and self.vencido(espera)
+
+    def _medir(self, pad, info, pipeline):
+        buffer = info.get_buffer()
+        if buffer is not None:
+            latencia = self.latencia_de(buffer, pipeline)
+            if latencia is not None:
+                self.observar(latencia)
+        return Gst.PadProbeReturn.OK
+
+    def iniciar(self):
+        def tick():
+            self.paso()
+            return True
+        self._fuente_id = GLib.timeout_add(int(self.intervalo * 1000), tick)
+
+    def detener(self):
+        if self._fuente_id is not None:
+            GLib.source_remove(self._fuente_id)
+            self._fuente_id = None
+
+    def estadisticas(self):
+        return {"fps": round(self.politica.fps, 2), "bajadas": self.bajadas, "subidas": self.subidas,
+                "vencidos": self.vencidos,
+                **{k: v for k, v in self.ultimo.items() if k != "fps"}}
+
+
+def elementos_tasa(fps_max, nombre="tasa"):
+    """videorate que solo descarta: max-rate se cambia en caliente sin renegociar caps"""
+    return [f"videorate name={nombre} drop-only=true max-rate={int(fps_max)}"]
+
+
+def insertar(espec, fps_max, antes_de="name=letterbox"):
+    """Poner el videorate en el preproceso, antes del escalador: los frames descartados no se convierten"""
+    indice = next((i for i, e in enumerate(espec.preproceso) if antes_de in e.split()),
+                  len(espec.preproceso))
+    espec.preproceso[indice:indice] = elementos_tasa(fps_max)
+    return espec
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--latencia-objetivo', type=float, metavar='MS',
+                        help='Activar el control de tasa: bajar los fps de inferencia para sostener '
+                             'esta latencia captura→callback (p95)')
+    parser.add_argument('--fps-min', type=float, default=2.0,
+                        help='Piso de fps del control de tasa')
+    parser.add_argument('--temp-max', type=float, default=80.0,
+                        help='Temperatura del SoC (°C) a partir de la cual se baja la tasa')
+
+
+def desde_argumentos(args, fps_max, registro_metricas=None):
+    if args.latencia_objetivo is None:
+        return None
+    politica = PoliticaTasa(fps_max=fps_max, fps_min=args.fps_min,
+                            latencia_objetivo=args.latencia_objetivo / 1000.0, temp_max=args.temp_max)
+    return ControladorTasa(politica, registro_metricas=registro_metricas)
+
+
+# -----------------------------------------------------------------------------------------------
+# Simulación: cámara, cola y un callback que se vuelve lento, con sensores simulados
+# -----------------------------------------------------------------------------------------------
+class SimulacionPipeline:
+    """Un servidor (callback) con cola FIFO, alimentado por una cámara a fps de la fuente
+
+    El tiempo de servicio sale de servicio(t) y se multiplica por 1.5 cuando
+    la temperatura simulada pasa el límite de throttling; la temperatura
+    sigue a la carga con una constante de tiempo.
+    """
+
+    def __init__(self, fps_camara, servicio, temp_ambiente=45.0, temp_carga=45.0,
+                 temp_throttling=82.0, constante=20.0):
+        self.fps_camara = fps_camara
+        self.servicio = servicio
+        self.temp_ambiente = temp_ambiente
+        self.temp_carga = temp_carga
+        self.temp_throttling = temp_throttling
+        self.constante = constante
+        self.temperatura = temp_ambiente
+        self.libre_en = 0.0
+        self._pendientes = deque()
+
+    def correr(self, desde, hasta, max_rate, observar, vencido=None):
+        """Frames de la cámara en [desde, hasta); videorate deja pasar max_rate por segundo
+
+        observar(latencia, procesado) recibe cada frame que llegó al callback;
+        vencido(espera) decide si el callback lo saltea (cuesta 1 ms).
+        """
+        periodo_camara = 1.0 / self.fps_camara
+        periodo = max(periodo_camara, 1.0 / max_rate)
+        t = desde
+        procesados, ocupado = 0, 0.0
+        while t < hasta:
+            inicio = max(t, self.libre_en)
+            procesado = vencido is None or not vencido(inicio - t)
+            servicio = self.servicio(t) if procesado else 0.001
+            if self.temperatura >= self.temp_throttling:
+                servicio *= 1.5
+            self.libre_en = inicio + servicio
+            self._pendientes.append(self.libre_en)
+            observar(self.libre_en - t, procesado)
+            procesados += procesado
+            ocupado += servicio
+            # videorate descarta los frames de la cámara que caen antes del próximo periodo
+            t += np.ceil(periodo / periodo_camara - 1e-9) * periodo_camara
+        carga = min(1.0, ocupado / (hasta - desde))
+        objetivo = self.temp_ambiente + self.temp_carga * carga
+        self.temperatura += (objetivo - self.temperatura) * (1 - np.exp(-(hasta - desde) / self.constante))
+        return procesados
+
+    def cola(self, ahora):
+        while self._pendientes and self._pendientes[0] <= ahora:
+            self._pendientes.popleft()
+        return len(self._pendientes)
+
+
+# Segundos de la simulación en los que el callback se vuelve lento, y los que
+# hacen falta después para que el control vuelva a subir los fps
+FASE_LENTA = (20.0, 50.0)
+RECUPERACION = 20.0
+
+
+def simular(segundos, con_control, objetivo, fps_camara=15.0, intervalo=1.0):
+    # Callback de 45 ms (22 fps de capacidad) que en la fase lenta tarda 110 ms (9 fps)
+    def servicio(t):
+        return 0.110 if FASE_LENTA[0] <= t < FASE_LENTA[1] else 0.045
+
+    sim = SimulacionPipeline(fps_camara, servicio)
+    latencias = []
+    controlador = ControladorTasa(
+        PoliticaTasa(fps_max=fps_camara, latencia_objetivo=objetivo),
+        intervalo=intervalo, leer_temperatura=lambda: sim.temperatura)
+    fps = fps_camara
+    procesados = 0
+    historia = []
+    t = 0.0
+    while t < segundos:
+        def observar(latencia, procesado):
+            if procesado:
+                latencias.append((t, latencia))
+            controlador.observar(latencia)
+        procesados += sim.correr(t, t + intervalo, fps, observar,
+                                 controlador.vencido if con_control else None)
+        t += intervalo
+        if con_control:
+            controlador.leer_cola = lambda: sim.cola(t)
+            fps = controlador.paso(ahora=t)
+        historia.append((t, fps, sim.temperatura))
+    return latencias, procesados, historia, controlador
+
+
+def _segundos_simulacion(texto):
+    segundos = float(texto)
+    minimo = FASE_LENTA[1] + RECUPERACION
+    if segundos < minimo:
+        raise argparse.ArgumentTypeError(
+            f"la simulación debe cubrir la fase lenta ({FASE_LENTA[0]:.0f}-{FASE_LENTA[1]:.0f} s) "
+            f"y la recuperación: al menos {minimo:.0f}")
+    return segundos
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Control de tasa con sensores simulados y un callback lento')
+    parser.add_argument('--segundos', type=_segundos_simulacion, default=90.0,
+                        help=f'Duración simulada (mínimo {FASE_LENTA[1] + RECUPERACION:.0f} s)')
+    parser.add_argument('--objetivo-ms', type=float, default=250.0)
+    parser.add_argument('--temperatura', help='Mostrar la temperatura real de esta zona térmica',
+                        nargs='?', const=ZONA_TERMICA)
+    agregar_argumentos_eventos(parser)
+    args = parser.parse_args()
+    configurar_desde_args(args)
+
+    if args.temperatura:
+        print(f"🌡️  {args.temperatura}: {leer_temperatura(args.temperatura)} °C")
+
+    objetivo = args.objetivo_ms / 1000.0
+    resultados = {}
+    for nombre, con_control in (("sin_control", False), ("con_control", True)):
+        latencias, procesados, historia, controlador = simular(args.segundos, con_control, objetivo)
+        # Solo la fase lenta y la posterior: ahí es donde se acumulan los frames
+        tramo = np.array([l for t, l in latencias if t >= FASE_LENTA[0]])
+        resultados[nombre] = {
+            "procesados": procesados,
+            "p50_ms": round(float(np.percentile(tramo, 50)) * 1000, 1),
+            "p95_ms": round(float(np.percentile(tramo, 95)) * 1000, 1),
+            "max_ms": round(float(tramo.max()) * 1000, 1),
+            "temp_max": round(float(max(h[2] for h in historia)), 1),
+            "bajadas": controlador.bajadas,
+            "subidas": controlador.subidas,
+            "vencidos": controlador.vencidos,
+        }
+        if con_control:
+            resumen = " ".join(f"{t:.0f}s:{f:.1f}" for t, f, _ in historia[::10])
+            print(f"📈 fps en el tiempo: {resumen}")
+        print(f"📊 {nombre}: {resultados[nombre]}")
+
+    ok = (resultados["con_control"]["p95_ms"] <= args.objetivo_ms * 1.5
+          and resultados["sin_control"]["p95_ms"] > args.objetivo_ms * 4)
+    print("✅ El control sostiene la latencia objetivo" if ok
+          else "❌ El control no sostuvo la latencia objetivo")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+
+import numpy as np
+
+# hailo solo existe en la Raspberry; sin él se puede trabajar con ROISimulado
+try:
+    import hailo
+    TIPO_DETECCION = hailo.HAILO_DETECTION
+    TIPO_UNIQUE_ID = hailo.HAILO_UNIQUE_ID
+except ImportError:
+    hailo = None
+    TIPO_DETECCION = "HAILO_DETECTION"
+    TIPO_UNIQUE_ID = "HAILO_UNIQUE_ID"
+
+
+class Detecciones:
+    """Detecciones de un frame como arrays de NumPy
+
+    class_id (int32 N), confianza (float32 N), xyxy (float32 Nx4, mismas
+    coordenadas que entrega hailo) y track_id (int64 N, 0 si no hay tracker).
+    nombres mapea class_id -> etiqueta.
+    """
+
+    __slots__ = ("class_id", "confianza", "xyxy", "track_id", "nombres")
+
+    def __init__(self, class_id, confianza, xyxy, track_id=None, nombres=None):
+        self.class_id = class_id
+        self.confianza = confianza
+        self.xyxy = xyxy
+        self.track_id = track_id if track_id is not None else np.zeros(len(class_id), dtype=np.int64)
+        self.nombres = nombres if nombres is not None else {}
+
+    @classmethod
+    def vacias(cls, nombres=None):
+        return cls(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32),
+                   np.zeros((0, 4), dtype=np.float32), nombres=nombres)
+
+    def __len__(self):
+        return len(self.class_id)
+
+    def __getitem__(self, indice):
+        """Subconjunto por máscara booleana, índices o slice"""
+        return Detecciones(self.class_id[indice], self.confianza[indice], self.xyxy[indice],
+                           self.track_id[indice], self.nombres)
+
+    def etiqueta(self, i):
+        return self.nombres.get(int(self.class_id[i]), str(int(self.class_id[i])))
+
+    def etiquetas(self):
+        return [self.nombres.get(int(c), str(int(c))) for c in self.class_id]
+
+    def tabla_de(self, etiquetas):
+        """Tabla booleana indexada por class_id con las etiquetas pedidas
+
+        Solo incluye las clases que ya aparecieron; se indexa con class_id en
+        lugar de usar np.isin, que es caro para pocos elementos.
+        """
+        maximo = max(self.nombres, default=0)
+        if len(self.class_id):
+            maximo = max(maximo, int(self.class_id.max()))
+        tabla = np.zeros(maximo + 1, dtype=bool)
+        for cid, nombre in self.nombres.items():
+            if nombre in etiquetas:
+                tabla[cid] = True
+        return tabla
+
+    def xywh(self):
+        """Cajas como (xmin, ymin, width, height)"""
+        cajas = self.xyxy.copy()
+        cajas[:, 2:] -= cajas[:, :2]
+        return cajas
+
+    def areas(self):
+        return (self.xyxy[:, 2] - self.xyxy[:, 0]) * (self.xyxy[:, 3] - self.xyxy[:, 1])
+
+    def centros(self):
+        return (self.xyxy[:, :2] + self.xyxy[:, 2:]) * 0.5
+
+
+# Caché de class_id -> etiqueta compartida entre frames: get_label() solo se
+# llama la primera vez que aparece cada clase.
+_NOMBRES = {}
+
+
+def extraer_detecciones(roi, con_track_id=False, nombres=_NOMBRES):
+    """Convertir las detecciones de un HailoROI en Detecciones en una sola pasada"""
+    objetos = roi.get_objects_typed(TIPO_DETECCION)
+    n = len(objetos)
+    if n == 0:
+        return Detecciones.vacias(nombres)
+
+    valores = []
+    track_id = np.zeros(n, dtype=np.int64)
+    for i, det in enumerate(objetos):
+        cid = det.get_class_id()
+        if cid not in nombres:
+            nombres[cid] = det.get_label()
+        bbox = det.get_bbox()
+        valores += (cid, det.get_confidence(), bbox.xmin(), bbox.ymin(), bbox.xmax(), bbox.ymax())
+        if con_track_id:
+            ids = det.get_objects_typed(TIPO_UNIQUE_ID)
+            if len(ids) == 1:
+                track_id[i] = ids[0].get_id()
+    # Una sola conversión a NumPy para todo el frame (lista plana: más rápida que tuplas)
+    datos = np.array(valores, dtype=np.float32).reshape(n, 6)
+    class_id = datos[:, 0].astype(np.int32)
+    confianza = datos[:, 1]
+    xyxy = datos[:, 2:]
+    return Detecciones(class_id, confianza, xyxy, track_id, nombres)
+
+
+class Poligono:
+    """Polígono de interés con las aristas precalculadas para el test punto-en-polígono"""
+
+    def __init__(self, vertices):
+        v = np.asarray(vertices, dtype=np.float32).reshape(-1, 2)
+        self.vertices = v
+        self.x1, self.y1 = v[:, 0], v[:, 1]
+        x2, y2 = np.roll(self.x1, -1), np.roll(self.y1, -1)
+        dy = y2 - self.y1
+        # Pendiente inversa por arista; las horizontales nunca cruzan el rayo
+        self.pendiente = np.divide(x2 - self.x1, dy, out=np.zeros_like(dy), where=dy != 0)
+        self.y2 = y2
+
+
+def puntos_en_poligono(puntos, poligono):
+    """Ray casting vectorizado: máscara de los puntos (Nx2) dentro del polígono"""
+    if not isinstance(poligono, Poligono):
+        poligono = Poligono(poligono)
+    puntos = np.asarray(puntos, dtype=np.float32).reshape(-1, 2)
+    x = puntos[:, 0:1]
+    y = puntos[:, 1:2]
+    cruza = (poligono.y1 > y) != (poligono.y2 > y)
+    x_corte = poligono.x1 + (y - poligono.y1) * poligono.pendiente
+    return np.count_nonzero(cruza & (x < x_corte), axis=1) % 2 == 1
+
+
+def filtrar(detecciones, etiquetas=None, umbral=None, poligono=None, area_minima=None):
+    """Máscara booleana combinando clase, umbral de confianza, polígono y área mínima
+
+    poligono puede ser una lista de vértices o un Poligono ya construido
+    (conviene construirlo una vez fuera del callback).
+    """
+    mascara = np.ones(len(detecciones), dtype=bool)
+    if not len(detecciones):
+        return mascara
+    if etiquetas is not None:
+        mascara &= detecciones.tabla_de(etiquetas)[detecciones.class_id]
+    if umbral is not None:
+        mascara &= detecciones.confianza > umbral
+    if area_minima is not None:
+        mascara &= detecciones.areas() >= area_minima
+    if poligono is not None:
+        mascara &= puntos_en_poligono(detecciones.centros(), poligono)
+    return mascara
+
+
+# -----------------------------------------------------------------------------------------------
+# ROI simulado (sin el módulo hailo) para pruebas y benchmarks
+# -----------------------------------------------------------------------------------------------
+class BBoxSimulada:
+    def __init__(self, xmin, ymin, width, height):
+        self._xmin = xmin
+        self._ymin = ymin
+        self._width = width
+        self._height = height
+
+    def xmin(self):
+        return self._xmin
+
+    def ymin(self):
+        return self._ymin
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def xmax(self):
+        return self._xmin + self._width
+
+    def ymax(self):
+        return self._ymin + self._height
+
+
+class UniqueIdSimulado:
+    def __init__(self, track_id):
+        self._id = track_id
+
+    def get_id(self):
+        return self._id
+
+
+class DeteccionSimulada:
+    def __init__(self, label, class_id, confidence, bbox, track_id=0):
+        self._label = label
+        self._class_id = class_id
+        self._confidence = confidence
+        self._bbox = BBoxSimulada(*bbox)
+        self._ids = [UniqueIdSimulado(track_id)] if track_id else []
+
+    def get_label(self):
+        return self._label
+
+    def get_class_id(self):
+        return self._class_id
+
+    def get_confidence(self):
+        return self._confidence
+
+    def get_bbox(self):
+        return self._bbox
+
+    def get_objects_typed(self, tipo):
+        return self._ids if tipo == TIPO_UNIQUE_ID else []
+
+
+class ROISimulado:
+    """Imita hailo.HailoROI: solo get_objects_typed(HAILO_DETECTION)"""
+
+    def __init__(self, detecciones=None):
+        self.detecciones = list(detecciones or [])
+
+    def get_objects_typed(self, tipo):
+        return self.detecciones if tipo == TIPO_DETECCION else []
+
+    def add_object(self, deteccion):
+        self.detecciones.append(deteccion)
+
+
+# Subconjunto de COCO usado por los scripts
+CLASES_COCO = {1: "person", 2: "bicycle", 3: "car", 4: "motorbike", 6: "bus", 8: "truck",
+               15: "bird", 16: "cat", 17: "dog"}
+
+
+def roi_aleatorio(rng, n):
+    ids = rng.choice(list(CLASES_COCO), n)
+    cajas = rng.uniform(0, 0.8, (n, 2))
+    tamanos = rng.uniform(0.02, 0.2, (n, 2))
+    confianzas = rng.uniform(0.1, 1.0, n)
+    return ROISimulado([
+        DeteccionSimulada(CLASES_COCO[int(c)], int(c), float(p), (*map(float, xy), *map(float, wh)))
+        for c, p, xy, wh in zip(ids, confianzas, cajas, tamanos)
+    ])
+
+
+def _filtrar_por_objeto(roi, etiquetas, umbral):
+    """Camino actual de los callbacks: accesores y if por cada objeto"""
+    resultado = []
+    for detection in roi.get_objects_typed(TIPO_DETECCION):
+        label = detection.get_label()
+        confidence = detection.get_confidence()
+        bbox = detection.get_bbox()
+        x, y, w, h = bbox.xmin(), bbox.ymin(), bbox.width(), bbox.height()
+        if label in etiquetas and confidence > umbral:
+            resultado.append((label, confidence, (x, y, w, h)))
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de extracción de detecciones')
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--objetos', type=int, nargs='+', default=[2, 20, 100],
+                        help='Detecciones por frame a medir')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    etiquetas = ["car", "truck", "bus"]
+    poligono = Poligono([(0.0, 0.2), (1.0, 0.2), (1.0, 1.0), (0.0, 1.0)])
+
+    for objetos in args.objetos:
+        rois = [roi_aleatorio(rng, objetos) for _ in range(64)]
+
+        inicio = time.perf_counter()
+        for i in range(args.frames):
+            _filtrar_por_objeto(rois[i % len(rois)], etiquetas, 0.3)
+        t_objeto = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        for i in range(args.frames):
+            dets = extraer_detecciones(rois[i % len(rois)])
+            dets[filtrar(dets, etiquetas, 0.3)]
+        t_vector = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        for i in range(args.frames):
+            dets = extraer_detecciones(rois[i % len(rois)])
+            dets[filtrar(dets, etiquetas, 0.3, poligono, area_minima=0.001)]
+        t_completo = time.perf_counter() - inicio
+
+        print(f"📊 {objetos} objetos/frame | por objeto: {t_objeto * 1e6 / args.frames:.1f} µs | "
+              f"vectorizado: {t_vector * 1e6 / args.frames:.1f} µs | "
+              f"+ polígono y área: {t_completo * 1e6 / args.frames:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
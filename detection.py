@@ -3,12 +3,28 @@ gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GLib
 import os
 import signal
-import numpy as np
-import cv2
 import argparse
-from pathlib import Path
 import datetime
+import time
 import hailo
+from captura_hd import MODOS as MODOS_HD, CapturadorHD
+from frame_handle import mapear_frame
+from escritor_imagenes import ANOTACIONES, PRESETS, EscritorImagenes
+from detecciones import Detecciones, extraer_detecciones, filtrar
+from eventos import registro, agregar_argumentos, configurar_desde_args, cerrar_eventos
+import metricas
+import pipelines
+import compuerta_movimiento
+import letterbox
+import clips
+import bus_frames
+import almacen
+import gestor_disco
+import captura
+import control_tasa
+from tracker import RastreadorIoU, CRITERIOS_MEJOR
+
+FPS_CAMARA = 15
 
 def get_caps_from_pad(pad):
     caps = pad.get_current_caps()
@@ -20,60 +36,6 @@ def get_caps_from_pad(pad):
     height = structure.get_int('height')[1]
     return format_str, width, height
 
-def get_numpy_from_buffer(buffer, format_str, width, height):
-    result, map_info = buffer.map(Gst.MapFlags.READ)
-    if not result:
-        return None
-    try:
-        array = np.frombuffer(map_info.data, dtype=np.uint8)
-        if format_str in ("RGB", "BGR"):
-            return array.reshape((height, width, 3))
-        elif format_str == "GRAY8":
-            return array.reshape((height, width))
-        else:
-            return None
-    except Exception:
-        return None
-    finally:
-        buffer.unmap(map_info)
-
-def capturar_imagen_hd(timestamp):
-    cap = cv2.VideoCapture("/dev/video2")
-    if not cap.isOpened():
-        print("❌ No se pudo abrir /dev/video2")
-        return
-
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
-    ret, frame = cap.read()
-    cap.release()
-    if ret:
-        Path("capturas_hd").mkdir(parents=True, exist_ok=True)
-        path = f"capturas_hd/captura_hd_{timestamp}.jpg"
-        cv2.imwrite(path, frame)
-        print(f"📸 Imagen HD capturada: {path}")
-    else:
-        print("⚠️ No se pudo capturar imagen desde /dev/video2")
-
-def guardar_frame(frame, label, confidence, bbox, carpeta, index):
-    Path(carpeta).mkdir(parents=True, exist_ok=True)
-    base_filename = f"frame_{index:04d}_{label}_{confidence:.3f}"
-    image_path = os.path.join(carpeta, base_filename + ".jpg")
-    bbox_image_path = os.path.join(carpeta, base_filename + "_bbox.jpg")
-
-    cv2.imwrite(image_path, frame)
-    height, width = frame.shape[:2]
-    x1 = max(0, min(int(bbox.xmin()), width - 1))
-    y1 = max(0, min(int(bbox.ymin()), height - 1))
-    x2 = max(0, min(x1 + int(bbox.width()), width - 1))
-    y2 = max(0, min(y1 + int(bbox.height()), height - 1))
-
-    bbox_frame = frame.copy()
-    cv2.rectangle(bbox_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-    cv2.putText(bbox_frame, f"{label}: {confidence:.2f}", (x1, y1 - 10),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-    cv2.imwrite(bbox_image_path, bbox_frame)
-
 class app_callback_class:
     def __init__(self):
         self.counter = 0
@@ -82,6 +44,23 @@ class app_callback_class:
         self.target_classes = ["car", "truck", "bus", "vehicle"]
         self.carpeta = ""
         self.index = 0
+        self.capturador_hd = None
+        self.escritor = None
+        self.rastreador = None
+        self.compuerta = None
+        self.letterbox = None
+        self.clips = None
+        self.bus = None
+        self.almacen = None
+        self.almacen_detecciones = False
+        # Primer instante en que se vio cada track (para la tabla tracks)
+        self.inicio_tracks = {}
+        self.calibracion_hd = None
+        # Instante del frame actual en el reloj del anillo HD (PTS en modo rama)
+        self.instante_hd = None
+        self.control = None
+        # True si el frame actual se saltó la inferencia (compuerta de movimiento)
+        self.saltado = False
 
     def increment(self):
         self.counter += 1
@@ -92,37 +71,209 @@ def app_callback(pad, info, user_data):
         return Gst.PadProbeReturn.OK
 
     user_data.increment()
-    format_str, width, height = get_caps_from_pad(pad)
+    user_data.saltado = user_data.compuerta is not None and user_data.compuerta.saltado(buffer.pts)
+    if user_data.saltado:
+        # El frame no pasó por hailonet: no hay detecciones que procesar
+        return Gst.PadProbeReturn.OK
+    if user_data.control is not None and user_data.control.descartar(buffer):
+        # Llegó vencido (el callback viene atrasado): saltearlo vacía la cola enseguida
+        return Gst.PadProbeReturn.OK
+
     frame = None
-    if user_data.use_frame and format_str and width and height:
-        frame = get_numpy_from_buffer(buffer, format_str, width, height)
+    if user_data.use_frame:
+        # Vista sin copia; el buffer queda mapeado hasta liberar el handle
+        frame = mapear_frame(buffer, pad)
+    try:
+        procesar_detecciones(buffer, frame, user_data)
+    finally:
+        if frame is not None:
+            frame.liberar()
+    return Gst.PadProbeReturn.OK
+
+def nuevo_timestamp(ahora):
+    return datetime.datetime.fromtimestamp(ahora).strftime('%Y%m%d_%H%M%S_%f')
+
+def carpeta_actual(user_data, timestamp):
+    if not user_data.carpeta:
+        user_data.carpeta = f"detections_vehicles/detection_{timestamp}"
+    return user_data.carpeta
 
+class ObservacionVehiculo:
+    """Mejor observación de un track: frame retenido, frame HD y la detección
+
+    bbox es xywh en píxeles del frame retenido (la entrada del modelo);
+    caja_camara y caja_hd son xyxy en píxeles de cada cámara.
+    """
+    def __init__(self, ahora, label, confidence, bbox, frame, frame_hd, caja_camara=None, caja_hd=None,
+                 instante_hd=None):
+        self.ahora = ahora
+        self.instante_hd = instante_hd
+        self.label = label
+        self.confidence = confidence
+        self.bbox = bbox
+        self.frame = frame
+        self.frame_hd = frame_hd
+        self.caja_camara = caja_camara
+        self.caja_hd = caja_hd
+
+    def liberar(self):
+        if self.frame is not None:
+            self.frame.liberar()
+            self.frame = None
+
+def procesar_detecciones(buffer, frame, user_data):
     try:
         roi = hailo.get_roi_from_buffer(buffer)
-        detections = roi.get_objects_typed(hailo.HAILO_DETECTION)
+        detecciones = extraer_detecciones(roi, con_track_id=True)
     except Exception:
-        return Gst.PadProbeReturn.OK
+        detecciones = Detecciones.vacias()
+
+    eventos = registro()
+    if eventos.habilitado():
+        eventos.detecciones(detecciones.etiquetas(), detecciones.confianza)
+    if user_data.bus is not None and frame is not None:
+        # Una copia al slot compartido; los procesos de análisis leen sin copiar
+        user_data.bus.publicar(frame.array, detecciones, pts=buffer.pts)
+
+    candidatas = detecciones[filtrar(detecciones, user_data.target_classes,
+                                     user_data.confidence_threshold)]
+    cajas = cajas_por_espacio(candidatas, buffer, frame, user_data)
+    if user_data.capturador_hd is not None:
+        user_data.instante_hd = user_data.capturador_hd.instante_de(buffer)
+    if user_data.rastreador is None:
+        guardar_cada_deteccion(candidatas, cajas, frame, user_data)
+    else:
+        guardar_por_vehiculo(candidatas, cajas, frame, user_data)
 
-    for detection in detections:
-        label = detection.get_label()
-        confidence = detection.get_confidence()
-        bbox = detection.get_bbox()
+def cajas_por_espacio(candidatas, buffer, frame, user_data):
+    """(entrada, camara, hd): las cajas en píxeles de la entrada del modelo, la cámara y la HD
 
-        print(f"🔍 Detección: {label} ({confidence:.2f})")
+    hailo entrega coordenadas normalizadas a la entrada del modelo; el
+    letterbox del preproceso se deshace con la transformación del buffer.
+    """
+    transformacion = None
+    if user_data.letterbox is not None:
+        transformacion = user_data.letterbox.transformacion_de(buffer)
+    if transformacion is None:
+        # Sin letterbox registrado: la entrada del modelo es el frame (o 640x640)
+        ancho, alto = (frame.width, frame.height) if frame is not None else (640, 640)
+        transformacion = letterbox.Transformacion.identidad(ancho, alto)
+    tamano_hd = None
+    if user_data.capturador_hd is not None:
+        tamano_hd = (user_data.capturador_hd.ancho, user_data.capturador_hd.alto)
+    camara, hd = letterbox.desmapear(candidatas.xyxy, transformacion, tamano_hd,
+                                     user_data.calibracion_hd)
+    return letterbox.a_entrada(candidatas.xyxy, transformacion), camara, hd
 
-        if label in user_data.target_classes and confidence > user_data.confidence_threshold:
-            timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-            capturar_imagen_hd(timestamp)
+def guardar_cada_deteccion(candidatas, cajas, frame, user_data):
+    entrada, camara, hd = cajas
+    clip = None
+    if user_data.clips is not None and len(entrada):
+        clip = user_data.clips.disparar(nuevo_timestamp(time.time()))
+    if user_data.almacen is not None and user_data.almacen_detecciones:
+        user_data.almacen.registrar_detecciones(time.time(), candidatas, camara, user_data.counter)
+    a_guardar = []
+    eventos = []
+    for i, bbox in enumerate(entrada):
+        ahora = time.time()
+        timestamp = nuevo_timestamp(ahora)
+        if user_data.capturador_hd is not None:
+            # No bloquea: el hilo del capturador elige el frame HD más cercano
+            user_data.capturador_hd.solicitar(user_data.instante_hd, timestamp, tuple(hd[i]))
+        carpeta_actual(user_data, timestamp)
+        user_data.index += 1
+        label, confidence = candidatas.etiqueta(i), float(candidatas.confianza[i])
+        if frame is not None:
+            a_guardar.append((user_data.index, label, confidence, tuple(bbox)))
+        if user_data.almacen is not None:
+            eventos.append((ahora, timestamp, int(candidatas.track_id[i]) or None, label, confidence,
+                            camara[i]))
 
-            if not user_data.carpeta:
-                base_folder = f"detections_vehicles/detection_{timestamp}"
-                user_data.carpeta = base_folder
+    if user_data.almacen is not None:
+        # Las rutas salen del escritor: sin recorte, las detecciones del frame comparten la imagen
+        rutas = user_data.escritor.rutas(user_data.carpeta, a_guardar) if a_guardar else [None] * len(eventos)
+        for (ahora, timestamp, track_id, label, confidence, caja), rutas_evento in zip(eventos, rutas):
+            registrar_evento(user_data, ahora, "deteccion", timestamp, track_id, label, confidence, caja,
+                             rutas_evento, clip)
 
-            user_data.index += 1
-            if frame is not None:
-                guardar_frame(frame, label, confidence, bbox, user_data.carpeta, user_data.index)
+    if a_guardar:
+        # La codificación y escritura se hacen en el pool, fuera del hilo de streaming
+        user_data.escritor.encolar(frame, a_guardar, user_data.carpeta)
 
-    return Gst.PadProbeReturn.OK
+def guardar_por_vehiculo(candidatas, cajas, frame, user_data):
+    """Una captura por track, con la mejor observación de todo su recorrido"""
+    entrada, camara, hd = cajas
+    ahora = time.time()
+    ids_externos = candidatas.track_id
+    if not len(candidatas) or not ids_externos.all():
+        ids_externos = None
+
+    def crear_dato(i):
+        frame_hd = None
+        if user_data.capturador_hd is not None:
+            frame_hd = user_data.capturador_hd.frame_en(user_data.instante_hd)
+        retenido = frame.retener() if frame is not None else None
+        return ObservacionVehiculo(ahora, candidatas.etiqueta(i), float(candidatas.confianza[i]),
+                                   tuple(map(float, entrada[i])), retenido, frame_hd,
+                                   tuple(map(float, camara[i])),
+                                   tuple(map(float, hd[i])) if hd is not None else None,
+                                   user_data.instante_hd)
+
+    ids, listos = user_data.rastreador.actualizar(candidatas.xyxy, candidatas.confianza,
+                                                  candidatas.class_id, ids_externos, crear_dato)
+    if user_data.almacen is not None:
+        for track_id in ids:
+            user_data.inicio_tracks.setdefault(int(track_id), ahora)
+        if user_data.almacen_detecciones:
+            user_data.almacen.registrar_detecciones(ahora, candidatas, camara, user_data.counter, ids)
+    for track in listos:
+        emitir_captura(track, user_data)
+
+def emitir_captura(track, user_data):
+    obs = track.mejor_dato
+    if obs is None:
+        return
+    timestamp = nuevo_timestamp(obs.ahora)
+    carpeta = carpeta_actual(user_data, timestamp)
+    user_data.index += 1
+    if user_data.capturador_hd is not None:
+        if obs.frame_hd is not None:
+            user_data.capturador_hd.guardar(obs.frame_hd, timestamp, obs.caja_hd)
+        else:
+            user_data.capturador_hd.solicitar(obs.instante_hd, timestamp, obs.caja_hd)
+    clip = None
+    if user_data.clips is not None:
+        # El clip se centra en la mejor observación, no en el fin del track
+        clip = user_data.clips.disparar(timestamp, obs.ahora)
+    guardado = [(user_data.index, obs.label, obs.confidence, obs.bbox)]
+    if user_data.almacen is not None:
+        rutas = user_data.escritor.rutas(carpeta, guardado)[0] if obs.frame is not None else None
+        registrar_evento(user_data, obs.ahora, "captura", timestamp, int(track.id), obs.label,
+                         obs.confidence, obs.caja_camara, rutas, clip)
+        inicio = user_data.inicio_tracks.pop(int(track.id), obs.ahora)
+        user_data.almacen.registrar_track(track.id, obs.label, inicio, time.time(), track.hits,
+                                          obs.confidence, timestamp)
+    if obs.frame is not None:
+        user_data.escritor.encolar(obs.frame, guardado, carpeta)
+    registro().evento("captura", f"🚗 Vehículo #{track.id} ({obs.label}, {obs.confidence:.2f}) capturado",
+                      track_id=int(track.id), clase=obs.label, confianza=round(obs.confidence, 4),
+                      carpeta=carpeta, index=user_data.index, timestamp=timestamp,
+                      caja_camara=[round(v, 1) for v in obs.caja_camara] if obs.caja_camara else None)
+    obs.liberar()
+    track.mejor_dato = None
+
+def registrar_evento(user_data, ahora, tipo, timestamp, track_id, label, confidence, caja_camara,
+                     rutas, clip):
+    """Evento en la base con las rutas de la imagen, su anotación (_bbox o sidecar), la captura HD y el clip"""
+    imagen = imagen_bbox = imagen_hd = None
+    if rutas is not None:
+        imagen, imagen_bbox = rutas
+    if user_data.capturador_hd is not None:
+        imagen_hd = user_data.capturador_hd.ruta(timestamp)
+    if clip is not None:
+        clip = user_data.clips.ruta(clip)
+    user_data.almacen.registrar_evento(ahora, tipo, timestamp, track_id, label, confidence,
+                                       caja_camara, imagen, imagen_bbox, imagen_hd, clip)
 
 def main():
     parser = argparse.ArgumentParser()
@@ -130,31 +281,139 @@ def main():
     parser.add_argument('--model', required=True)
     parser.add_argument('--postproc', required=True)
     parser.add_argument('--function', required=True)
+    parser.add_argument('--hd-device', default='/dev/video2',
+                        help='Cámara HD (o archivo/pipeline GStreamer de prueba)')
+    parser.add_argument('--hd-max-solicitudes', type=int, default=8,
+                        help='Tamaño de la cola de capturas HD pendientes')
+    parser.add_argument('--hd-politica', default='descartar_nuevo',
+                        choices=['descartar_nuevo', 'descartar_antiguo'],
+                        help='Qué hacer cuando la cola de capturas HD está llena')
+    parser.add_argument('--hd-calibracion', type=letterbox.calibracion_desde_texto,
+                        help='sx,sy,dx,dy de coordenadas normalizadas de la cámara a las de la HD '
+                             '(por defecto, mismo campo de visión)')
+    parser.add_argument('--hd-modo', default='rama', choices=MODOS_HD,
+                        help='rama: la cámara HD como segunda fuente del pipeline, sincronizada por '
+                             'PTS; opencv: lectura con cv2.VideoCapture en un hilo')
+    parser.add_argument('--hd-formato', default='MJPEG', choices=['MJPEG', 'YUY2', 'NV12'],
+                        help='Formato pedido a la cámara HD en modo rama')
+    parser.add_argument('--hd-lado-recorte', type=int, default=640,
+                        help='Ampliar el recorte del vehículo hasta este lado mayor (0 = sin ampliar)')
+    parser.add_argument('--writer-hilos', type=int, default=2,
+                        help='Hilos del pool de escritura de imágenes')
+    parser.add_argument('--writer-cola', type=int, default=32,
+                        help='Frames pendientes máximos en el pool de escritura')
+    parser.add_argument('--writer-politica', default='descartar_antiguo',
+                        choices=['descartar_nuevo', 'descartar_antiguo'],
+                        help='Qué hacer cuando la cola de escritura está llena')
+    parser.add_argument('--writer-preset', default='jpeg90', choices=list(PRESETS),
+                        help='Formato y calidad de las imágenes guardadas')
+    parser.add_argument('--writer-anotacion', default='imagen', choices=ANOTACIONES,
+                        help='imagen: copia _bbox dibujada; sidecar: cajas en un .json junto a la '
+                             'imagen, dibujadas a demanda (escritor_imagenes.py --anotar)')
+    parser.add_argument('--writer-recorte', action='store_true',
+                        help='Guardar solo el recorte de cada detección en lugar del frame completo')
+    parser.add_argument('--modo-captura', default='por_vehiculo',
+                        choices=['por_vehiculo', 'cada_deteccion'],
+                        help='Una captura por vehículo (tracker) o una por cada detección')
+    parser.add_argument('--criterio-mejor', default='confianza', choices=CRITERIOS_MEJOR,
+                        help='Qué frame del recorrido guardar en modo por_vehiculo')
+    agregar_argumentos(parser)
+    metricas.agregar_argumentos(parser)
+    pipelines.agregar_argumentos(parser)
+    compuerta_movimiento.agregar_argumentos(parser)
+    clips.agregar_argumentos(parser)
+    bus_frames.agregar_argumentos(parser)
+    almacen.agregar_argumentos(parser)
+    gestor_disco.agregar_argumentos(parser)
+    captura.agregar_argumentos(parser)
+    control_tasa.agregar_argumentos(parser)
     args = parser.parse_args()
+    configurar_desde_args(args)
 
     Gst.init(None)
-    pipeline_str = f"""
-        v4l2src device={args.input} !
-        video/x-raw,format=YUY2,width=640,height=480,framerate=15/1 !
-        videoconvert !
-        videoscale !
-        video/x-raw,format=RGB,width=640,height=640 !
-        hailonet hef-path={args.model} force-writable=true !
-        hailofilter function-name={args.function} so-path={args.postproc} !
-        identity name=identity_callback !
-        fakesink sync=false
-    """
-
-    pipeline = Gst.parse_launch(pipeline_str)
+    # El camino de captura más barato que ofrezca la cámara (caps consultados en READY)
+    espec = captura.elegir(captura.candidatos(
+        "deteccion", [f"v4l2src device={args.input}"], args.captura, fps=FPS_CAMARA,
+        modelo=args.model, propiedades_modelo={"force-writable": "true"},
+        postproceso=args.postproc, funcion=args.function))
+    print(f"📷 Captura: {espec.nombre} ({espec.caps_fuente})")
+    if args.latencia_objetivo is not None:
+        # videorate antes del letterbox: el control de tasa ajusta su max-rate en caliente
+        control_tasa.insertar(espec, FPS_CAMARA)
+    compuerta = compuerta_movimiento.desde_argumentos(args)
+    if compuerta is not None:
+        pipeline = compuerta.construir(espec, args)
+    else:
+        pipeline = pipelines.construir(espec, args)
     identity = pipeline.get_by_name("identity_callback")
     pad = identity.get_static_pad("src")
     user_data = app_callback_class()
+    user_data.compuerta = compuerta
+    user_data.letterbox = letterbox.MarcadorLetterbox()
+    user_data.letterbox.instalar(pipeline.get_by_name("letterbox"))
+    user_data.calibracion_hd = args.hd_calibracion
+    user_data.clips = clips.desde_argumentos(args)
+    if user_data.clips is not None:
+        # Los clips se codifican desde el frame de la cámara, antes del letterbox
+        # (y antes del videorate del control de tasa, para que no pierdan fps)
+        user_data.clips.instalar(pipeline, "tasa" if args.latencia_objetivo is not None else "letterbox")
+        user_data.clips.iniciar()
+    modo_hd = args.hd_modo
+    if modo_hd == 'rama' and "!" not in args.hd_device and not os.path.exists(args.hd_device):
+        # Una fuente ausente haría fallar todo el pipeline; el lector opencv reintenta solo
+        print(f"⚠️ {args.hd_device} no existe: la cámara HD se lee aparte (--hd-modo opencv)")
+        modo_hd = 'opencv'
+    user_data.capturador_hd = CapturadorHD(args.hd_device,
+                                           max_solicitudes=args.hd_max_solicitudes,
+                                           politica=args.hd_politica,
+                                           modo=modo_hd, formato=args.hd_formato,
+                                           lado_recorte=args.hd_lado_recorte)
+    if modo_hd == 'rama':
+        # Mismo reloj que la cámara de detección: el PTS de cada buffer indica qué frame HD pedir
+        user_data.capturador_hd.instalar(pipeline)
+    user_data.capturador_hd.iniciar()
+    user_data.escritor = EscritorImagenes(hilos=args.writer_hilos,
+                                          max_cola=args.writer_cola,
+                                          politica=args.writer_politica,
+                                          preset=args.writer_preset,
+                                          anotacion=args.writer_anotacion,
+                                          recorte=args.writer_recorte)
+    user_data.escritor.iniciar()
+    if args.modo_captura == 'por_vehiculo':
+        user_data.rastreador = RastreadorIoU(criterio=args.criterio_mejor)
+    if args.bus_frames:
+        user_data.bus = bus_frames.PublicadorFrames(args.bus_frames, 640, 640, 3, args.bus_slots)
+    user_data.almacen = almacen.desde_argumentos(args, camara=args.input)
+    if user_data.almacen is not None:
+        user_data.almacen_detecciones = args.db_detecciones
+        user_data.almacen.iniciar()
     pad.add_probe(Gst.PadProbeType.BUFFER, app_callback, user_data)
 
+    instrumentacion, exportadores = metricas.iniciar_desde_args(args, pipeline)
+
+    carpetas = ["detections_vehicles", user_data.capturador_hd.carpeta]
+    if user_data.clips is not None:
+        carpetas.append(user_data.clips.carpeta)
+    disco = gestor_disco.desde_argumentos(
+        args, carpetas, instrumentacion.registro if instrumentacion is not None else None)
+    if disco is not None:
+        # Cada escritor avisa sus archivos: el uso se lleva sin recorrer las carpetas
+        for escritor in (user_data.escritor, user_data.capturador_hd, user_data.clips):
+            if escritor is not None:
+                escritor.al_escribir = disco.registrar
+        disco.iniciar()
+    user_data.control = control_tasa.desde_argumentos(
+        args, FPS_CAMARA, instrumentacion.registro if instrumentacion is not None else None)
+    if user_data.control is not None:
+        user_data.control.instalar(pipeline)
+        user_data.control.iniciar()
+
     bus = pipeline.get_bus()
     loop = GLib.MainLoop()
 
     def on_message(bus, message):
+        if instrumentacion is not None:
+            instrumentacion.procesar_mensaje(message)
         if message.type == Gst.MessageType.EOS:
             loop.quit()
         elif message.type == Gst.MessageType.ERROR:
@@ -176,6 +435,38 @@ def main():
     print("🚦 Detectando vehículos... Ctrl+C para detener.")
     loop.run()
     pipeline.set_state(Gst.State.NULL)
+    if instrumentacion is not None:
+        instrumentacion.detener()
+    for exportador in exportadores:
+        exportador.detener()
+    if user_data.rastreador is not None:
+        for track in user_data.rastreador.finalizar():
+            emitir_captura(track, user_data)
+    user_data.capturador_hd.detener()
+    user_data.escritor.detener()
+    if user_data.control is not None:
+        user_data.control.detener()
+        registro().evento("control_tasa", f"📊 Control de tasa: {user_data.control.estadisticas()}",
+                          **user_data.control.estadisticas())
+    if disco is not None:
+        disco.detener()
+        registro().evento("disco", f"📊 Disco: {disco.estadisticas()}", **disco.estadisticas())
+    if user_data.almacen is not None:
+        user_data.almacen.detener()
+        registro().evento("almacen", f"📊 Base: {user_data.almacen.estadisticas()}",
+                          **user_data.almacen.estadisticas())
+    if user_data.bus is not None:
+        user_data.bus.cerrar()
+    if user_data.clips is not None:
+        user_data.clips.detener()
+        registro().evento("clips", f"📊 Clips: {user_data.clips.estadisticas()}",
+                          **user_data.clips.estadisticas())
+    registro().evento("escritor", f"📊 Escritor: {user_data.escritor.estadisticas()}",
+                      **user_data.escritor.estadisticas())
+    if compuerta is not None:
+        registro().evento("compuerta", f"📊 Compuerta: {compuerta.estadisticas()}",
+                          **compuerta.estadisticas())
+    cerrar_eventos()
 
 if __name__ == "__main__":
     main()
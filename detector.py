@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# Punto de entrada único. Solo usa la biblioteca estándar: el módulo del
+# subcomando (y con él gi, hailo, numpy u OpenCV) se importa recién cuando
+# se sabe cuál se va a ejecutar.
+import sys
+import time
+import atexit
+import argparse
+import importlib
+import threading
+
+_INICIO_NS = time.perf_counter_ns()
+
+# Subcomando -> (módulo, descripción)
+COMANDOS = {
+    "detectar": ("detection", "Detección de vehículos con captura HD (detection.py)"),
+    "headless": ("simple_hailo_test", "Detección sin ventana con búsqueda de modelo (simple_hailo_test.py)"),
+    "probar-modelo": ("test_moder_yolo", "Probar un modelo YOLO en /dev/video0"),
+    "camara": ("check_camera", "Verificar la cámara V4L2 y GStreamer"),
+    "benchmark": ("benchmark", "Benchmark offline de los callbacks"),
+    "pipelines": ("pipelines", "Throughput con y sin colas entre etapas"),
+    "indice": ("indice_artefactos", "Índice de modelos y librerías"),
+    "metricas": ("metricas", "Métricas por elemento sobre videotestsrc"),
+    "multifuente": ("multifuente", "Prueba de varias fuentes sobre una inferencia compartida"),
+    "compuerta": ("compuerta_movimiento", "Inferencias ahorradas por la compuerta de movimiento"),
+    "mosaico": ("mosaico", "Mapeo y fusión de mosaicos con detecciones sintéticas"),
+    "letterbox": ("letterbox", "Precisión y costo del letterbox y el desmapeo"),
+    "clips": ("clips", "Clips pre/post evento sobre videotestsrc"),
+    "bus": ("bus_frames", "Publicación y consumo del bus de frames en memoria compartida"),
+    "almacen": ("almacen", "Consultas y benchmark de la base SQLite de detecciones"),
+    "disco": ("gestor_disco", "Cuotas y retención de capturas con archivos sintéticos"),
+    "captura": ("captura", "CPU y fps de cada camino de captura (NV12/YUY2/MJPEG)"),
+    "control": ("control_tasa", "Control de tasa con sensores simulados y un callback lento"),
+    "escritor": ("escritor_imagenes", "Bytes y ms por evento del escritor de imágenes por preset"),
+    "hd": ("captura_hd", "Captura HD sincronizada por PTS (--prueba sintetica|videotestsrc)"),
+    "postproceso": ("postproceso_yolo", "Pruebas y benchmark de la decodificación YOLO + NMS en NumPy"),
+}
+
+
+class _CargadorCronometrado:
+    """Envuelve el loader real y mide create_module + exec_module"""
+
+    def __init__(self, cargador, perfil, nombre):
+        self._cargador = cargador
+        self._perfil = perfil
+        self._nombre = nombre
+
+    def create_module(self, spec):
+        self._perfil.entrar(self._nombre)
+        try:
+            return self._cargador.create_module(spec)
+        except BaseException:
+            self._perfil.salir()
+            raise
+
+    def exec_module(self, modulo):
+        try:
+            self._cargador.exec_module(modulo)
+        finally:
+            self._perfil.salir()
+
+    def __getattr__(self, nombre):
+        return getattr(self._cargador, nombre)
+
+
+class PerfilImportaciones:
+    """Tiempo propio y acumulado de cada importación, al estilo de python -X importtime"""
+
+    def __init__(self):
+        self.registros = []
+        self._pila = []
+        self._buscando = threading.local()
+        self.marca = None
+
+    # El finder va primero en sys.meta_path y delega en los demás
+    def find_spec(self, nombre, path=None, target=None):
+        if getattr(self._buscando, "activo", False):
+            return None
+        self._buscando.activo = True
+        try:
+            for buscador in sys.meta_path:
+                if buscador is self or not hasattr(buscador, "find_spec"):
+                    continue
+                spec = buscador.find_spec(nombre, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._buscando.activo = False
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _CargadorCronometrado(spec.loader, self, nombre)
+        return spec
+
+    def entrar(self, nombre):
+        self._pila.append([nombre, time.perf_counter_ns(), 0])
+
+    def salir(self):
+        nombre, inicio, hijos = self._pila.pop()
+        total = time.perf_counter_ns() - inicio
+        if self._pila:
+            self._pila[-1][2] += total
+        self.registros.append((nombre, total - hijos, total, len(self._pila), self.marca is not None))
+
+    def instalar(self):
+        sys.meta_path.insert(0, self)
+
+    def marcar(self):
+        """Fin del arranque: lo que se importe después se informa aparte"""
+        self.marca = time.perf_counter_ns()
+
+    def reporte(self, despues=False, limite=15):
+        registros = [r for r in self.registros if r[4] == despues]
+        if not registros:
+            return
+        raiz = sum(r[2] for r in registros if r[3] == 0)
+        titulo = "importado después del arranque" if despues else "arranque"
+        print(f"⏱️  Importaciones ({titulo}): {len(registros)} módulos, {raiz / 1e6:.1f} ms",
+              file=sys.stderr)
+        if not despues:
+            print(f"⏱️  Hasta el main del subcomando: {(self.marca - _INICIO_NS) / 1e6:.1f} ms",
+                  file=sys.stderr)
+        print("   propio [ms] | acumulado [ms] | módulo", file=sys.stderr)
+        for nombre, propio, total, nivel, _ in sorted(registros, key=lambda r: -r[2])[:limite]:
+            print(f"   {propio / 1e6:11.2f} | {total / 1e6:14.2f} | {'  ' * nivel}{nombre}",
+                  file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Detector Hailo: un solo punto de entrada con importaciones diferidas',
+        epilog="\n".join(f"  {c:14s} {d}" for c, (_, d) in COMANDOS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='Mostrar el tiempo de cada importación del arranque (como -X importtime)')
+    parser.add_argument('comando', choices=list(COMANDOS))
+    parser.add_argument('argumentos', nargs=argparse.REMAINDER,
+                        help='Opciones del subcomando (ver "detector.py <comando> --help")')
+    args = parser.parse_args()
+
+    perfil = None
+    if args.startup_profile:
+        perfil = PerfilImportaciones()
+        perfil.instalar()
+
+    modulo = importlib.import_module(COMANDOS[args.comando][0])
+    if perfil is not None:
+        perfil.marcar()
+        perfil.reporte()
+        atexit.register(perfil.reporte, True)
+
+    sys.argv = [f"{parser.prog} {args.comando}"] + args.argumentos
+    modulo.main()
+
+
+if __name__ == "__main__":
+    main()
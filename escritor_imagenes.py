@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import queue
+import shutil
+import tempfile
+import argparse
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from captura_hd import POLITICAS_DESCARTE, caja_recorte
+
+# Preset -> (extensión, parámetros de cv2.imencode por nombre de constante)
+PRESETS = {
+    "jpeg90": (".jpg", (("IMWRITE_JPEG_QUALITY", 90),)),
+    "jpeg80": (".jpg", (("IMWRITE_JPEG_QUALITY", 80),)),
+    "jpeg60": (".jpg", (("IMWRITE_JPEG_QUALITY", 60),)),
+    "webp": (".webp", (("IMWRITE_WEBP_QUALITY", 75),)),
+    # Sin compresión: casi sin CPU pero archivos de ~1 MB por frame de 640x640
+    "png_sin_compresion": (".png", (("IMWRITE_PNG_COMPRESSION", 0),)),
+}
+ANOTACIONES = ("imagen", "sidecar")
+
+
+def nombre_base(index, label, confidence):
+    """Nombre de archivo (sin extensión) de una detección guardada"""
+    return f"frame_{index:04d}_{label}_{confidence:.3f}"
+
+
+def anotar_frame(frame, label, confidence, bbox, destino=None):
+    """Dibujar la caja y la etiqueta sobre una copia del frame
+
+    bbox es (xmin, ymin, width, height) en píxeles del frame. Con destino (un
+    array de la misma forma, p.ej. de un pool) se copia ahí en lugar de
+    reservar memoria nueva.
+    """
+    height, width = frame.shape[:2]
+    xmin, ymin, bw, bh = bbox
+    x1 = max(0, min(int(xmin), width - 1))
+    y1 = max(0, min(int(ymin), height - 1))
+    x2 = max(0, min(x1 + int(bw), width - 1))
+    y2 = max(0, min(y1 + int(bh), height - 1))
+
+    # OpenCV se importa recién al guardar: acelera el arranque en --no-frame-processing
+    import cv2
+    if destino is None:
+        bbox_frame = frame.copy()
+    else:
+        np.copyto(destino, frame)
+        bbox_frame = destino
+    cv2.rectangle(bbox_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    cv2.putText(bbox_frame, f"{label}: {confidence:.2f}", (x1, y1 - 10),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+    return bbox_frame
+
+
+def anotar_sidecar(path, salida=None):
+    """Dibujar a demanda las cajas de un sidecar .json sobre su imagen
+
+    Devuelve la imagen anotada; con salida, además la escribe ahí. Las cajas
+    están en píxeles de la imagen tal como se escribió (ancho x alto del
+    sidecar); si después se achicó (p.ej. la recompresión de gestor_disco),
+    se reescalan al tamaño actual.
+    """
+    import cv2
+    with open(path) as f:
+        datos = json.load(f)
+    imagen = cv2.imread(os.path.join(os.path.dirname(path), datos["imagen"]))
+    if imagen is None:
+        raise FileNotFoundError(f"No se pudo leer la imagen de {path}")
+    sx = imagen.shape[1] / datos.get("ancho", imagen.shape[1])
+    sy = imagen.shape[0] / datos.get("alto", imagen.shape[0])
+    anotada = imagen.copy()
+    for deteccion in datos["detecciones"]:
+        x, y, w, h = deteccion["bbox"]
+        anotar_frame(anotada, deteccion["label"], deteccion["confidence"],
+                     (x * sx, y * sy, w * sx, h * sy), destino=anotada)
+    if salida is not None:
+        cv2.imwrite(salida, anotada)
+    return anotada
+
+
+def _liberar(frame):
+    if hasattr(frame, "liberar"):
+        frame.liberar()
+
+
+class EscritorImagenes:
+    """Pool de hilos que codifica y escribe las imágenes de detección fuera del pad probe
+
+    Cada trabajo es un frame con sus detecciones; el frame crudo se codifica y
+    se escribe una sola vez aunque tenga varias detecciones. Los hilos toman
+    lotes de la cola, codifican todo el lote y después hacen las escrituras a
+    disco juntas.
+
+    anotacion="imagen" guarda además una copia anotada por detección (dibujada
+    en un buffer reutilizable de cada hilo); "sidecar" guarda las cajas en un
+    .json junto a la imagen y la anotación se dibuja a demanda con
+    anotar_sidecar. Con recorte se codifica solo el recorte de cada detección
+    en lugar del frame completo. preset elige formato y calidad (PRESETS).
+    """
+
+    def __init__(self, hilos=2, max_cola=32, politica="descartar_antiguo", lote=8,
+                 calidad_jpeg=90, preset=None, anotacion="imagen", recorte=False,
+                 margen_recorte=0.1):
+        if politica not in POLITICAS_DESCARTE:
+            raise ValueError(f"Política de descarte no válida: {politica}")
+        if preset is not None and preset not in PRESETS:
+            raise ValueError(f"Preset no válido: {preset}")
+        if anotacion not in ANOTACIONES:
+            raise ValueError(f"Anotación no válida: {anotacion}")
+        self.num_hilos = hilos
+        self.politica = politica
+        self.lote = lote
+        self.calidad_jpeg = calidad_jpeg
+        if preset is None:
+            self.extension, self._parametros = ".jpg", (("IMWRITE_JPEG_QUALITY", calidad_jpeg),)
+        else:
+            self.extension, self._parametros = PRESETS[preset]
+        self.anotacion = anotacion
+        self.recorte = recorte
+        self.margen_recorte = margen_recorte
+        # Buffer de anotación por hilo, reutilizado mientras no cambie la forma del frame
+        self._locales = threading.local()
+        self.cola = queue.Queue(maxsize=max_cola)
+        self._activo = threading.Event()
+        self._hilos = []
+        self._lock = threading.Lock()
+        self._carpetas_creadas = set()
+        # al_escribir(path, bytes) se llama tras cada archivo escrito (p.ej. GestorDisco.registrar)
+        self.al_escribir = None
+
+        # Contadores
+        self.encolados = 0
+        self.descartados = 0
+        self.escritos = 0
+        self.errores = 0
+        self.bytes_escritos = 0
+        self.detecciones = 0
+        self.segundos_trabajo = 0.0
+
+    def iniciar(self):
+        """Arrancar los hilos de escritura"""
+        if self._activo.is_set():
+            return
+        self._activo.set()
+        self._hilos = [
+            threading.Thread(target=self._bucle, name=f"escritor_{i}", daemon=True)
+            for i in range(self.num_hilos)
+        ]
+        for hilo in self._hilos:
+            hilo.start()
+
+    def detener(self, timeout=None):
+        """Vaciar la cola pendiente y detener los hilos
+
+        Bloquea hasta que se escribió todo lo encolado. Con timeout (segundos)
+        se deja de esperar y se avisa cuántos frames quedaron sin escribir.
+        """
+        self._activo.clear()
+        limite = None if timeout is None else time.monotonic() + timeout
+        for hilo in self._hilos:
+            hilo.join(None if limite is None else max(0.0, limite - time.monotonic()))
+        vivos = [hilo for hilo in self._hilos if hilo.is_alive()]
+        if vivos:
+            print(f"⚠️ Escritor detenido con {self.cola.qsize()} frames en cola sin escribir "
+                  f"(más los lotes en curso de {len(vivos)} hilos)")
+        self._hilos = vivos
+
+    def encolar(self, frame, detecciones, carpeta, copiar=True):
+        """Encolar un frame para guardar (no bloquea)
+
+        detecciones es una lista de (index, label, confidence, bbox). frame puede
+        ser un FrameHandle (se retiene sin copiar mientras está en la cola) o un
+        array BGR; en ese caso, si copiar es True, se copia.
+        Devuelve False si el trabajo se descartó.
+        """
+        if self.politica == "descartar_nuevo" and self.cola.full():
+            self._contar_descarte()
+            return False
+
+        if hasattr(frame, "retener"):
+            frame = frame.retener()
+        elif copiar:
+            frame = frame.copy()
+        trabajo = (frame, detecciones, carpeta)
+        while True:
+            try:
+                self.cola.put_nowait(trabajo)
+                with self._lock:
+                    self.encolados += 1
+                return True
+            except queue.Full:
+                if self.politica == "descartar_nuevo":
+                    self._contar_descarte()
+                    _liberar(frame)
+                    return False
+            # descartar_antiguo: liberar lugar quitando el trabajo más viejo
+            try:
+                viejo, _, _ = self.cola.get_nowait()
+                _liberar(viejo)
+                self._contar_descarte()
+            except queue.Empty:
+                pass
+
+    def _contar_descarte(self):
+        with self._lock:
+            self.descartados += 1
+
+    def _tomar_lote(self):
+        try:
+            trabajos = [self.cola.get(timeout=0.2)]
+        except queue.Empty:
+            return []
+        while len(trabajos) < self.lote:
+            try:
+                trabajos.append(self.cola.get_nowait())
+            except queue.Empty:
+                break
+        return trabajos
+
+    def _bucle(self):
+        while self._activo.is_set() or not self.cola.empty():
+            trabajos = self._tomar_lote()
+            if not trabajos:
+                continue
+            inicio = time.perf_counter()
+            archivos = []
+            for frame, detecciones, carpeta in trabajos:
+                try:
+                    imagen = frame.a_bgr() if hasattr(frame, "a_bgr") else frame
+                    archivos.extend(self._codificar(imagen, detecciones, carpeta))
+                except Exception as e:
+                    print(f"⚠️ Error codificando frame: {e}")
+                    with self._lock:
+                        self.errores += 1
+                finally:
+                    _liberar(frame)
+            self._escribir(archivos)
+            with self._lock:
+                self.detecciones += sum(len(t[1]) for t in trabajos)
+                self.segundos_trabajo += time.perf_counter() - inicio
+
+    def rutas(self, carpeta, detecciones):
+        """[(imagen, anotación)] por detección: la anotación es el _bbox o el sidecar .json
+
+        Sin recorte, todas las detecciones de un frame comparten la imagen (y
+        el sidecar), que lleva el nombre de la primera.
+        """
+        rutas = []
+        for index, label, confidence, _ in detecciones:
+            base = nombre_base(index, label, confidence)
+            if not self.recorte and rutas:
+                imagen = rutas[0][0]
+            else:
+                imagen = os.path.join(carpeta, base + self.extension)
+            if self.anotacion == "sidecar":
+                anotacion = os.path.splitext(imagen)[0] + ".json"
+            else:
+                anotacion = os.path.join(carpeta, base + "_bbox" + self.extension)
+            rutas.append((imagen, anotacion))
+        return rutas
+
+    def _codificar_imagen(self, imagen):
+        """Bytes codificados según el preset (cv2.imencode siempre reserva su propio buffer)"""
+        import cv2
+        parametros = [v for nombre, valor in self._parametros for v in (getattr(cv2, nombre), valor)]
+        ok, datos = cv2.imencode(self.extension, imagen, parametros)
+        if not ok:
+            raise RuntimeError("cv2.imencode falló")
+        return datos
+
+    def _buffer_anotacion(self, forma, dtype):
+        buffer = getattr(self._locales, "anotacion", None)
+        if buffer is None or buffer.shape != forma or buffer.dtype != dtype:
+            buffer = np.empty(forma, dtype)
+            self._locales.anotacion = buffer
+        return buffer
+
+    def _codificar(self, frame, detecciones, carpeta):
+        archivos = []
+        rutas = self.rutas(carpeta, detecciones)
+        # Por imagen: (origen x, y, vista) y las detecciones que van en su sidecar
+        imagenes = {}
+        for (index, label, confidence, bbox), (path_imagen, _) in zip(detecciones, rutas):
+            if path_imagen not in imagenes:
+                origen, vista = (0, 0), frame
+                if self.recorte:
+                    x, y, w, h = bbox
+                    caja = caja_recorte(frame.shape, (x, y, x + w, y + h), frame.shape[1],
+                                        frame.shape[0], self.margen_recorte)
+                    if caja is not None:
+                        # Vista sin copia: imencode acepta arrays con stride
+                        origen, vista = caja[:2], frame[caja[1]:caja[3], caja[0]:caja[2]]
+                imagenes[path_imagen] = (origen, vista, [])
+            origen, vista, propias = imagenes[path_imagen]
+            relativa = (bbox[0] - origen[0], bbox[1] - origen[1], bbox[2], bbox[3])
+            propias.append((index, label, confidence, relativa))
+
+        for path_imagen, (origen, vista, propias) in imagenes.items():
+            archivos.append((path_imagen, self._codificar_imagen(vista)))
+            if self.anotacion == "sidecar":
+                sidecar = {
+                    "imagen": os.path.basename(path_imagen),
+                    "ancho": int(vista.shape[1]), "alto": int(vista.shape[0]),
+                    "origen": [int(origen[0]), int(origen[1])],
+                    "detecciones": [{"index": int(index), "label": label,
+                                     "confidence": round(float(confidence), 4),
+                                     "bbox": [round(float(v), 1) for v in bbox]}
+                                    for index, label, confidence, bbox in propias],
+                }
+                archivos.append((os.path.splitext(path_imagen)[0] + ".json",
+                                 json.dumps(sidecar).encode()))
+                continue
+            destino = self._buffer_anotacion(vista.shape, vista.dtype)
+            for index, label, confidence, bbox in propias:
+                anotada = anotar_frame(vista, label, confidence, bbox, destino=destino)
+                path_anotada = os.path.join(os.path.dirname(path_imagen),
+                                            nombre_base(index, label, confidence) + "_bbox"
+                                            + self.extension)
+                archivos.append((path_anotada, self._codificar_imagen(anotada)))
+        return archivos
+
+    def _escribir(self, archivos):
+        for path, datos in archivos:
+            carpeta = os.path.dirname(path)
+            if carpeta not in self._carpetas_creadas:
+                Path(carpeta).mkdir(parents=True, exist_ok=True)
+                self._carpetas_creadas.add(carpeta)
+            try:
+                with open(path, "wb") as f:
+                    f.write(datos)
+                with self._lock:
+                    self.escritos += 1
+                    self.bytes_escritos += len(datos)
+                if self.al_escribir is not None:
+                    self.al_escribir(path, len(datos))
+            except OSError as e:
+                print(f"⚠️ No se pudo escribir {path}: {e}")
+                with self._lock:
+                    self.errores += 1
+
+    def estadisticas(self):
+        return {
+            "encolados": self.encolados,
+            "descartados": self.descartados,
+            "escritos": self.escritos,
+            "errores": self.errores,
+            "en_cola": self.cola.qsize(),
+            "bytes_escritos": self.bytes_escritos,
+        }
+
+
+def _guardar_inline(frame, detecciones, carpeta):
+    """Camino original: dos cv2.imwrite por detección dentro del callback"""
+    import cv2
+    Path(carpeta).mkdir(parents=True, exist_ok=True)
+    for index, label, confidence, bbox in detecciones:
+        base_filename = nombre_base(index, label, confidence)
+        cv2.imwrite(os.path.join(carpeta, base_filename + ".jpg"), frame)
+        cv2.imwrite(os.path.join(carpeta, base_filename + "_bbox.jpg"),
+                    anotar_frame(frame, label, confidence, bbox))
+
+
+def _frame_sintetico(rng, ancho=640, alto=640):
+    """Frame con gradiente, rectángulos y algo de ruido: comprime como una escena, no como ruido puro"""
+    import cv2
+    y, x = np.mgrid[0:alto, 0:ancho]
+    frame = np.stack([(x * 255 // ancho), (y * 255 // alto), ((x + y) * 127 // (ancho + alto))],
+                     axis=-1).astype(np.uint8)
+    for _ in range(12):
+        x1, y1 = int(rng.integers(0, ancho - 40)), int(rng.integers(0, alto - 40))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(frame, (x1, y1), (x1 + int(rng.integers(20, 200)), y1 + int(rng.integers(20, 200))),
+                      color, -1)
+    ruido = rng.integers(-8, 9, frame.shape)
+    return np.clip(frame.astype(np.int16) + ruido, 0, 255).astype(np.uint8)
+
+
+def _medir_configuracion(frames, detecciones, n_frames, carpeta, **kwargs):
+    """(ms de trabajo por evento, bytes por evento) del pool con una configuración"""
+    escritor = EscritorImagenes(hilos=1, max_cola=n_frames, politica="descartar_nuevo", **kwargs)
+    escritor.iniciar()
+    for i in range(n_frames):
+        dets = [(i * len(detecciones) + j,) + d[1:] for j, d in enumerate(detecciones)]
+        escritor.encolar(frames[i % len(frames)], dets, carpeta)
+    # Bloquea hasta escribir todo: los contadores (y la carpeta) recién valen después
+    escritor.detener()
+    if escritor.errores or escritor.descartados or escritor.detecciones != n_frames * len(detecciones):
+        print(f"⚠️ Medición incompleta: {escritor.estadisticas()}")
+    eventos = max(1, escritor.detecciones)
+    return escritor.segundos_trabajo * 1000 / eventos, escritor.bytes_escritos / eventos
+
+
+def _bytes_carpeta(carpeta):
+    return sum(p.stat().st_size for p in Path(carpeta).glob("*") if p.is_file())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del escritor asíncrono vs. imwrite en línea')
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--detecciones', type=int, default=2, help='Detecciones por frame')
+    parser.add_argument('--hilos', type=int, default=2)
+    parser.add_argument('--max-cola', type=int, default=32)
+    parser.add_argument('--politica', default='descartar_antiguo', choices=POLITICAS_DESCARTE)
+    parser.add_argument('--fps', type=float, default=15.0,
+                        help='Ritmo de llegada de frames (0 = lo más rápido posible)')
+    parser.add_argument('--presets', nargs='*', default=['jpeg90', 'jpeg80', 'webp'],
+                        choices=list(PRESETS), help='Presets a comparar en bytes y ms por evento')
+    parser.add_argument('--anotar', metavar='JSON',
+                        help='Solo dibujar las cajas de un sidecar y escribir <imagen>_bbox al lado')
+    args = parser.parse_args()
+
+    if args.anotar:
+        base, _ = os.path.splitext(args.anotar)
+        salida = base + "_bbox.jpg"
+        anotar_sidecar(args.anotar, salida)
+        print(f"🖍️  {salida}")
+        return
+
+    rng = np.random.default_rng(0)
+    frames = [_frame_sintetico(rng) for _ in range(8)]
+    detecciones = [(0, "car", 0.87, (100.0 + 150 * j, 120.0, 120.0, 150.0))
+                   for j in range(args.detecciones)]
+    periodo = 1.0 / args.fps if args.fps > 0 else 0.0
+    directorio = tempfile.mkdtemp(prefix="bench_escritor_")
+
+    try:
+        # Camino en línea
+        inicio = time.perf_counter()
+        for i in range(args.frames):
+            dets = [(i * args.detecciones + j,) + d[1:] for j, d in enumerate(detecciones)]
+            _guardar_inline(frames[i % len(frames)], dets, os.path.join(directorio, "inline"))
+        t_inline = time.perf_counter() - inicio
+
+        # Camino asíncrono: medimos el tiempo que pasa el "callback" en encolar
+        escritor = EscritorImagenes(hilos=args.hilos, max_cola=args.max_cola, politica=args.politica)
+        escritor.iniciar()
+        t_callback = 0.0
+        inicio = time.perf_counter()
+        for i in range(args.frames):
+            dets = [(i * args.detecciones + j,) + d[1:] for j, d in enumerate(detecciones)]
+            t0 = time.perf_counter()
+            escritor.encolar(frames[i % len(frames)], dets, os.path.join(directorio, "pool"))
+            t_callback += time.perf_counter() - t0
+            if periodo:
+                time.sleep(periodo)
+        escritor.detener()
+        t_pool = time.perf_counter() - inicio
+
+        print(f"📊 En línea: {t_inline * 1000 / args.frames:.2f} ms/frame dentro del callback")
+        print(f"📊 Pool:     {t_callback * 1000 / args.frames:.2f} ms/frame dentro del callback "
+              f"({t_pool:.2f} s totales)")
+        print(f"📊 {escritor.estadisticas()}")
+
+        # Costo por evento (una detección): dos imwrite vs. escribir una vez con sidecar/recorte
+        eventos = args.frames * args.detecciones
+        resultados = {"inline 2x imwrite (q95)": (
+            t_inline * 1000 / eventos, _bytes_carpeta(os.path.join(directorio, "inline")) / eventos)}
+        for preset in args.presets:
+            for anotacion, recorte in (("imagen", False), ("sidecar", False), ("sidecar", True)):
+                clave = f"{preset} {anotacion}" + (" recorte" if recorte else "")
+                carpeta = os.path.join(directorio, clave.replace(" ", "_"))
+                resultados[clave] = _medir_configuracion(
+                    frames, detecciones, args.frames, carpeta, preset=preset,
+                    anotacion=anotacion, recorte=recorte)
+        base_ms, base_bytes = resultados["inline 2x imwrite (q95)"]
+        print(f"{'configuración':<34} {'ms/evento':>10} {'KB/evento':>10} {'vs inline':>10}")
+        for clave, (ms, nbytes) in resultados.items():
+            print(f"{clave:<34} {ms:>10.2f} {nbytes / 1024:>10.1f} "
+                  f"{ms / base_ms:>5.2f}x/{nbytes / base_bytes:.2f}x")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import argparse
+import threading
+import logging.handlers
+
+# Niveles de --log-level: "off" no registra nada y deja las llamadas casi gratis
+NIVELES = {
+    "off": logging.CRITICAL + 10,
+    "error": logging.ERROR,
+    "warning": logging.WARNING,
+    "info": logging.INFO,
+    "debug": logging.DEBUG,
+}
+
+NOMBRE_LOGGER = "hailo_detector"
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro, con los campos extra del evento"""
+
+    def format(self, record):
+        datos = {
+            "ts": round(record.created, 6),
+            "nivel": record.levelname.lower(),
+            "mensaje": record.getMessage(),
+        }
+        campos = getattr(record, "campos", None)
+        if campos:
+            datos.update(campos)
+        return json.dumps(datos, ensure_ascii=False)
+
+
+class RegistroEventos:
+    """Registro de eventos con cola no bloqueante, agregación y límite por clase
+
+    En nivel info las detecciones se agregan por clase y se emite un resumen
+    por intervalo ("car x12 en el último 1.0s"). En debug además se registra
+    cada detección, con un máximo de max_por_clase registros por segundo y
+    clase. Con el registro apagado deteccion() sale en la primera comparación.
+    """
+
+    def __init__(self, nivel="info", logger=None, intervalo=1.0, max_por_clase=5,
+                 reloj=time.monotonic):
+        self.nivel = NIVELES[nivel]
+        self.logger = logger or logging.getLogger(NOMBRE_LOGGER)
+        self.intervalo = intervalo
+        self.max_por_clase = max_por_clase
+        self.reloj = reloj
+        self._agregado = {}
+        self._inicio_ventana = reloj()
+        self._debug_ventana = {}
+        self._lock = threading.Lock()
+
+    def habilitado(self, nivel=logging.INFO):
+        return self.nivel <= nivel
+
+    def deteccion(self, label, confidence):
+        """Contar una detección (no hace I/O en el hilo que llama)"""
+        if self.nivel > logging.INFO:
+            return
+        ahora = self.reloj()
+        with self._lock:
+            cantidad, maxima = self._agregado.get(label, (0, 0.0))
+            self._agregado[label] = (cantidad + 1, max(maxima, confidence))
+
+            if self.nivel <= logging.DEBUG:
+                inicio, emitidos = self._debug_ventana.get(label, (ahora, 0))
+                if ahora - inicio >= 1.0:
+                    inicio, emitidos = ahora, 0
+                if emitidos < self.max_por_clase:
+                    self._debug_ventana[label] = (inicio, emitidos + 1)
+                    self.logger.debug(f"🔍 Detección: {label} ({confidence:.2f})",
+                                      extra={"campos": {"evento": "deteccion", "clase": label,
+                                                        "confianza": round(float(confidence), 4)}})
+                else:
+                    self._debug_ventana[label] = (inicio, emitidos)
+
+            if ahora - self._inicio_ventana >= self.intervalo:
+                self._vaciar(ahora)
+
+    def detecciones(self, etiquetas, confianzas):
+        """Contar todas las detecciones de un frame (llamar también con frames vacíos)"""
+        if self.nivel > logging.INFO:
+            return
+        for label, confidence in zip(etiquetas, confianzas):
+            self.deteccion(label, confidence)
+        # Sin detecciones también hay que cerrar la ventana a tiempo
+        ahora = self.reloj()
+        if self._agregado and ahora - self._inicio_ventana >= self.intervalo:
+            with self._lock:
+                self._vaciar(ahora)
+
+    def _vaciar(self, ahora):
+        duracion = ahora - self._inicio_ventana
+        for label, (cantidad, maxima) in self._agregado.items():
+            self.logger.info(f"🔍 {label} x{cantidad} en el último {duracion:.1f}s (máx {maxima:.2f})",
+                             extra={"campos": {"evento": "resumen", "clase": label,
+                                               "cantidad": cantidad,
+                                               "confianza_max": round(float(maxima), 4),
+                                               "ventana_s": round(duracion, 3)}})
+        self._agregado = {}
+        self._inicio_ventana = ahora
+
+    def vaciar(self):
+        """Emitir el resumen pendiente (al cerrar)"""
+        if self.nivel > logging.INFO:
+            return
+        with self._lock:
+            self._vaciar(self.reloj())
+
+    def evento(self, tipo, mensaje, nivel=logging.INFO, **campos):
+        """Registrar un evento puntual (captura, fps, error...)"""
+        if self.nivel > nivel:
+            return
+        campos["evento"] = tipo
+        self.logger.log(nivel, mensaje, extra={"campos": campos})
+
+    def debug(self, tipo, mensaje, **campos):
+        self.evento(tipo, mensaje, logging.DEBUG, **campos)
+
+
+_registro = None
+_listener = None
+
+
+def configurar_eventos(nivel="info", archivo=None, max_bytes=5 * 1024 * 1024, backups=3,
+                       consola=True, intervalo=1.0, max_por_clase=5):
+    """Configurar el logger con QueueHandler: el formateo y la escritura ocurren en otro hilo
+
+    archivo recibe JSON lines con rotación por tamaño; la consola recibe el
+    mensaje legible.
+    """
+    global _registro, _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    logger = logging.getLogger(NOMBRE_LOGGER)
+    logger.handlers.clear()
+    logger.propagate = False
+    logger.setLevel(NIVELES[nivel])
+
+    destinos = []
+    if consola:
+        salida = logging.StreamHandler(sys.stdout)
+        salida.setFormatter(logging.Formatter("%(message)s"))
+        destinos.append(salida)
+    if archivo:
+        rotativo = logging.handlers.RotatingFileHandler(archivo, maxBytes=max_bytes,
+                                                        backupCount=backups, encoding="utf-8")
+        rotativo.setFormatter(FormatoJSON())
+        destinos.append(rotativo)
+
+    if nivel != "off" and destinos:
+        cola = queue.SimpleQueue()
+        logger.addHandler(logging.handlers.QueueHandler(cola))
+        _listener = logging.handlers.QueueListener(cola, *destinos, respect_handler_level=True)
+        _listener.start()
+    else:
+        logger.addHandler(logging.NullHandler())
+
+    _registro = RegistroEventos(nivel, logger, intervalo, max_por_clase)
+    return _registro
+
+
+def registro():
+    """Registro global; si nadie lo configuró, uno en nivel info por consola"""
+    if _registro is None:
+        configurar_eventos()
+    return _registro
+
+
+def cerrar_eventos():
+    """Vaciar resúmenes pendientes y esperar a que el hilo de escritura termine"""
+    global _listener
+    if _registro is not None:
+        _registro.vaciar()
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(cerrar_eventos)
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos comunes a los scripts"""
+    parser.add_argument('--log-level', default='info', choices=list(NIVELES),
+                        help='Verbosidad: off, error, warning, info (resúmenes por clase) '
+                             'o debug (cada detección, con límite por clase)')
+    parser.add_argument('--log-file',
+                        help='Archivo JSON lines con rotación para los eventos')
+    parser.add_argument('--log-intervalo', type=float, default=1.0,
+                        help='Segundos entre resúmenes de detecciones por clase')
+
+
+def configurar_desde_args(args):
+    return configurar_eventos(args.log_level, args.log_file, intervalo=args.log_intervalo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Costo por detección del registro de eventos')
+    parser.add_argument('--detecciones', type=int, default=200000)
+    agregar_argumentos(parser)
+    args = parser.parse_args()
+
+    eventos = configurar_eventos(args.log_level, args.log_file, consola=False,
+                                 intervalo=args.log_intervalo)
+    clases = ["car", "truck", "bus", "person"]
+    inicio = time.perf_counter()
+    for i in range(args.detecciones):
+        eventos.deteccion(clases[i & 3], 0.5)
+    duracion = time.perf_counter() - inicio
+    cerrar_eventos()
+    print(f"📊 Nivel {args.log_level}: {duracion * 1e9 / args.detecciones:.0f} ns por detección")
+
+
+if __name__ == "__main__":
+    main()
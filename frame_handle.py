@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+import threading
+import tracemalloc
+
+import numpy as np
+
+# GStreamer es opcional aquí para poder medir con buffers simulados
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    gi.require_version('GstVideo', '1.0')
+    from gi.repository import Gst, GstVideo
+    FLAG_LECTURA = Gst.MapFlags.READ
+except (ImportError, ValueError):
+    Gst = None
+    GstVideo = None
+    FLAG_LECTURA = 1
+
+# Cantidad máxima de frames mapeados retenidos a la vez fuera del probe. Más allá
+# de esto retener() copia para no dejar al pool del pipeline sin buffers.
+LIMITE_RETENIDOS = 4
+
+_retenidos = 0
+_lock_retenidos = threading.Lock()
+
+
+def _ru(valor, multiplo):
+    """Redondear hacia arriba a un múltiplo"""
+    return (valor + multiplo - 1) // multiplo * multiplo
+
+
+# Formatos empaquetados: bytes por píxel y canales
+_EMPAQUETADOS = {
+    "RGB": (3, 3), "BGR": (3, 3),
+    "RGBA": (4, 4), "BGRA": (4, 4), "RGBx": (4, 4), "BGRx": (4, 4),
+    "GRAY8": (1, 1),
+    "YUY2": (2, 2), "UYVY": (2, 2), "YVYU": (2, 2),
+}
+
+
+def calcular_planos(format_str, width, height, strides=None, offsets=None):
+    """Calcular (offset, shape, strides) de numpy para cada plano del formato
+
+    Si no se pasan strides/offsets se usan los que GStreamer asigna por defecto
+    (filas alineadas a 4 bytes). Devuelve None si el formato no está soportado.
+    """
+    if format_str in _EMPAQUETADOS:
+        bpp, canales = _EMPAQUETADOS[format_str]
+        stride = strides[0] if strides else _ru(width * bpp, 4)
+        offset = offsets[0] if offsets else 0
+        if canales == 1:
+            return [(offset, (height, width), (stride, 1))]
+        return [(offset, (height, width, canales), (stride, canales, 1))]
+
+    if format_str in ("NV12", "NV21"):
+        alto_uv = (height + 1) // 2
+        ancho_uv = (width + 1) // 2
+        s_y = strides[0] if strides else _ru(width, 4)
+        s_uv = strides[1] if strides else s_y
+        o_y = offsets[0] if offsets else 0
+        o_uv = offsets[1] if offsets else s_y * _ru(height, 2)
+        return [
+            (o_y, (height, width), (s_y, 1)),
+            (o_uv, (alto_uv, ancho_uv, 2), (s_uv, 2, 1)),
+        ]
+
+    if format_str in ("I420", "YV12"):
+        alto_uv = (height + 1) // 2
+        ancho_uv = (width + 1) // 2
+        s_y = strides[0] if strides else _ru(width, 4)
+        s_u = strides[1] if strides else _ru(_ru(width, 2) // 2, 4)
+        s_v = strides[2] if strides else s_u
+        o_y = offsets[0] if offsets else 0
+        o_u = offsets[1] if offsets else s_y * _ru(height, 2)
+        o_v = offsets[2] if offsets else o_u + s_u * (_ru(height, 2) // 2)
+        planos = [
+            (o_y, (height, width), (s_y, 1)),
+            (o_u, (alto_uv, ancho_uv), (s_u, 1)),
+            (o_v, (alto_uv, ancho_uv), (s_v, 1)),
+        ]
+        if format_str == "YV12":
+            # En YV12 el segundo plano es V y el tercero U
+            planos[1], planos[2] = planos[2], planos[1]
+        return planos
+
+    return None
+
+
+def _layout_desde_buffer(buffer, caps):
+    """Strides/offsets reales: GstVideoMeta del buffer o, si no hay, VideoInfo de las caps"""
+    if GstVideo is None:
+        return None, None
+    try:
+        meta = GstVideo.buffer_get_video_meta(buffer)
+        if meta is not None:
+            n = meta.n_planes
+            return list(meta.stride)[:n], list(meta.offset)[:n]
+    except Exception:
+        pass
+    if caps is not None:
+        try:
+            info = GstVideo.VideoInfo.new_from_caps(caps)
+            n = info.finfo.n_planes
+            return list(info.stride)[:n], list(info.offset)[:n]
+        except Exception:
+            pass
+    return None, None
+
+
+class FrameHandle:
+    """Acceso sin copia a un frame de un Gst.Buffer que lo mantiene mapeado mientras se use
+
+    El buffer queda mapeado y referenciado hasta que se liberan todas las
+    referencias (contador interno). Se usa como context manager dentro del
+    probe; los consumidores que necesiten el frame más tarde (escritores,
+    tracker, recortes) llaman a retener() y luego a liberar().
+    """
+
+    def __init__(self, buffer, format_str, width, height, caps=None):
+        self.buffer = buffer
+        self.format = format_str
+        self.width = width
+        self.height = height
+        self._refs = 1
+        self._lock = threading.Lock()
+        self._retenido = False
+
+        ok, self._map_info = buffer.map(FLAG_LECTURA)
+        if not ok:
+            raise RuntimeError("No se pudo mapear el buffer")
+        strides, offsets = _layout_desde_buffer(buffer, caps)
+        layout = calcular_planos(format_str, width, height, strides, offsets)
+        if layout is None:
+            buffer.unmap(self._map_info)
+            raise ValueError(f"Formato no soportado: {format_str}")
+        datos = np.frombuffer(self._map_info.data, dtype=np.uint8)
+        self.planos = [
+            np.ndarray(shape, dtype=np.uint8, buffer=datos, offset=offset, strides=st)
+            for offset, shape, st in layout
+        ]
+
+    # -------------------------------------------------------------------------
+    # Ciclo de vida
+    # -------------------------------------------------------------------------
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.liberar()
+        return False
+
+    @property
+    def mapeado(self):
+        return self._refs > 0
+
+    def retener(self):
+        """Tomar una referencia extra para usar el frame fuera del probe
+
+        Si ya hay demasiados frames retenidos, devuelve una copia desacoplada
+        (FrameCopia) en lugar de retener el buffer del pool.
+        """
+        global _retenidos
+        with _lock_retenidos:
+            if self._retenido or _retenidos < LIMITE_RETENIDOS:
+                if not self._retenido:
+                    _retenidos += 1
+                    self._retenido = True
+                with self._lock:
+                    if self._refs <= 0:
+                        raise RuntimeError("El frame ya fue liberado")
+                    self._refs += 1
+                return self
+        return self.copiar()
+
+    def liberar(self):
+        """Soltar una referencia; con la última se desmapea el buffer"""
+        global _retenidos
+        with self._lock:
+            if self._refs <= 0:
+                return
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            self.planos = []
+            self.buffer.unmap(self._map_info)
+            self._map_info = None
+            self.buffer = None
+        if self._retenido:
+            with _lock_retenidos:
+                _retenidos -= 1
+            self._retenido = False
+
+    # -------------------------------------------------------------------------
+    # Acceso a los datos
+    # -------------------------------------------------------------------------
+    @property
+    def array(self):
+        """Vista principal: HxWxC para empaquetados, plano Y para formatos planares"""
+        return self.planos[0]
+
+    def copiar(self):
+        """Copia desacoplada que sobrevive al buffer del pipeline"""
+        return FrameCopia(self.format, self.width, self.height,
+                          [np.ascontiguousarray(p) for p in self.planos])
+
+    def a_bgr(self):
+        return _a_bgr(self.format, self.planos, self.width, self.height)
+
+
+class FrameCopia:
+    """Frame ya copiado con la misma interfaz que FrameHandle (retener/liberar no hacen nada)"""
+
+    def __init__(self, format_str, width, height, planos):
+        self.format = format_str
+        self.width = width
+        self.height = height
+        self.planos = planos
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    mapeado = True
+
+    def retener(self):
+        return self
+
+    def liberar(self):
+        pass
+
+    @property
+    def array(self):
+        return self.planos[0]
+
+    def copiar(self):
+        return self
+
+    def a_bgr(self):
+        return _a_bgr(self.format, self.planos, self.width, self.height)
+
+
+def _a_bgr(format_str, planos, width, height):
+    """Convertir los planos a una imagen BGR contigua para OpenCV"""
+    import cv2
+
+    if format_str == "BGR":
+        return planos[0]
+    if format_str == "RGB":
+        return cv2.cvtColor(planos[0], cv2.COLOR_RGB2BGR)
+    if format_str in ("BGRA", "BGRx"):
+        return cv2.cvtColor(planos[0], cv2.COLOR_BGRA2BGR)
+    if format_str in ("RGBA", "RGBx"):
+        return cv2.cvtColor(planos[0], cv2.COLOR_RGBA2BGR)
+    if format_str == "GRAY8":
+        return cv2.cvtColor(planos[0], cv2.COLOR_GRAY2BGR)
+    if format_str in ("YUY2", "UYVY", "YVYU"):
+        codigo = {"YUY2": cv2.COLOR_YUV2BGR_YUY2, "UYVY": cv2.COLOR_YUV2BGR_UYVY,
+                  "YVYU": cv2.COLOR_YUV2BGR_YVYU}[format_str]
+        return cv2.cvtColor(planos[0], codigo)
+    if format_str in ("NV12", "NV21"):
+        y, uv = planos
+        codigo = cv2.COLOR_YUV2BGR_NV12 if format_str == "NV12" else cv2.COLOR_YUV2BGR_NV21
+        return cv2.cvtColorTwoPlane(y, uv, codigo)
+    if format_str in ("I420", "YV12"):
+        # cvtColor necesita los tres planos contiguos y sin padding (requiere ancho y alto pares)
+        y, u, v = planos
+        contiguo = np.concatenate([y.reshape(-1), u.reshape(-1), v.reshape(-1)])
+        return cv2.cvtColor(contiguo.reshape(height * 3 // 2, width), cv2.COLOR_YUV2BGR_I420)
+    raise ValueError(f"Formato no soportado: {format_str}")
+
+
+def mapear_frame(buffer, pad):
+    """Crear un FrameHandle a partir del buffer y las caps actuales del pad (o None)"""
+    caps = pad.get_current_caps()
+    if caps is None:
+        return None
+    structure = caps.get_structure(0)
+    format_str = structure.get_string('format')
+    width = structure.get_int('width')[1]
+    height = structure.get_int('height')[1]
+    try:
+        return FrameHandle(buffer, format_str, width, height, caps)
+    except (RuntimeError, ValueError):
+        return None
+
+
+# -----------------------------------------------------------------------------------------------
+# Benchmark: asignaciones por frame con la copia defensiva de hoy vs. FrameHandle
+# -----------------------------------------------------------------------------------------------
+class _MapInfoSimulado:
+    def __init__(self, data):
+        self.data = data
+
+
+class _BufferSimulado:
+    """Imita map/unmap de Gst.Buffer sobre memoria propia"""
+
+    def __init__(self, tamano):
+        self._memoria = bytearray(tamano)
+
+    def map(self, flags):
+        return True, _MapInfoSimulado(memoryview(self._memoria))
+
+    def unmap(self, map_info):
+        map_info.data.release()
+
+
+def _camino_actual(buffer, format_str, width, height):
+    """get_numpy_from_buffer + copia defensiva que hoy necesitan los consumidores"""
+    result, map_info = buffer.map(FLAG_LECTURA)
+    copia = np.frombuffer(map_info.data, dtype=np.uint8).reshape((height, width, 3)).copy()
+    buffer.unmap(map_info)
+    return copia
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de asignaciones por frame')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=640)
+    args = parser.parse_args()
+
+    tamano = _ru(args.width * 3, 4) * args.height
+    buffers = [_BufferSimulado(tamano) for _ in range(4)]
+
+    def medir(nombre, funcion):
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        for i in range(args.frames):
+            funcion(buffers[i % len(buffers)])
+        duracion = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"📊 {nombre}: {duracion * 1e6 / args.frames:.1f} µs/frame, "
+              f"pico de memoria {pico / 1024:.1f} KiB")
+
+    medir("Copia defensiva (hoy)",
+          lambda b: _camino_actual(b, "RGB", args.width, args.height))
+
+    def con_handle(b):
+        with FrameHandle(b, "RGB", args.width, args.height) as frame:
+            frame.array[0, 0, 0]
+
+    medir("FrameHandle (sin copia)", con_handle)
+
+    def con_retencion(b):
+        with FrameHandle(b, "RGB", args.width, args.height) as frame:
+            retenido = frame.retener()
+        retenido.liberar()
+
+    medir("FrameHandle retenido por un consumidor", con_retencion)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import heapq
+import shutil
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+
+_EXTENSIONES_RECOMPRIMIBLES = (".jpg", ".jpeg")
+
+
+class _Archivo:
+    __slots__ = ("instante", "tamano", "recomprimido")
+
+    def __init__(self, instante, tamano):
+        self.instante = instante
+        self.tamano = tamano
+        self.recomprimido = False
+
+
+class _Raiz:
+    """Índice de una carpeta de capturas: bytes totales y archivos ordenados por antigüedad"""
+
+    def __init__(self, path, max_bytes=None):
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.archivos = {}
+        # Heaps de (instante, path); las entradas viejas se descartan al sacarlas
+        self.por_antiguedad = []
+        self.por_recomprimir = []
+
+    def agregar(self, path, instante, tamano):
+        anterior = self.archivos.get(path)
+        if anterior is not None:
+            self.bytes -= anterior.tamano
+        self.archivos[path] = _Archivo(instante, tamano)
+        self.bytes += tamano
+        heapq.heappush(self.por_antiguedad, (instante, path))
+        if path.lower().endswith(_EXTENSIONES_RECOMPRIMIBLES):
+            heapq.heappush(self.por_recomprimir, (instante, path))
+
+    def _vigente(self, heap):
+        """Descartar del tope las entradas de archivos borrados o reescritos"""
+        while heap:
+            instante, path = heap[0]
+            archivo = self.archivos.get(path)
+            if archivo is not None and archivo.instante == instante:
+                return instante, path
+            heapq.heappop(heap)
+        return None
+
+    def mas_viejo(self):
+        return self._vigente(self.por_antiguedad)
+
+    def quitar_mas_viejo(self):
+        _, path = self._vigente(self.por_antiguedad)
+        heapq.heappop(self.por_antiguedad)
+        archivo = self.archivos.pop(path)
+        self.bytes -= archivo.tamano
+        return path, archivo.tamano
+
+
+class GestorDisco:
+    """Cuotas de tamaño y antigüedad para las carpetas de capturas, con borrado del más viejo
+
+    Los escritores avisan cada archivo nuevo con registrar(path, bytes): el
+    uso por carpeta se lleva de forma incremental y solo se recorre el disco
+    una vez, al arrancar. Un hilo aplica las políticas cada intervalo
+    segundos: borra lo que supera max_edad, después lo más viejo hasta
+    respetar la cuota de cada carpeta, max_bytes en total y min_libre en el
+    disco. Opcionalmente recomprime (y achica) los JPEG más viejos que
+    recomprimir_despues. reloj permite probarlo con un tiempo simulado.
+    """
+
+    def __init__(self, max_bytes=None, max_edad=None, min_libre=None, intervalo=5.0,
+                 recomprimir_despues=None, calidad=60, escala=0.5, max_recomprimir=20,
+                 reloj=time.time, registro=None):
+        self.max_bytes = max_bytes
+        self.max_edad = max_edad
+        self.min_libre = min_libre
+        self.intervalo = intervalo
+        self.recomprimir_despues = recomprimir_despues
+        self.calidad = calidad
+        self.escala = escala
+        self.max_recomprimir = max_recomprimir
+        self.reloj = reloj
+        self.registro = registro
+        self.raices = []
+        self._lock = threading.Lock()
+        self._activo = threading.Event()
+        self._despertar = threading.Event()
+        self._hilo = None
+
+        # Contadores
+        self.borrados = 0
+        self.bytes_borrados = 0
+        self.recomprimidos = 0
+        self.bytes_ahorrados = 0
+        self.errores = 0
+
+    def agregar_raiz(self, path, max_bytes=None, escanear=True):
+        """Administrar una carpeta (y sus subcarpetas); max_bytes es su cuota propia"""
+        os.makedirs(path, exist_ok=True)
+        raiz = _Raiz(path, max_bytes)
+        with self._lock:
+            self.raices.append(raiz)
+            # La más larga primero: una raíz dentro de otra se lleva sus archivos
+            self.raices.sort(key=lambda r: len(r.path), reverse=True)
+        if escanear:
+            self._escanear(raiz)
+        return raiz
+
+    def _escanear(self, raiz):
+        """Único recorrido del disco: indexar lo que ya había al arrancar"""
+        encontrados = []
+        for carpeta, _, nombres in os.walk(raiz.path):
+            for nombre in nombres:
+                path = os.path.join(carpeta, nombre)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                encontrados.append((path, st.st_mtime, st.st_size))
+        with self._lock:
+            for path, instante, tamano in encontrados:
+                raiz.agregar(path, instante, tamano)
+
+    def _raiz_de(self, path):
+        for raiz in self.raices:
+            if path == raiz.path or path.startswith(raiz.path + os.sep):
+                return raiz
+        return None
+
+    def registrar(self, path, tamano=None, instante=None):
+        """Avisar un archivo escrito (o reescrito); no toca el disco si se pasa tamano"""
+        path = os.path.abspath(path)
+        if tamano is None:
+            try:
+                tamano = os.path.getsize(path)
+            except OSError:
+                return False
+        instante = self.reloj() if instante is None else instante
+        with self._lock:
+            raiz = self._raiz_de(path)
+            if raiz is None:
+                return False
+            raiz.agregar(path, instante, tamano)
+        return True
+
+    # -------------------------------------------------------------------------
+    # Políticas
+    # -------------------------------------------------------------------------
+    def _libre(self):
+        if self.min_libre is None or not self.raices:
+            return None
+        try:
+            return shutil.disk_usage(self.raices[0].path).free
+        except OSError:
+            return None
+
+    def _elegir_victimas(self, ahora, libre):
+        """Sacar del índice lo que hay que borrar; el borrado real se hace sin el lock"""
+        victimas = []
+        with self._lock:
+            if self.max_edad is not None:
+                limite = ahora - self.max_edad
+                for raiz in self.raices:
+                    while (tope := raiz.mas_viejo()) is not None and tope[0] < limite:
+                        victimas.append(raiz.quitar_mas_viejo())
+            for raiz in self.raices:
+                while raiz.max_bytes is not None and raiz.bytes > raiz.max_bytes and raiz.archivos:
+                    victimas.append(raiz.quitar_mas_viejo())
+
+            def excedido():
+                if self.max_bytes is not None and sum(r.bytes for r in self.raices) > self.max_bytes:
+                    return True
+                return libre is not None and libre < self.min_libre
+
+            while excedido():
+                candidatas = [(tope, raiz) for raiz in self.raices
+                              if (tope := raiz.mas_viejo()) is not None]
+                if not candidatas:
+                    break
+                _, raiz = min(candidatas, key=lambda c: c[0])
+                path, tamano = raiz.quitar_mas_viejo()
+                victimas.append((path, tamano))
+                if libre is not None:
+                    libre += tamano
+        return victimas
+
+    def _borrar(self, victimas):
+        for path, tamano in victimas:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"⚠️ No se pudo borrar {path}: {e}")
+                self.errores += 1
+                continue
+            self.borrados += 1
+            self.bytes_borrados += tamano
+
+    def _elegir_recompresion(self, ahora):
+        if self.recomprimir_despues is None:
+            return []
+        limite = ahora - self.recomprimir_despues
+        elegidos = []
+        with self._lock:
+            for raiz in self.raices:
+                while len(elegidos) < self.max_recomprimir:
+                    tope = raiz._vigente(raiz.por_recomprimir)
+                    if tope is None or tope[0] >= limite:
+                        break
+                    heapq.heappop(raiz.por_recomprimir)
+                    archivo = raiz.archivos[tope[1]]
+                    if not archivo.recomprimido:
+                        elegidos.append((raiz, tope[1], archivo.instante))
+        return elegidos
+
+    def _recomprimir(self, elegidos):
+        import cv2
+        for raiz, path, instante in elegidos:
+            imagen = cv2.imread(path)
+            if imagen is None:
+                self.errores += 1
+                continue
+            if self.escala < 1.0:
+                imagen = cv2.resize(imagen, None, fx=self.escala, fy=self.escala,
+                                    interpolation=cv2.INTER_AREA)
+            ok, datos = cv2.imencode(".jpg", imagen, [cv2.IMWRITE_JPEG_QUALITY, self.calidad])
+            if not ok:
+                self.errores += 1
+                continue
+            temporal = path + ".tmp"
+            try:
+                with open(temporal, "wb") as f:
+                    f.write(datos)
+                # Reemplazo atómico: un lector nunca ve un JPEG a medio escribir
+                os.replace(temporal, path)
+            except OSError as e:
+                print(f"⚠️ No se pudo recomprimir {path}: {e}")
+                self.errores += 1
+                continue
+            with self._lock:
+                archivo = raiz.archivos.get(path)
+                if archivo is None or archivo.instante != instante:
+                    continue
+                ahorro = archivo.tamano - len(datos)
+                archivo.tamano = len(datos)
+                archivo.recomprimido = True
+                raiz.bytes -= ahorro
+            self.recomprimidos += 1
+            self.bytes_ahorrados += ahorro
+
+    def aplicar(self, ahora=None):
+        """Una pasada de todas las políticas (el hilo la llama cada intervalo segundos)"""
+        ahora = self.reloj() if ahora is None else ahora
+        self._recomprimir(self._elegir_recompresion(ahora))
+        self._borrar(self._elegir_victimas(ahora, self._libre()))
+        self.publicar_metricas()
+
+    # -------------------------------------------------------------------------
+    # Hilo y métricas
+    # -------------------------------------------------------------------------
+    def iniciar(self):
+        if self._activo.is_set():
+            return
+        self._activo.set()
+        self._despertar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="gestor_disco", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=5.0):
+        self._activo.clear()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+            self._hilo = None
+
+    def _bucle(self):
+        while self._activo.is_set():
+            try:
+                self.aplicar()
+            except Exception as e:
+                print(f"⚠️ Error en el gestor de disco: {e}")
+                self.errores += 1
+            # Event.wait en lugar de sleep: detener() no espera el intervalo completo
+            self._despertar.wait(self.intervalo)
+
+    def uso(self):
+        """{carpeta: (bytes, archivos)} según el índice, sin tocar el disco"""
+        with self._lock:
+            return {raiz.path: (raiz.bytes, len(raiz.archivos)) for raiz in self.raices}
+
+    def publicar_metricas(self):
+        if self.registro is None:
+            return
+        for path, (usados, archivos) in self.uso().items():
+            etiquetas = {"carpeta": os.path.basename(path)}
+            self.registro.fijar("disco_bytes", usados, etiquetas)
+            self.registro.fijar("disco_archivos", archivos, etiquetas)
+        libre = self._libre()
+        if libre is not None:
+            self.registro.fijar("disco_libre_bytes", libre)
+        self.registro.fijar("disco_borrados_total", self.borrados)
+        self.registro.fijar("disco_bytes_borrados_total", self.bytes_borrados)
+        self.registro.fijar("disco_recomprimidos_total", self.recomprimidos)
+        self.registro.fijar("disco_bytes_ahorrados_total", self.bytes_ahorrados)
+
+    def estadisticas(self):
+        uso = self.uso()
+        return {
+            "bytes": sum(b for b, _ in uso.values()),
+            "archivos": sum(n for _, n in uso.values()),
+            "borrados": self.borrados,
+            "bytes_borrados": self.bytes_borrados,
+            "recomprimidos": self.recomprimidos,
+            "bytes_ahorrados": self.bytes_ahorrados,
+            "errores": self.errores,
+        }
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--disco-max-gb', type=float,
+                        help='Tamaño máximo total de las carpetas de capturas (borra lo más viejo)')
+    parser.add_argument('--disco-max-dias', type=float,
+                        help='Borrar capturas más viejas que esta cantidad de días')
+    parser.add_argument('--disco-min-libre-gb', type=float,
+                        help='Borrar lo más viejo mientras el disco tenga menos espacio libre que esto')
+    parser.add_argument('--disco-recomprimir-horas', type=float,
+                        help='Recomprimir a la mitad de resolución los JPEG más viejos que esto')
+
+
+def desde_argumentos(args, carpetas, registro=None):
+    """Gestor con las carpetas dadas, o None si no se pidió ninguna política"""
+    politicas = (args.disco_max_gb, args.disco_max_dias, args.disco_min_libre_gb,
+                 args.disco_recomprimir_horas)
+    if all(p is None for p in politicas):
+        return None
+    gb = 1024 ** 3
+    gestor = GestorDisco(
+        max_bytes=int(args.disco_max_gb * gb) if args.disco_max_gb is not None else None,
+        max_edad=args.disco_max_dias * 86400 if args.disco_max_dias is not None else None,
+        min_libre=int(args.disco_min_libre_gb * gb) if args.disco_min_libre_gb is not None else None,
+        recomprimir_despues=(args.disco_recomprimir_horas * 3600
+                             if args.disco_recomprimir_horas is not None else None),
+        registro=registro)
+    for carpeta in carpetas:
+        gestor.agregar_raiz(carpeta)
+    return gestor
+
+
+# -----------------------------------------------------------------------------------------------
+# Prueba con archivos sintéticos en un directorio temporal y un reloj simulado
+# -----------------------------------------------------------------------------------------------
+class RelojSimulado:
+    def __init__(self, inicio=1_700_000_000.0):
+        self.ahora = inicio
+
+    def __call__(self):
+        return self.ahora
+
+    def avanzar(self, segundos):
+        self.ahora += segundos
+
+
+def _bytes_en_disco(carpetas):
+    total = 0
+    for raiz in carpetas:
+        for carpeta, _, nombres in os.walk(raiz):
+            total += sum(os.path.getsize(os.path.join(carpeta, n)) for n in nombres)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba del gestor de disco con archivos sintéticos')
+    parser.add_argument('--dias', type=int, default=10, help='Días simulados')
+    parser.add_argument('--capturas-dia', type=int, default=200)
+    parser.add_argument('--max-mb', type=float, default=10.0)
+    parser.add_argument('--max-dias', type=float, default=7.0)
+    parser.add_argument('--recomprimir-horas', type=float, default=6.0)
+    args = parser.parse_args()
+
+    import cv2
+    rng = np.random.default_rng(0)
+    # Imágenes con algo de estructura para que el JPEG se parezca a una captura real
+    base = cv2.GaussianBlur(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8), (0, 0), 3)
+    _, jpeg = cv2.imencode(".jpg", base, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    jpeg = jpeg.tobytes()
+
+    directorio = tempfile.mkdtemp(prefix="prueba_disco_")
+    carpetas = [os.path.join(directorio, "detections_vehicles"), os.path.join(directorio, "capturas_hd")]
+    reloj = RelojSimulado()
+    cuota_hd = int(args.max_mb * 0.6 * 1024 * 1024)
+    gestor = GestorDisco(max_bytes=int(args.max_mb * 1024 * 1024), max_edad=args.max_dias * 86400,
+                         recomprimir_despues=args.recomprimir_horas * 3600, max_recomprimir=10_000,
+                         reloj=reloj)
+    gestor.agregar_raiz(carpetas[0])
+    # La cuota propia de las HD deja lugar a las detecciones
+    gestor.agregar_raiz(carpetas[1], max_bytes=cuota_hd)
+
+    ok, orden_ok = True, True
+    t_registrar = 0.0
+    registrados = 0
+    periodo = 86400.0 / args.capturas_dia
+    try:
+        for dia in range(args.dias):
+            carpeta_dia = os.path.join(carpetas[0], f"detection_{dia:03d}")
+            os.makedirs(carpeta_dia, exist_ok=True)
+            for i in range(args.capturas_dia):
+                reloj.avanzar(periodo)
+                for path in (os.path.join(carpeta_dia, f"frame_{i:04d}.jpg"),
+                             os.path.join(carpeta_dia, f"frame_{i:04d}_bbox.jpg"),
+                             os.path.join(carpetas[1], f"captura_hd_{dia:03d}_{i:04d}.jpg")):
+                    with open(path, "wb") as f:
+                        f.write(jpeg)
+                    t0 = time.perf_counter()
+                    gestor.registrar(path, len(jpeg))
+                    t_registrar += time.perf_counter() - t0
+                    registrados += 1
+                if i % 20 == 0:
+                    antes = [{p: a.instante for p, a in r.archivos.items()} for r in gestor.raices]
+                    gestor.aplicar()
+                    # Dentro de cada carpeta, todo lo borrado es más viejo que todo lo que queda
+                    for raiz, instantes in zip(gestor.raices, antes):
+                        borrados = [t for p, t in instantes.items() if p not in raiz.archivos]
+                        if borrados and raiz.archivos:
+                            orden_ok &= max(borrados) <= min(a.instante for a in raiz.archivos.values())
+                    ok &= gestor.estadisticas()["bytes"] <= gestor.max_bytes
+            uso = gestor.estadisticas()
+            print(f"📅 Día {dia + 1}: {uso['bytes'] / 1e6:.1f} MB en {uso['archivos']} archivos, "
+                  f"{uso['borrados']} borrados, {uso['recomprimidos']} recomprimidos")
+
+        estadisticas = gestor.estadisticas()
+        en_disco = _bytes_en_disco(carpetas)
+        viejo = min(a.instante for r in gestor.raices for a in r.archivos.values())
+        t0 = time.perf_counter()
+        _bytes_en_disco(carpetas)
+        t_escaneo = time.perf_counter() - t0
+        print(f"📊 {estadisticas}")
+        print(f"📊 registrar: {t_registrar * 1e6 / registrados:.1f} µs/archivo; "
+              f"recorrer las carpetas: {t_escaneo * 1000:.1f} ms")
+        checks = [
+            ("el índice coincide con el disco", en_disco == estadisticas["bytes"]),
+            ("nunca se pasó de la cuota total", ok),
+            ("la cuota de las HD se respeta", gestor.uso()[os.path.abspath(carpetas[1])][0] <= cuota_hd),
+            ("nada más viejo que max_dias", reloj() - viejo <= args.max_dias * 86400),
+            ("se borró siempre lo más viejo", orden_ok),
+            ("la recompresión ahorró espacio", estadisticas["bytes_ahorrados"] > 0),
+        ]
+        for descripcion, paso in checks:
+            print(f"{'✅' if paso else '❌'} {descripcion}")
+        # Un gestor nuevo sobre las mismas carpetas arranca con el mismo uso
+        reinicio = GestorDisco()
+        for carpeta in carpetas:
+            reinicio.agregar_raiz(carpeta)
+        mismo = reinicio.estadisticas()["bytes"] == estadisticas["bytes"]
+        print(f"{'✅' if mismo else '❌'} el escaneo inicial reconstruye el índice")
+        sys.exit(0 if all(p for _, p in checks) and mismo else 1)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+# Dónde buscar modelos .hef y librerías de post-procesamiento
+RAICES = (
+    "/home/jose/hailo-rpi5-examples",
+    "/opt/hailo",
+    "/usr/lib/hailo",
+    "/usr/lib/gstreamer-1.0",
+    "/usr/share/hailo-models",
+)
+
+_IGNORAR = {".git", "__pycache__", "node_modules"}
+_VERSION = 1
+
+
+def _tipo(nombre):
+    if nombre.endswith(".hef"):
+        return "modelo"
+    if nombre.endswith(".so") and "post" in nombre:
+        return "postproceso"
+    return None
+
+
+def _sello(st):
+    return [st.st_mtime_ns, st.st_ino]
+
+
+class IndiceArtefactos:
+    """Índice persistente de modelos .hef, librerías de post-proceso y formatos V4L2
+
+    Se escanea una sola vez y se guarda en JSON. Al arrancar solo se lee el
+    archivo (milisegundos); la verificación contra el disco (mtime e inode
+    de cada directorio) y el re-escaneo de lo que cambió corren en un hilo
+    en segundo plano. Los formatos de cada /dev/videoN se guardan junto con
+    el inode/rdev/ctime del nodo, que cambian cuando el dispositivo se
+    reconecta.
+    """
+
+    def __init__(self, raices=RAICES, path=None, profundidad=6):
+        self.raices = [os.path.abspath(r) for r in raices]
+        self.path = path or os.path.join(os.path.expanduser("~"), ".cache", "hailo_detector",
+                                         "indice.json")
+        self.profundidad = profundidad
+        self._datos = self._vacio()
+        self._lock = threading.Lock()
+        self._hilos = []
+        self.desde_disco = False
+
+    def _vacio(self):
+        return {"version": _VERSION, "raices": list(self.raices), "directorios": {},
+                "artefactos": {}, "dispositivos": {}}
+
+    # -------------------------------------------------------------------------
+    # Persistencia
+    # -------------------------------------------------------------------------
+    def cargar(self):
+        """Leer el índice de disco; si no hay uno utilizable, escanear ahora"""
+        try:
+            with open(self.path) as f:
+                datos = json.load(f)
+            if datos.get("version") == _VERSION and datos.get("raices") == self.raices:
+                self._datos = datos
+                self.desde_disco = True
+        except (OSError, ValueError):
+            pass
+        if not self.desde_disco:
+            self.escanear()
+        return self
+
+    def guardar(self):
+        carpeta = os.path.dirname(self.path) or "."
+        os.makedirs(carpeta, exist_ok=True)
+        with self._lock:
+            texto = json.dumps(self._datos)
+        fd, temporal = tempfile.mkstemp(dir=carpeta, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(texto)
+        os.replace(temporal, self.path)
+
+    # -------------------------------------------------------------------------
+    # Escaneo
+    # -------------------------------------------------------------------------
+    def _escanear_raiz(self, raiz, directorios, artefactos):
+        pendientes = [(raiz, 0)]
+        while pendientes:
+            directorio, nivel = pendientes.pop()
+            try:
+                directorios[directorio] = _sello(os.stat(directorio))
+                entradas = list(os.scandir(directorio))
+            except OSError:
+                continue
+            for entrada in entradas:
+                try:
+                    if entrada.is_dir(follow_symlinks=False):
+                        if nivel < self.profundidad and entrada.name not in _IGNORAR:
+                            pendientes.append((entrada.path, nivel + 1))
+                        continue
+                    tipo = _tipo(entrada.name)
+                    if tipo is not None:
+                        st = entrada.stat()
+                        artefactos[entrada.path] = {"tipo": tipo, "sello": _sello(st),
+                                                    "tamano": st.st_size}
+                except OSError:
+                    continue
+
+    def escanear(self, raices=None):
+        """Re-escanear las raíces indicadas (por defecto todas) y guardar el índice"""
+        raices = self.raices if raices is None else raices
+        directorios, artefactos = {}, {}
+        for raiz in raices:
+            self._escanear_raiz(raiz, directorios, artefactos)
+
+        def dentro(path):
+            return any(path == r or path.startswith(r + os.sep) for r in raices)
+
+        with self._lock:
+            viejos = self._datos
+            self._datos = dict(viejos)
+            self._datos["directorios"] = {
+                d: s for d, s in viejos["directorios"].items() if not dentro(d)}
+            self._datos["directorios"].update(directorios)
+            self._datos["artefactos"] = {
+                a: v for a, v in viejos["artefactos"].items() if not dentro(a)}
+            self._datos["artefactos"].update(artefactos)
+        self.guardar()
+
+    def desactualizadas(self):
+        """Raíces con algún directorio cuyo mtime/inode cambió (o que aparecieron/desaparecieron)"""
+        with self._lock:
+            directorios = dict(self._datos["directorios"])
+        cambiadas = []
+        for raiz in self.raices:
+            propios = [d for d in directorios if d == raiz or d.startswith(raiz + os.sep)]
+            if not propios and os.path.isdir(raiz):
+                cambiadas.append(raiz)
+                continue
+            for directorio in propios:
+                try:
+                    if _sello(os.stat(directorio)) != directorios[directorio]:
+                        cambiadas.append(raiz)
+                        break
+                except OSError:
+                    cambiadas.append(raiz)
+                    break
+        return cambiadas
+
+    def refrescar_en_segundo_plano(self):
+        """Verificar el índice contra el disco en otro hilo y re-escanear lo que cambió"""
+        def refrescar():
+            cambiadas = self.desactualizadas()
+            if cambiadas:
+                self.escanear(cambiadas)
+            for dispositivo in list(self._datos["dispositivos"]):
+                if not self._dispositivo_vigente(dispositivo):
+                    self._consultar_v4l2(dispositivo)
+        hilo = threading.Thread(target=refrescar, name="indice_artefactos", daemon=True)
+        hilo.start()
+        self._hilos.append(hilo)
+        return hilo
+
+    def esperar(self, timeout=None):
+        for hilo in self._hilos:
+            hilo.join(timeout)
+        self._hilos = []
+
+    # -------------------------------------------------------------------------
+    # Consultas
+    # -------------------------------------------------------------------------
+    def artefactos(self, tipo):
+        with self._lock:
+            return sorted(p for p, v in self._datos["artefactos"].items() if v["tipo"] == tipo)
+
+    def buscar(self, tipo, preferidos=(), filtro=None):
+        """Primer preferido que exista; si no, el primer artefacto del índice que pase el filtro
+
+        Solo se hace un stat del resultado, para no devolver algo borrado desde
+        el último escaneo. Si el índice no tiene nada, se re-escanea una vez.
+        """
+        for path in preferidos:
+            if os.path.exists(path):
+                return path
+        for intento in range(2):
+            for path in self.artefactos(tipo):
+                if (filtro is None or filtro(path)) and os.path.exists(path):
+                    return path
+            if intento == 0:
+                cambiadas = self.desactualizadas()
+                if not cambiadas:
+                    break
+                self.escanear(cambiadas)
+        return None
+
+    def _sello_dispositivo(self, dispositivo):
+        st = os.stat(dispositivo)
+        return [st.st_ino, st.st_rdev, st.st_ctime_ns]
+
+    def _dispositivo_vigente(self, dispositivo):
+        with self._lock:
+            guardado = self._datos["dispositivos"].get(dispositivo)
+        try:
+            return guardado is not None and guardado["sello"] == self._sello_dispositivo(dispositivo)
+        except OSError:
+            return False
+
+    def _consultar_v4l2(self, dispositivo):
+        try:
+            sello = self._sello_dispositivo(dispositivo)
+        except OSError:
+            return None
+        try:
+            resultado = subprocess.run(['v4l2-ctl', '--device', dispositivo, '--list-formats-ext'],
+                                       capture_output=True, text=True, timeout=10)
+            formatos = resultado.stdout if resultado.returncode == 0 else None
+            error = None if formatos is not None else "No se pudieron obtener los formatos"
+        except FileNotFoundError:
+            formatos, error = None, "v4l2-ctl no instalado"
+        except subprocess.TimeoutExpired:
+            formatos, error = None, "v4l2-ctl no respondió"
+        entrada = {"sello": sello, "formatos": formatos, "error": error}
+        with self._lock:
+            self._datos["dispositivos"][dispositivo] = entrada
+        self.guardar()
+        return entrada
+
+    def formatos_v4l2(self, dispositivo, esperar=False):
+        """Formatos del dispositivo ({"formatos", "error"}) si están en el índice y vigentes
+
+        Si no lo están, la consulta a v4l2-ctl se hace en segundo plano y se
+        devuelve None (o se espera, con esperar=True).
+        """
+        if self._dispositivo_vigente(dispositivo):
+            with self._lock:
+                return self._datos["dispositivos"][dispositivo]
+        if esperar:
+            return self._consultar_v4l2(dispositivo)
+        hilo = threading.Thread(target=self._consultar_v4l2, args=(dispositivo,),
+                                name="indice_v4l2", daemon=True)
+        hilo.start()
+        self._hilos.append(hilo)
+        return None
+
+
+_indice = None
+
+
+def indice():
+    """Índice global, cargado una vez y refrescado en segundo plano"""
+    global _indice
+    if _indice is None:
+        _indice = IndiceArtefactos().cargar()
+        if _indice.desde_disco:
+            _indice.refrescar_en_segundo_plano()
+    return _indice
+
+
+# -----------------------------------------------------------------------------------------------
+# Benchmark de arranque sobre un árbol temporal de artefactos falsos
+# -----------------------------------------------------------------------------------------------
+def crear_arbol(raiz, directorios=300, archivos=20):
+    """Árbol con muchos archivos irrelevantes, algunos .hef y una librería de post-proceso"""
+    for d in range(directorios):
+        carpeta = os.path.join(raiz, f"paquete_{d % 10}", f"modulo_{d}")
+        os.makedirs(carpeta, exist_ok=True)
+        for a in range(archivos):
+            open(os.path.join(carpeta, f"archivo_{a}.py"), "w").close()
+    recursos = os.path.join(raiz, "resources")
+    os.makedirs(recursos, exist_ok=True)
+    for nombre in ("yolov8s_h8l.hef", "yolov6n_h8l.hef", "yolov11n_h8l.hef"):
+        with open(os.path.join(recursos, nombre), "wb") as f:
+            f.write(b"\0" * 1024)
+    libs = os.path.join(raiz, "paquete_3", "modulo_3", "resources")
+    os.makedirs(libs, exist_ok=True)
+    open(os.path.join(libs, "libyolo_hailortpp_postprocess.so"), "w").close()
+
+
+def _descubrir_escaneando(raiz):
+    """Lo que hacía HeadlessDetectionApp: listdir de recursos + find del .so + find de .hef"""
+    recursos = os.path.join(raiz, "resources")
+    modelo = next((os.path.join(recursos, f) for f in os.listdir(recursos)
+                   if f.endswith(".hef") and "yolo" in f.lower()), None)
+    resultado = subprocess.run(['find', raiz, '-name', '*yolo*post*.so', '-type', 'f'],
+                               capture_output=True, text=True, timeout=10)
+    postproceso = resultado.stdout.strip().split('\n')[0] or None
+    subprocess.run(['find', raiz, '-name', '*.hef', '-type', 'f'],
+                   capture_output=True, text=True, timeout=15)
+    return modelo, postproceso
+
+
+def _es_yolo_post(path):
+    nombre = os.path.basename(path)
+    return "yolo" in nombre and "post" in nombre
+
+
+def _descubrir_con_indice(raiz, path):
+    ind = IndiceArtefactos([raiz], path).cargar()
+    modelo = ind.buscar("modelo", filtro=lambda p: "yolo" in os.path.basename(p).lower())
+    postproceso = ind.buscar("postproceso", filtro=_es_yolo_post)
+    ind.refrescar_en_segundo_plano()
+    return ind, modelo, postproceso
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tiempo de descubrimiento de modelos al arrancar')
+    parser.add_argument('--directorios', type=int, default=300)
+    parser.add_argument('--archivos', type=int, default=20)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--listar', action='store_true',
+                        help='Mostrar lo que hay en el índice real del sistema y salir')
+    args = parser.parse_args()
+
+    if args.listar:
+        ind = indice()
+        ind.esperar()
+        for tipo in ("modelo", "postproceso"):
+            for path in ind.artefactos(tipo):
+                print(f"{tipo:12s} {path}")
+        return
+
+    raiz = tempfile.mkdtemp(prefix="bench_artefactos_")
+    path = os.path.join(raiz, "indice.json")
+    arbol = os.path.join(raiz, "arbol")
+    try:
+        crear_arbol(arbol, args.directorios, args.archivos)
+
+        def medir(funcion):
+            mejor = float("inf")
+            for _ in range(args.repeticiones):
+                inicio = time.perf_counter()
+                resultado = funcion()
+                mejor = min(mejor, time.perf_counter() - inicio)
+                # El refresco en segundo plano no cuenta para el arranque, pero no debe solaparse
+                if isinstance(resultado, tuple) and isinstance(resultado[0], IndiceArtefactos):
+                    resultado[0].esperar()
+            return mejor * 1000
+
+        t_escaneo = medir(lambda: _descubrir_escaneando(arbol))
+
+        def en_frio():
+            if os.path.exists(path):
+                os.remove(path)
+            _descubrir_con_indice(arbol, path)[0].esperar()
+        t_frio = medir(en_frio)
+
+        t_caliente = medir(lambda: _descubrir_con_indice(arbol, path))
+        ind, modelo, postproceso = _descubrir_con_indice(arbol, path)
+        ind.esperar()
+
+        print(f"📦 Modelo: {os.path.relpath(modelo, arbol)} | post-proceso: "
+              f"{os.path.relpath(postproceso, arbol)}")
+        print(f"⏱️  listdir + find: {t_escaneo:.1f} ms | índice en frío: {t_frio:.1f} ms | "
+              f"índice cargado: {t_caliente:.2f} ms")
+    finally:
+        shutil.rmtree(raiz, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
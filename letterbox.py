@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+
+import numpy as np
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+except (ImportError, ValueError):
+    Gst = None
+
+# Nombre del GstCustomMeta con la transformación de cada buffer
+NOMBRE_META = "HailoLetterbox"
+_CAMPOS = ("ancho", "alto", "ancho_modelo", "alto_modelo", "pad_x", "pad_y")
+
+
+class Transformacion:
+    """Letterbox de un frame ancho x alto a la entrada del modelo
+
+    La imagen se escala por igual en los dos ejes (escala) y queda centrada
+    con bandas de pad_x / pad_y píxeles a los costados o arriba y abajo.
+    """
+
+    __slots__ = ("ancho", "alto", "ancho_modelo", "alto_modelo", "escala", "pad_x", "pad_y",
+                 "_vectores")
+
+    def __init__(self, ancho, alto, ancho_modelo, alto_modelo, pad_x, pad_y):
+        self.ancho = ancho
+        self.alto = alto
+        self.ancho_modelo = ancho_modelo
+        self.alto_modelo = alto_modelo
+        self.pad_x = pad_x
+        self.pad_y = pad_y
+        # Escala del eje que llena la entrada; el otro usa la misma (salvo redondeo)
+        if pad_x == 0:
+            self.escala = ancho_modelo / ancho
+        else:
+            self.escala = alto_modelo / alto
+        self._vectores = None
+
+    @classmethod
+    def calcular(cls, ancho, alto, ancho_modelo=640, alto_modelo=640):
+        """Mismo rectángulo centrado que usa videoscale add-borders=true con PAR 1/1"""
+        if ancho * alto_modelo >= alto * ancho_modelo:
+            nuevo_alto = ancho_modelo * alto // ancho
+            return cls(ancho, alto, ancho_modelo, alto_modelo, 0, (alto_modelo - nuevo_alto) // 2)
+        nuevo_ancho = alto_modelo * ancho // alto
+        return cls(ancho, alto, ancho_modelo, alto_modelo, (ancho_modelo - nuevo_ancho) // 2, 0)
+
+    @classmethod
+    def identidad(cls, ancho_modelo=640, alto_modelo=640):
+        return cls(ancho_modelo, alto_modelo, ancho_modelo, alto_modelo, 0, 0)
+
+    def vectores(self):
+        """(multiplicador, desplazamiento, tamaño) para desmapear xyxy con una sola operación"""
+        if self._vectores is None:
+            modelo = np.array([self.ancho_modelo, self.alto_modelo] * 2, dtype=np.float32)
+            pad = np.array([self.pad_x, self.pad_y] * 2, dtype=np.float32)
+            self._vectores = (modelo / self.escala, pad / self.escala,
+                              np.array([self.ancho, self.alto] * 2, dtype=np.float32))
+        return self._vectores
+
+    def a_dict(self):
+        return {campo: getattr(self, campo) for campo in _CAMPOS}
+
+    def __eq__(self, otra):
+        return isinstance(otra, Transformacion) and self.a_dict() == otra.a_dict()
+
+    def __repr__(self):
+        return (f"Transformacion({self.ancho}x{self.alto} -> {self.ancho_modelo}x{self.alto_modelo}, "
+                f"escala={self.escala:.4f}, pad=({self.pad_x}, {self.pad_y}))")
+
+
+def caps_modelo(ancho=640, alto=640, formato="RGB"):
+    """Caps de la entrada del modelo; pixel-aspect-ratio=1/1 obliga a videoscale a agregar bandas"""
+    return f"video/x-raw,format={formato},width={ancho},height={alto},pixel-aspect-ratio=1/1"
+
+
+def elementos_letterbox(nombre="letterbox", combinado=False):
+    """Preproceso de EspecPipeline: el escalador con nombre es donde se instala el marcador
+
+    combinado usa videoconvertscale (GStreamer >= 1.22): convierte y escala en
+    una sola pasada en lugar de videoconvert ! videoscale.
+    """
+    if combinado:
+        return [f"videoconvertscale name={nombre} add-borders=true"]
+    return ["videoconvert", f"videoscale name={nombre} add-borders=true"]
+
+
+def letterbox(frame, ancho_modelo=640, alto_modelo=640, relleno=0):
+    """Letterbox de referencia con OpenCV (para pruebas y para el camino sin GStreamer)"""
+    import cv2
+    alto, ancho = frame.shape[:2]
+    t = Transformacion.calcular(ancho, alto, ancho_modelo, alto_modelo)
+    nuevo_ancho = ancho_modelo - 2 * t.pad_x
+    nuevo_alto = alto_modelo - 2 * t.pad_y
+    salida = np.full((alto_modelo, ancho_modelo) + frame.shape[2:], relleno, dtype=frame.dtype)
+    salida[t.pad_y:t.pad_y + nuevo_alto, t.pad_x:t.pad_x + nuevo_ancho] = cv2.resize(
+        frame, (nuevo_ancho, nuevo_alto), interpolation=cv2.INTER_LINEAR)
+    return salida, t
+
+
+def desmapear(xyxy, transformacion, tamano_hd=None, calibracion_hd=None):
+    """Cajas normalizadas a la entrada del modelo -> píxeles de la cámara original y de la HD
+
+    Devuelve (camara, hd), ambos Nx4 float32 en xyxy; hd es None sin
+    tamano_hd. calibracion_hd = (sx, sy, dx, dy) lleva coordenadas normalizadas
+    de la cámara a normalizadas de la HD (x_hd = x * sx + dx); por defecto se
+    asume el mismo campo de visión.
+    """
+    multiplicador, desplazamiento, tamano = transformacion.vectores()
+    xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+    camara = np.clip(xyxy * multiplicador - desplazamiento, 0.0, tamano)
+    if tamano_hd is None:
+        return camara, None
+
+    normalizadas = camara / tamano
+    if calibracion_hd is not None:
+        sx, sy, dx, dy = calibracion_hd
+        normalizadas = normalizadas * np.array([sx, sy, sx, sy], dtype=np.float32) \
+            + np.array([dx, dy, dx, dy], dtype=np.float32)
+    hd_tamano = np.array(list(tamano_hd) * 2, dtype=np.float32)
+    return camara, np.clip(normalizadas * hd_tamano, 0.0, hd_tamano)
+
+
+def a_entrada(xyxy, transformacion):
+    """Cajas normalizadas -> xywh en píxeles del frame que recibe el modelo (para anotarlo)"""
+    t = transformacion
+    cajas = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4) * np.array(
+        [t.ancho_modelo, t.alto_modelo] * 2, dtype=np.float32)
+    cajas[:, 2:] -= cajas[:, :2]
+    return cajas
+
+
+def calibracion_desde_texto(texto):
+    valores = tuple(float(v) for v in texto.split(","))
+    if len(valores) != 4:
+        raise ValueError(f"La calibración HD son 4 valores sx,sy,dx,dy: {texto}")
+    return valores
+
+
+class MarcadorLetterbox:
+    """Registra la transformación del letterbox y la adjunta a cada buffer
+
+    Lee los caps de entrada y salida del videoscale y, en cada buffer que sale,
+    agrega un GstCustomMeta con los campos de la transformación (hailonet lo
+    copia con el buffer). Si la versión de GStreamer no tiene custom meta o el
+    buffer no es escribible desde Python, transformacion_de() usa la última
+    transformación vista, que solo cambia con los caps.
+    """
+
+    def __init__(self):
+        self.actual = None
+        self._entrada = None
+        self._salida = None
+        self.con_meta = 0
+        self.sin_meta = 0
+        self._meta_disponible = _registrar_meta()
+
+    def instalar(self, elemento):
+        elemento.get_static_pad("sink").add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self._caps, "entrada")
+        salida = elemento.get_static_pad("src")
+        salida.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self._caps, "salida")
+        salida.add_probe(Gst.PadProbeType.BUFFER, self._marcar)
+
+    def _caps(self, pad, info, lado):
+        evento = info.get_event()
+        if evento is not None and evento.type == Gst.EventType.CAPS:
+            estructura = evento.parse_caps().get_structure(0)
+            tamano = (estructura.get_int("width")[1], estructura.get_int("height")[1])
+            if lado == "entrada":
+                self._entrada = tamano
+            else:
+                self._salida = tamano
+            if self._entrada and self._salida:
+                self.actual = Transformacion.calcular(*self._entrada, *self._salida)
+        return Gst.PadProbeReturn.OK
+
+    def _marcar(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer is None or self.actual is None or not self._meta_disponible:
+            return Gst.PadProbeReturn.OK
+        try:
+            estructura = buffer.add_custom_meta(NOMBRE_META).get_structure()
+            for campo, valor in self.actual.a_dict().items():
+                estructura.set_value(campo, valor)
+            self.con_meta += 1
+        except Exception:
+            self.sin_meta += 1
+        return Gst.PadProbeReturn.OK
+
+    def transformacion_de(self, buffer):
+        if self._meta_disponible:
+            try:
+                meta = buffer.get_custom_meta(NOMBRE_META)
+                if meta is not None:
+                    estructura = meta.get_structure()
+                    return Transformacion(*(estructura.get_value(c) for c in _CAMPOS))
+            except Exception:
+                pass
+        return self.actual
+
+
+def _registrar_meta():
+    """Registrar el custom meta una vez por proceso (GStreamer >= 1.20)"""
+    if Gst is None:
+        return False
+    if Gst.meta_get_info(NOMBRE_META) is not None:
+        return True
+    try:
+        if hasattr(Gst, "meta_register_custom_simple"):
+            Gst.meta_register_custom_simple(NOMBRE_META)
+        else:
+            Gst.meta_register_custom(NOMBRE_META, [], None, None)
+        return True
+    except Exception:
+        return False
+
+
+# -----------------------------------------------------------------------------------------------
+# Prueba con frames sintéticos: cajas conocidas, letterbox y vuelta a la cámara y a la HD
+# -----------------------------------------------------------------------------------------------
+# Colores saturados: el borde interpolado de uno (mezcla con negro) no se confunde con otro
+_PALETA = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255),
+           (255, 128, 0), (128, 0, 255)]
+
+
+def escena(rng, n, columnas=4):
+    """Cajas normalizadas conocidas, cada una dentro de su celda de una grilla (sin solaparse)"""
+    filas = -(-n // columnas)
+    celda = np.array([1.0 / columnas, 1.0 / filas], dtype=np.float32)
+    indices = np.arange(n)
+    esquina = np.stack([indices % columnas, indices // columnas], axis=1) * celda
+    lados = rng.uniform(0.3, 0.9, (n, 2)) * celda
+    origen = esquina + rng.uniform(0, 1, (n, 2)) * (celda - lados)
+    return np.concatenate([origen, origen + lados], axis=1).astype(np.float32)
+
+
+def dibujar(cajas, ancho, alto, colores):
+    frame = np.zeros((alto, ancho, 3), dtype=np.uint8)
+    for (x1, y1, x2, y2), color in zip(cajas, colores):
+        frame[int(round(y1 * alto)):int(round(y2 * alto)), int(round(x1 * ancho)):int(round(x2 * ancho))] = color
+    return frame
+
+
+def detectar_colores(imagen, colores):
+    """Detector exacto para la prueba: caja envolvente de cada color, normalizada a la imagen"""
+    alto, ancho = imagen.shape[:2]
+    cajas = []
+    for color in colores:
+        mascara = np.all(np.abs(imagen.astype(np.int16) - color) <= 12, axis=2)
+        ys, xs = np.nonzero(mascara)
+        cajas.append((xs.min(), ys.min(), xs.max() + 1, ys.max() + 1) if len(xs) else (0, 0, 0, 0))
+    return np.asarray(cajas, dtype=np.float32) / np.array([ancho, alto] * 2, dtype=np.float32)
+
+
+_REPETICIONES = 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precisión y costo del letterbox y el desmapeo')
+    parser.add_argument('--camara', default='640x480', help='Resolución de la cámara de detección')
+    parser.add_argument('--hd', default='1920x1440', help='Resolución de la cámara HD')
+    parser.add_argument('--modelo', type=int, default=640)
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--objetos', type=int, default=6, choices=range(1, len(_PALETA) + 1))
+    args = parser.parse_args()
+
+    ancho, alto = (int(v) for v in args.camara.split("x"))
+    ancho_hd, alto_hd = (int(v) for v in args.hd.split("x"))
+    rng = np.random.default_rng(0)
+    colores = _PALETA[:args.objetos]
+
+    error_letterbox = error_estirado = error_hd = 0.0
+    distorsion_letterbox = distorsion_estirado = 0.0
+    t_letterbox = t_desmapeo = 0.0
+    for _ in range(args.frames):
+        cajas = escena(rng, args.objetos)
+        frame = dibujar(cajas, ancho, alto, colores)
+        reales = cajas * np.array([ancho, alto] * 2, dtype=np.float32)
+        reales_hd = cajas * np.array([ancho_hd, alto_hd] * 2, dtype=np.float32)
+
+        inicio = time.perf_counter()
+        entrada, t = letterbox(frame, args.modelo, args.modelo)
+        t_letterbox += time.perf_counter() - inicio
+        detectadas = detectar_colores(entrada, colores)
+        # La transformación se reutiliza entre frames: se mide el costo ya en régimen
+        inicio = time.perf_counter()
+        for _ in range(_REPETICIONES):
+            camara, hd = desmapear(detectadas, t, (ancho_hd, alto_hd))
+        t_desmapeo += (time.perf_counter() - inicio) / _REPETICIONES
+        error_letterbox = max(error_letterbox, float(np.abs(camara - reales).max()))
+        error_hd = max(error_hd, float(np.abs(hd - reales_hd).max()))
+
+        # Camino anterior: estirar a la entrada y leer las cajas como si no hubiera deformación
+        import cv2
+        estirada = cv2.resize(frame, (args.modelo, args.modelo), interpolation=cv2.INTER_LINEAR)
+        cajas_estiradas = detectar_colores(estirada, colores)
+        error_estirado = max(error_estirado, float(np.abs(
+            cajas_estiradas * np.array([ancho, alto] * 2) - reales).max()))
+
+        def aspecto(c):
+            return (c[:, 2] - c[:, 0]) / np.maximum(c[:, 3] - c[:, 1], 1e-9)
+        verdadero = aspecto(reales)
+        distorsion_letterbox = max(distorsion_letterbox, float(np.abs(
+            aspecto(detectadas * np.array([args.modelo] * 4)) / verdadero - 1).max()))
+        distorsion_estirado = max(distorsion_estirado, float(np.abs(
+            aspecto(cajas_estiradas * np.array([args.modelo] * 4)) / verdadero - 1).max()))
+
+    print(f"📐 {t}")
+    print(f"📊 Error máximo en la cámara: {error_letterbox:.2f} px (1 px del modelo = {1 / t.escala:.2f} px) | "
+          f"HD: {error_hd:.2f} px")
+    print(f"📊 Aspecto de los objetos en la entrada del modelo: letterbox {distorsion_letterbox * 100:.1f}% | "
+          f"estirado {distorsion_estirado * 100:.1f}% de deformación")
+    print(f"⏱️  letterbox (OpenCV) {t_letterbox * 1e6 / args.frames:.0f} µs/frame | "
+          f"desmapeo {t_desmapeo * 1e6 / args.frames:.1f} µs/frame ({args.objetos} cajas)")
+    ok = error_letterbox <= 2.0 / t.escala + 1 and error_hd <= (2.0 / t.escala + 1) * ancho_hd / ancho
+    print("✅ Desmapeo correcto" if ok else "❌ Error de desmapeo fuera de tolerancia")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
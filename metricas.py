@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import math
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# GStreamer es opcional: los histogramas y la exportación funcionan sin él
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst, GLib
+except (ImportError, ValueError):
+    Gst = None
+    GLib = None
+
+# Buckets logarítmicos de 1 µs a ~100 s, 20 por década (error relativo < 6%)
+_BUCKETS_POR_DECADA = 20
+_MINIMO = 1e-6
+_NUM_BUCKETS = 8 * _BUCKETS_POR_DECADA + 2
+
+
+def _limite_superior(indice):
+    if indice == 0:
+        return _MINIMO
+    if indice >= _NUM_BUCKETS - 1:
+        return math.inf
+    return _MINIMO * 10 ** (indice / _BUCKETS_POR_DECADA)
+
+
+class Histograma:
+    """Histograma de latencias con buckets logarítmicos, sin locks al registrar
+
+    Cada hilo escribe en su propio array de contadores (threading.local), así
+    que registrar() nunca compite con otros hilos; los percentiles suman los
+    arrays de todos los hilos al leer.
+    """
+
+    def __init__(self, nombre, ayuda=""):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self._local = threading.local()
+        self._por_hilo = []
+        self._alta = threading.Lock()
+
+    def _contadores(self):
+        contadores = getattr(self._local, "contadores", None)
+        if contadores is None:
+            # [buckets..., cantidad, suma]
+            contadores = [0] * (_NUM_BUCKETS + 2)
+            self._local.contadores = contadores
+            with self._alta:
+                self._por_hilo.append(contadores)
+        return contadores
+
+    def registrar(self, segundos):
+        contadores = self._contadores()
+        if segundos <= _MINIMO:
+            indice = 0
+        else:
+            indice = min(_NUM_BUCKETS - 1,
+                         int(math.ceil(math.log10(segundos / _MINIMO) * _BUCKETS_POR_DECADA)))
+        contadores[indice] += 1
+        contadores[_NUM_BUCKETS] += 1
+        contadores[_NUM_BUCKETS + 1] += segundos
+
+    def _sumar(self):
+        total = [0] * (_NUM_BUCKETS + 2)
+        with self._alta:
+            hilos = list(self._por_hilo)
+        for contadores in hilos:
+            for i, valor in enumerate(contadores):
+                total[i] += valor
+        return total
+
+    def resumen(self, percentiles=(50, 95, 99)):
+        total = self._sumar()
+        cantidad = total[_NUM_BUCKETS]
+        datos = {"cantidad": cantidad, "suma": total[_NUM_BUCKETS + 1]}
+        for p in percentiles:
+            datos[f"p{p}"] = self._percentil(total, cantidad, p)
+        return datos
+
+    @staticmethod
+    def _percentil(total, cantidad, p):
+        if cantidad == 0:
+            return None
+        objetivo = cantidad * p / 100.0
+        acumulado = 0
+        for i in range(_NUM_BUCKETS):
+            acumulado += total[i]
+            if acumulado >= objetivo:
+                return _limite_superior(i)
+        return math.inf
+
+    def texto_prometheus(self, etiquetas=""):
+        total = self._sumar()
+        lineas = []
+        acumulado = 0
+        for i in range(_NUM_BUCKETS):
+            acumulado += total[i]
+            if total[i] == 0 and i < _NUM_BUCKETS - 1:
+                continue
+            le = "+Inf" if i == _NUM_BUCKETS - 1 else f"{_limite_superior(i):.6g}"
+            separador = "," if etiquetas else ""
+            lineas.append(f'{self.nombre}_bucket{{{etiquetas}{separador}le="{le}"}} {acumulado}')
+        sufijo = f"{{{etiquetas}}}" if etiquetas else ""
+        lineas.append(f"{self.nombre}_sum{sufijo} {total[_NUM_BUCKETS + 1]:.9f}")
+        lineas.append(f"{self.nombre}_count{sufijo} {total[_NUM_BUCKETS]}")
+        return lineas
+
+
+class RegistroMetricas:
+    """Conjunto de histogramas, contadores y gauges con exportación Prometheus y JSON"""
+
+    def __init__(self, prefijo="hailo_detector"):
+        self.prefijo = prefijo
+        self.histogramas = OrderedDict()
+        self.contadores = OrderedDict()
+        self.gauges = OrderedDict()
+
+    def histograma(self, nombre, etiquetas=None, ayuda=""):
+        clave = (nombre, tuple(sorted((etiquetas or {}).items())))
+        if clave not in self.histogramas:
+            self.histogramas[clave] = Histograma(f"{self.prefijo}_{nombre}", ayuda)
+        return self.histogramas[clave]
+
+    def incrementar(self, nombre, valor=1, etiquetas=None):
+        clave = (nombre, tuple(sorted((etiquetas or {}).items())))
+        self.contadores[clave] = self.contadores.get(clave, 0) + valor
+
+    def fijar(self, nombre, valor, etiquetas=None):
+        clave = (nombre, tuple(sorted((etiquetas or {}).items())))
+        self.gauges[clave] = valor
+
+    @staticmethod
+    def _etiquetas(pares):
+        return ",".join(f'{k}="{v}"' for k, v in pares)
+
+    def texto_prometheus(self):
+        lineas = []
+        vistos = set()
+        for (nombre, pares), hist in list(self.histogramas.items()):
+            if nombre not in vistos:
+                vistos.add(nombre)
+                if hist.ayuda:
+                    lineas.append(f"# HELP {hist.nombre} {hist.ayuda}")
+                lineas.append(f"# TYPE {hist.nombre} histogram")
+            lineas.extend(hist.texto_prometheus(self._etiquetas(pares)))
+        for tipo, valores in (("counter", self.contadores), ("gauge", self.gauges)):
+            for (nombre, pares), valor in list(valores.items()):
+                completo = f"{self.prefijo}_{nombre}"
+                if completo not in vistos:
+                    vistos.add(completo)
+                    lineas.append(f"# TYPE {completo} {tipo}")
+                sufijo = f"{{{self._etiquetas(pares)}}}" if pares else ""
+                lineas.append(f"{completo}{sufijo} {valor}")
+        return "\n".join(lineas) + "\n"
+
+    def a_dict(self):
+        def clave(nombre, pares):
+            return nombre + ("{" + self._etiquetas(pares) + "}" if pares else "")
+        return {
+            "ts": time.time(),
+            "histogramas": {clave(n, p): h.resumen() for (n, p), h in list(self.histogramas.items())},
+            "contadores": {clave(n, p): v for (n, p), v in list(self.contadores.items())},
+            "gauges": {clave(n, p): v for (n, p), v in list(self.gauges.items())},
+        }
+
+
+# -----------------------------------------------------------------------------------------------
+# Exportación: endpoint HTTP local y volcado JSON periódico
+# -----------------------------------------------------------------------------------------------
+class ServidorMetricas:
+    """Endpoint /metrics en formato de texto Prometheus (y /metrics.json)"""
+
+    def __init__(self, registro, puerto=9108, host="127.0.0.1"):
+        self.registro = registro
+        registro_local = registro
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    cuerpo = json.dumps(registro_local.a_dict()).encode()
+                    tipo = "application/json"
+                elif self.path.startswith("/metrics"):
+                    cuerpo = registro_local.texto_prometheus().encode()
+                    tipo = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass
+
+        self.servidor = ThreadingHTTPServer((host, puerto), Manejador)
+        self.servidor.daemon_threads = True
+        self._hilo = threading.Thread(target=self.servidor.serve_forever, name="metricas_http",
+                                      daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+        print(f"📈 Métricas en http://{self.servidor.server_address[0]}:"
+              f"{self.servidor.server_address[1]}/metrics")
+
+    def detener(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+class VolcadoJSON:
+    """Escribe el estado de las métricas a un archivo JSON cada intervalo segundos"""
+
+    def __init__(self, registro, path, intervalo=10.0):
+        self.registro = registro
+        self.path = path
+        self.intervalo = intervalo
+        self._fin = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name="metricas_json", daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def detener(self):
+        self._fin.set()
+        self._hilo.join(2.0)
+        self.volcar()
+
+    def _bucle(self):
+        while not self._fin.wait(self.intervalo):
+            self.volcar()
+
+    def volcar(self):
+        temporal = self.path + ".tmp"
+        with open(temporal, "w") as f:
+            json.dump(self.registro.a_dict(), f, indent=1)
+        # Reemplazo atómico para que los lectores nunca vean un archivo a medias
+        os.replace(temporal, self.path)
+
+
+# -----------------------------------------------------------------------------------------------
+# Instrumentación del pipeline con pad probes
+# -----------------------------------------------------------------------------------------------
+class MetricasPipeline:
+    """Mide latencia captura→callback, tiempo por elemento, colas y frames perdidos
+
+    Pone un probe en el pad sink y otro en el pad src de cada elemento: el
+    tiempo entre ambos (emparejado por PTS) es el tiempo del buffer dentro
+    del elemento, incluida la espera si el elemento es una cola. Las fuentes
+    marcan el instante de captura y el elemento del callback cierra la
+    latencia total. Funciona igual con videotestsrc que con v4l2src/hailonet.
+    """
+
+    def __init__(self, pipeline, callback="identity_callback", registro=None, max_en_vuelo=512):
+        if Gst is None:
+            raise RuntimeError("GStreamer (gi) no está disponible")
+        self.pipeline = pipeline
+        self.callback = callback
+        self.registro = registro or RegistroMetricas()
+        self.max_en_vuelo = max_en_vuelo
+        self._capturas = OrderedDict()
+        self._entradas = {}
+        self._lock = threading.Lock()
+        self._colas = []
+        self._muestreo = None
+        self._latencia = self.registro.histograma(
+            "latencia_captura_callback_segundos", ayuda="Tiempo desde la fuente hasta el callback")
+
+    def instrumentar(self, elementos=None):
+        """Agregar probes a los elementos (por defecto, a todos los del pipeline)"""
+        for elemento in self._elementos():
+            nombre = elemento.get_name()
+            if elementos is not None and nombre not in elementos:
+                continue
+            fabrica = elemento.get_factory().get_name() if elemento.get_factory() else ""
+            sinks = [p for p in elemento.pads if p.get_direction() == Gst.PadDirection.SINK]
+            srcs = [p for p in elemento.pads if p.get_direction() == Gst.PadDirection.SRC]
+
+            if fabrica == "queue":
+                self._colas.append(elemento)
+
+            if not sinks:
+                for pad in srcs:
+                    pad.add_probe(Gst.PadProbeType.BUFFER, self._probe_fuente, nombre)
+                continue
+
+            if nombre == self.callback:
+                for pad in srcs:
+                    pad.add_probe(Gst.PadProbeType.BUFFER, self._probe_callback, nombre)
+
+            hist = self.registro.histograma("tiempo_elemento_segundos", {"elemento": nombre},
+                                            ayuda="Tiempo del buffer dentro de cada elemento")
+            entradas = {}
+            self._entradas[nombre] = entradas
+            for pad in sinks:
+                pad.add_probe(Gst.PadProbeType.BUFFER, self._probe_entrada, entradas)
+            for pad in srcs:
+                pad.add_probe(Gst.PadProbeType.BUFFER, self._probe_salida, (entradas, hist, nombre))
+
+    def _elementos(self):
+        resultado = []
+        iterador = self.pipeline.iterate_recurse()
+        while True:
+            ok, elemento = iterador.next()
+            if ok != Gst.IteratorResult.OK:
+                break
+            if not isinstance(elemento, Gst.Bin):
+                resultado.append(elemento)
+        return resultado
+
+    def _probe_fuente(self, pad, info, nombre):
+        buffer = info.get_buffer()
+        if buffer is not None and buffer.pts != Gst.CLOCK_TIME_NONE:
+            with self._lock:
+                self._capturas[buffer.pts] = time.perf_counter()
+                if len(self._capturas) > self.max_en_vuelo:
+                    self._capturas.popitem(last=False)
+            self.registro.incrementar("buffers_fuente_total", etiquetas={"fuente": nombre})
+        return Gst.PadProbeReturn.OK
+
+    def _probe_callback(self, pad, info, nombre):
+        buffer = info.get_buffer()
+        if buffer is not None:
+            with self._lock:
+                inicio = self._capturas.pop(buffer.pts, None)
+            if inicio is not None:
+                self._latencia.registrar(time.perf_counter() - inicio)
+            self.registro.incrementar("buffers_callback_total")
+        return Gst.PadProbeReturn.OK
+
+    def _probe_entrada(self, pad, info, entradas):
+        buffer = info.get_buffer()
+        if buffer is not None:
+            entradas[buffer.pts] = time.perf_counter()
+            if len(entradas) > self.max_en_vuelo:
+                entradas.pop(next(iter(entradas)))
+        return Gst.PadProbeReturn.OK
+
+    def _probe_salida(self, pad, info, datos):
+        entradas, hist, nombre = datos
+        buffer = info.get_buffer()
+        if buffer is not None:
+            inicio = entradas.pop(buffer.pts, None)
+            if inicio is not None:
+                hist.registrar(time.perf_counter() - inicio)
+        return Gst.PadProbeReturn.OK
+
+    # -------------------------------------------------------------------------
+    # Colas y frames perdidos
+    # -------------------------------------------------------------------------
+    def iniciar_muestreo(self, intervalo_ms=200):
+        """Muestrear periódicamente la ocupación de las colas desde el main loop"""
+        def muestrear():
+            for cola in self._colas:
+                nivel = cola.get_property("current-level-buffers")
+                maximo = cola.get_property("max-size-buffers")
+                etiquetas = {"cola": cola.get_name()}
+                self.registro.fijar("ocupacion_cola_buffers", nivel, etiquetas)
+                if maximo:
+                    self.registro.fijar("ocupacion_cola_ratio", round(nivel / maximo, 3), etiquetas)
+            self._actualizar_perdidos()
+            return True
+        self._muestreo = GLib.timeout_add(intervalo_ms, muestrear)
+
+    def _actualizar_perdidos(self):
+        fuente = sum(v for (n, _), v in self.registro.contadores.items() if n == "buffers_fuente_total")
+        callback = self.registro.contadores.get(("buffers_callback_total", ()), 0)
+        with self._lock:
+            en_vuelo = len(self._capturas)
+        self.registro.fijar("frames_perdidos", max(0, fuente - callback - en_vuelo))
+
+    def procesar_mensaje(self, message):
+        """Contar frames descartados reportados por QoS (conectar desde on_message del bus)"""
+        if message.type == Gst.MessageType.QOS:
+            _, _, descartados = message.parse_qos_stats()
+            origen = message.src.get_name() if message.src else "desconocido"
+            self.registro.fijar("qos_descartados", descartados, {"elemento": origen})
+
+    def detener(self):
+        if self._muestreo is not None:
+            GLib.source_remove(self._muestreo)
+            self._muestreo = None
+
+    def reporte(self):
+        self._actualizar_perdidos()
+        return self.registro.a_dict()
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos para exponer las métricas"""
+    parser.add_argument('--metrics-port', type=int,
+                        help='Puerto local para /metrics (formato Prometheus)')
+    parser.add_argument('--metrics-json',
+                        help='Archivo donde volcar las métricas en JSON periódicamente')
+    parser.add_argument('--metrics-intervalo', type=float, default=10.0,
+                        help='Segundos entre volcados JSON')
+
+
+def iniciar_desde_args(args, pipeline, callback="identity_callback"):
+    """Instrumentar el pipeline si se pidieron métricas; devuelve (metricas, exportadores)"""
+    if not args.metrics_port and not args.metrics_json:
+        return None, []
+    metricas = MetricasPipeline(pipeline, callback)
+    metricas.instrumentar()
+    metricas.iniciar_muestreo()
+    return metricas, crear_exportadores(args, metricas.registro)
+
+
+def crear_exportadores(args, registro):
+    exportadores = []
+    if args.metrics_port:
+        exportadores.append(ServidorMetricas(registro, args.metrics_port))
+    if args.metrics_json:
+        exportadores.append(VolcadoJSON(registro, args.metrics_json, args.metrics_intervalo))
+    for exportador in exportadores:
+        exportador.iniciar()
+    return exportadores
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Métricas por elemento sobre un pipeline videotestsrc')
+    parser.add_argument('--segundos', type=float, default=5.0)
+    parser.add_argument('--pipeline', default=(
+        "videotestsrc is-live=true pattern=ball ! "
+        "video/x-raw,format=YUY2,width=640,height=480,framerate=30/1 ! "
+        "videoconvert ! videoscale ! video/x-raw,format=RGB,width=640,height=640 ! "
+        "queue name=q_inferencia max-size-buffers=4 leaky=downstream ! "
+        "identity name=inferencia sleep-time=5000 ! "
+        "identity name=identity_callback ! fakesink sync=false"))
+    agregar_argumentos(parser)
+    args = parser.parse_args()
+
+    Gst.init(None)
+    pipeline = Gst.parse_launch(args.pipeline)
+    metricas = MetricasPipeline(pipeline)
+    metricas.instrumentar()
+    metricas.iniciar_muestreo()
+    exportadores = crear_exportadores(args, metricas.registro)
+
+    loop = GLib.MainLoop()
+    GLib.timeout_add(int(args.segundos * 1000), loop.quit)
+    pipeline.set_state(Gst.State.PLAYING)
+    loop.run()
+    pipeline.set_state(Gst.State.NULL)
+    metricas.detener()
+    for exportador in exportadores:
+        exportador.detener()
+    print(json.dumps(metricas.reporte(), indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+except (ImportError, ValueError):
+    Gst = None
+
+from detecciones import Detecciones, extraer_detecciones
+from pipelines import cola, crear_elemento, enlazar
+
+METRICAS = ("mixta", "iou", "ios")
+
+
+# -----------------------------------------------------------------------------------------------
+# Mosaicos: cada fila es (x, y, ancho, alto) en píxeles de la fuente
+# -----------------------------------------------------------------------------------------------
+def _posiciones(total, tam, solape):
+    """Inicios de ventanas de tamaño tam que cubren [0, total) con al menos solape de superposición"""
+    if tam >= total:
+        return [0]
+    paso = tam * (1.0 - solape)
+    n = int(np.ceil((total - tam) / paso)) + 1
+    return [int(round(i * (total - tam) / (n - 1))) for i in range(n)]
+
+
+def grilla(ancho, alto, tam=640, solape=0.2, completo=True):
+    """Grilla de mosaicos de tam x tam (o tam=(ancho, alto)) que cubre la fuente
+
+    Los mosaicos se reparten de forma pareja, así que la superposición real es
+    solape o algo más. Con tam igual a la entrada del modelo, cada mosaico
+    llega al modelo sin escalar. completo=True agrega el frame entero como
+    último mosaico, para los objetos grandes que ningún mosaico contiene.
+    """
+    tw, th = (tam, tam) if np.isscalar(tam) else tam
+    tw, th = min(tw, ancho), min(th, alto)
+    mosaicos = [(x, y, tw, th) for y in _posiciones(alto, th, solape)
+                for x in _posiciones(ancho, tw, solape)]
+    if completo and len(mosaicos) > 1:
+        mosaicos.append((0, 0, ancho, alto))
+    return np.asarray(mosaicos, dtype=np.int32)
+
+
+def recortes_desde_texto(texto, ancho, alto):
+    """Recortes fijos 'x,y,w,h;x,y,w,h' en píxeles de la fuente"""
+    mosaicos = []
+    for parte in texto.split(";"):
+        if not parte.strip():
+            continue
+        x, y, w, h = (int(v) for v in parte.split(","))
+        if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > ancho or y + h > alto:
+            raise ValueError(f"Recorte fuera de la fuente {ancho}x{alto}: {parte}")
+        mosaicos.append((x, y, w, h))
+    if not mosaicos:
+        raise ValueError("No se indicó ningún recorte")
+    return np.asarray(mosaicos, dtype=np.int32)
+
+
+def mapear_a_fuente(xyxy, indices, mosaicos, ancho, alto):
+    """Cajas normalizadas al mosaico -> cajas normalizadas a la fuente completa
+
+    hailo entrega las cajas en [0, 1] respecto de la entrada del modelo, que es
+    el mosaico escalado; el mapeo es lineal por eje: x = (mx + xn * mw) / ancho.
+    """
+    m = mosaicos[indices].astype(np.float32)
+    tamano = np.array([ancho, alto], dtype=np.float32)
+    escala = np.tile(m[:, 2:] / tamano, 2)
+    origen = np.tile(m[:, :2] / tamano, 2)
+    return np.asarray(xyxy, dtype=np.float32) * escala + origen
+
+
+def mapear_a_mosaico(xyxy, indice, mosaicos, ancho, alto):
+    """Inverso de mapear_a_fuente para un mosaico (sin recortar a [0, 1])"""
+    x, y, w, h = mosaicos[indice].astype(np.float32)
+    escala = np.array([ancho / w, alto / h] * 2, dtype=np.float32)
+    origen = np.array([x / ancho, y / alto] * 2, dtype=np.float32)
+    return (np.asarray(xyxy, dtype=np.float32) - origen) * escala
+
+
+def cortadas_por_borde(xyxy, indices, mosaicos, ancho, alto, margen=0.01):
+    """True para las cajas que tocan un borde del mosaico que no es borde de la fuente
+
+    Son objetos partidos: otro mosaico (o el frame completo) los ve enteros.
+    """
+    m = mosaicos[indices]
+    interno = np.stack([m[:, 0] > 0, m[:, 1] > 0,
+                        m[:, 0] + m[:, 2] < ancho, m[:, 1] + m[:, 3] < alto], axis=1)
+    xyxy = np.asarray(xyxy, dtype=np.float32)
+    toca = np.concatenate([xyxy[:, :2] <= margen, xyxy[:, 2:] >= 1.0 - margen], axis=1)
+    return np.any(toca & interno, axis=1)
+
+
+def _interseccion(xyxy):
+    a = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], a[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], a[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], a[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], a[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    return inter, (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+
+
+def _cociente(inter, base):
+    return np.where(base > 0, inter / np.maximum(base, 1e-12), 0.0)
+
+
+def superposicion(xyxy, metrica="iou"):
+    """Matriz NxN de IoU, o de intersección sobre la caja más chica (ios)
+
+    ios detecta como duplicado el pedazo de un objeto partido por un mosaico,
+    que tiene IoU bajo con la caja entera pero queda contenido en ella. Ambas
+    métricas son invariantes al escalar cada eje, así que da igual usar
+    coordenadas normalizadas o píxeles.
+    """
+    if metrica not in ("iou", "ios"):
+        raise ValueError(f"Métrica no válida: {metrica}")
+    inter, area = _interseccion(xyxy)
+    if metrica == "iou":
+        return _cociente(inter, area[:, None] + area[None, :] - inter)
+    return _cociente(inter, np.minimum(area[:, None], area[None, :]))
+
+
+def nms(xyxy, confianza, class_id=None, grupo=None, umbral=0.5, metrica="mixta", cortadas=None,
+        prioridad=None):
+    """NMS voraz por clase; devuelve los índices que quedan, de mayor a menor prioridad
+
+    La matriz de superposición se calcula una sola vez; el bucle solo recorre
+    las cajas que sobreviven. Con grupo (índice de mosaico), dos cajas del
+    mismo mosaico no se suprimen entre sí: hailofilter ya les hizo NMS.
+    "mixta" usa IoU entre cajas enteras e ios para suprimir las cortadas por
+    un borde, así un auto chico junto a uno grande no se toma por un pedazo.
+    prioridad ordena en lugar de la confianza.
+    """
+    if metrica not in METRICAS:
+        raise ValueError(f"Métrica no válida: {metrica}")
+    n = len(confianza)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    orden = np.argsort(-(confianza if prioridad is None else prioridad), kind="stable")
+    if metrica == "mixta":
+        inter, area = _interseccion(np.asarray(xyxy)[orden])
+        duplicado = _cociente(inter, area[:, None] + area[None, :] - inter) > umbral
+        if cortadas is not None:
+            ios = _cociente(inter, np.minimum(area[:, None], area[None, :])) > umbral
+            duplicado |= ios & np.asarray(cortadas)[orden][None, :]
+    else:
+        duplicado = superposicion(np.asarray(xyxy)[orden], metrica) > umbral
+    if class_id is not None:
+        clases = np.asarray(class_id)[orden]
+        duplicado &= clases[:, None] == clases[None, :]
+    if grupo is not None:
+        grupos = np.asarray(grupo)[orden]
+        duplicado &= grupos[:, None] != grupos[None, :]
+
+    suprimida = np.zeros(n, dtype=bool)
+    quedan = []
+    for i in range(n):
+        if suprimida[i]:
+            continue
+        quedan.append(i)
+        suprimida[i + 1:] |= duplicado[i, i + 1:]
+    return orden[quedan]
+
+
+def fusionar(partes, mosaicos, ancho, alto, umbral=0.5, metrica="mixta", nombres=None):
+    """Detecciones de cada mosaico ({indice: Detecciones}) -> Detecciones de la fuente completa
+
+    Las cajas salen normalizadas a la fuente. Las cortadas por un borde interno
+    pierden contra cualquier caja entera del mismo objeto, aunque tengan más
+    confianza.
+    """
+    partes = {i: d for i, d in partes.items() if len(d)}
+    if not partes:
+        return Detecciones.vacias(nombres)
+    if nombres is None:
+        nombres = next(iter(partes.values())).nombres
+    indices = np.concatenate([np.full(len(d), i, dtype=np.int32) for i, d in partes.items()])
+    xyxy_mosaico = np.concatenate([d.xyxy for d in partes.values()])
+    confianza = np.concatenate([d.confianza for d in partes.values()])
+    class_id = np.concatenate([d.class_id for d in partes.values()])
+
+    xyxy = mapear_a_fuente(xyxy_mosaico, indices, mosaicos, ancho, alto)
+    cortadas = cortadas_por_borde(xyxy_mosaico, indices, mosaicos, ancho, alto)
+    quedan = nms(xyxy, confianza, class_id, indices, umbral, metrica, cortadas,
+                 prioridad=confianza - cortadas.astype(np.float32))
+    return Detecciones(class_id[quedan], confianza[quedan], np.clip(xyxy[quedan], 0.0, 1.0),
+                       nombres=nombres)
+
+
+class AgregadorMosaicos:
+    """Junta las detecciones de los mosaicos de cada frame (mismo PTS) y entrega la fusión
+
+    callback(pts, detecciones, datos) recibe las detecciones normalizadas a la
+    fuente completa. Si un frame no completa sus mosaicos antes de que haya
+    max_pendientes frames abiertos, se entrega con los que llegaron.
+    """
+
+    def __init__(self, mosaicos, ancho, alto, callback, datos=None, umbral=0.5, metrica="mixta",
+                 max_pendientes=4):
+        self.mosaicos = mosaicos
+        self.ancho = ancho
+        self.alto = alto
+        self.callback = callback
+        self.datos = datos
+        self.umbral = umbral
+        self.metrica = metrica
+        self.max_pendientes = max_pendientes
+        self._pendientes = OrderedDict()
+        self.frames = 0
+        self.incompletos = 0
+        self.tiempo_fusion = 0.0
+
+    def agregar(self, indice, pts, detecciones):
+        partes = self._pendientes.setdefault(pts, {})
+        partes[indice] = detecciones
+        if len(partes) == len(self.mosaicos):
+            del self._pendientes[pts]
+            self._entregar(pts, partes)
+        while len(self._pendientes) > self.max_pendientes:
+            viejo, partes = self._pendientes.popitem(last=False)
+            self.incompletos += 1
+            self._entregar(viejo, partes)
+
+    def _entregar(self, pts, partes):
+        inicio = time.perf_counter()
+        fusion = fusionar(partes, self.mosaicos, self.ancho, self.alto, self.umbral, self.metrica)
+        self.tiempo_fusion += time.perf_counter() - inicio
+        self.frames += 1
+        self.callback(pts, fusion, self.datos)
+
+    def recibir(self, pad, info, datos):
+        """Callback por mosaico para RuteadorFuentes (datos.indice es el mosaico)"""
+        buffer = info.get_buffer()
+        if buffer is None:
+            return Gst.PadProbeReturn.OK
+        # Import diferido: hailo solo existe en la Raspberry
+        import hailo
+        detecciones = extraer_detecciones(hailo.get_roi_from_buffer(buffer))
+        self.agregar(datos.indice, buffer.pts, detecciones)
+        return Gst.PadProbeReturn.OK
+
+    def estadisticas(self):
+        return {"mosaicos": len(self.mosaicos), "frames": self.frames,
+                "incompletos": self.incompletos,
+                "us_por_fusion": round(self.tiempo_fusion * 1e6 / self.frames, 1) if self.frames else 0.0}
+
+
+class _Mosaico:
+    def __init__(self, indice):
+        self.indice = indice
+
+
+def construir_mosaico(fuente, mosaicos, ancho, alto, modelo, postproceso=None, funcion="yolov5",
+                      fps_max=15, entrada=640):
+    """Pipeline fuente (resolución completa) -> tee -> un videocrop por mosaico -> un hailonet
+
+    La cola con descarte va antes del tee, así que se descartan frames enteros
+    y los mosaicos de un mismo frame siguen juntos. Cada rama escala su recorte
+    a la entrada del modelo y entra a un funnel antes del hailonet compartido.
+    """
+    import multifuente
+
+    pipeline = Gst.Pipeline.new("mosaico")
+
+    def cadena(textos, anterior=None):
+        for texto in textos:
+            elemento = crear_elemento(texto)
+            pipeline.add(elemento)
+            if anterior is not None:
+                enlazar(anterior, elemento)
+            anterior = elemento
+        return anterior
+
+    reparto = cadena(multifuente.elementos_fuente(fuente, 0, fps_max, ancho, alto, 1)
+                     + ["tee name=reparto"])
+    union = crear_elemento("funnel name=union_mosaicos")
+    pipeline.add(union)
+    for i, (x, y, w, h) in enumerate(mosaicos):
+        ultimo = cadena([
+            cola(f"q_reparto_{i}", 2, leaky="no"),
+            f"videocrop left={x} top={y} right={ancho - x - w} bottom={alto - y - h}",
+            "videoscale",
+            f"video/x-raw,format=RGB,width={entrada},height={entrada}",
+            cola(f"q_mosaico_{i}", 2, leaky="no"),
+        ], reparto)
+        enlazar(ultimo, union)
+
+    modelo_elementos = [f"hailonet hef-path={modelo} force-writable=true"]
+    if postproceso:
+        modelo_elementos.append(f"hailofilter function-name={funcion} so-path={postproceso}")
+    cadena(modelo_elementos + ["identity name=identity_callback", "fakesink sync=false"], union)
+    return pipeline
+
+
+def instalar(pipeline, mosaicos, agregador):
+    """Marcar cada rama con su mosaico y entregar cada buffer al agregador"""
+    import multifuente
+
+    nombres = [f"mosaico_{i}" for i in range(len(mosaicos))]
+    ruteador = multifuente.RuteadorFuentes(nombres, [agregador.recibir] * len(nombres),
+                                           [_Mosaico(i) for i in range(len(nombres))])
+    ruteador.instalar(pipeline, prefijo="q_mosaico_")
+    return ruteador
+
+
+def resolucion(texto):
+    ancho, alto = (int(v) for v in texto.lower().split("x"))
+    return ancho, alto
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--mosaico', action='store_true',
+                        help='Inferir por mosaicos sobre la fuente a resolución completa')
+    parser.add_argument('--recortes',
+                        help='Recortes fijos "x,y,w,h;x,y,w,h" en lugar de la grilla automática')
+    parser.add_argument('--resolucion-fuente', type=resolucion, default=(1920, 1080),
+                        help='Resolución completa de la fuente en modo mosaico (ANCHOxALTO)')
+    parser.add_argument('--mosaico-tam', type=int, default=640,
+                        help='Lado de cada mosaico en píxeles de la fuente')
+    parser.add_argument('--solape', type=float, default=0.2,
+                        help='Superposición mínima entre mosaicos vecinos')
+    parser.add_argument('--sin-frame-completo', action='store_true',
+                        help='No inferir también el frame completo escalado')
+
+
+def mosaicos_desde_args(args):
+    """Mosaicos pedidos por línea de comandos, o None sin --mosaico ni --recortes"""
+    if not args.mosaico and not args.recortes:
+        return None
+    ancho, alto = args.resolucion_fuente
+    if args.recortes:
+        return recortes_desde_texto(args.recortes, ancho, alto)
+    return grilla(ancho, alto, args.mosaico_tam, args.solape, not args.sin_frame_completo)
+
+
+# -----------------------------------------------------------------------------------------------
+# Prueba sin NPU: detector simulado por mosaico sobre cajas conocidas
+# -----------------------------------------------------------------------------------------------
+def cajas_sinteticas(rng, n, ancho, alto, lado_min=12, lado_max=120):
+    """Vehículos lejanos (chicos) y algunos cercanos, normalizados a la fuente"""
+    lados = rng.uniform(lado_min, lado_max, (n, 2))
+    lados[: n // 10] *= 5
+    x1 = rng.uniform(0, ancho - lados[:, 0])
+    y1 = rng.uniform(0, alto - lados[:, 1])
+    cajas = np.stack([x1, y1, x1 + lados[:, 0], y1 + lados[:, 1]], axis=1)
+    return (cajas / np.array([ancho, alto] * 2)).astype(np.float32)
+
+
+def detector_simulado(rng, cajas, indice, mosaicos, ancho, alto, entrada=640, lado_min=16,
+                      visible_min=0.3, ruido=0.0):
+    """Lo que vería el modelo en un mosaico: cajas visibles, recortadas y normalizadas al mosaico
+
+    Un objeto se detecta si queda visible al menos visible_min de su área y
+    mide al menos lado_min píxeles en la entrada del modelo.
+    """
+    en_mosaico = mapear_a_mosaico(cajas, indice, mosaicos, ancho, alto)
+    recortadas = np.clip(en_mosaico, 0.0, 1.0)
+    area = lambda c: np.clip(c[:, 2] - c[:, 0], 0, None) * np.clip(c[:, 3] - c[:, 1], 0, None)
+    visible = area(recortadas) / np.maximum(area(en_mosaico), 1e-12)
+    lado = np.minimum(recortadas[:, 2] - recortadas[:, 0], recortadas[:, 3] - recortadas[:, 1]) * entrada
+    detectadas = (visible >= visible_min) & (lado >= lado_min)
+    xyxy = recortadas[detectadas]
+    if ruido:
+        xyxy = np.clip(xyxy + rng.normal(0, ruido, xyxy.shape).astype(np.float32), 0.0, 1.0)
+    n = len(xyxy)
+    return Detecciones(np.full(n, 3, dtype=np.int32),
+                       rng.uniform(0.4, 0.95, n).astype(np.float32), xyxy, nombres={3: "car"})
+
+
+def evaluar(cajas, detecciones, umbral_iou=0.5):
+    """Recall y duplicados de las detecciones fusionadas contra las cajas reales"""
+    from tracker import iou_matriz, asignacion_voraz
+
+    pares = asignacion_voraz(iou_matriz(cajas, detecciones.xyxy), umbral_iou)
+    return {"reales": len(cajas), "detectadas": len(detecciones), "aciertos": len(pares),
+            "sobrantes": len(detecciones) - len(pares)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mapeo y fusión de mosaicos con detecciones sintéticas')
+    parser.add_argument('--resolucion-fuente', type=resolucion, default=(1920, 1080))
+    parser.add_argument('--mosaico-tam', type=int, default=640)
+    parser.add_argument('--solape', type=float, default=0.2)
+    parser.add_argument('--objetos', type=int, default=40, help='Vehículos por frame')
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--ruido', type=float, default=0.002,
+                        help='Desvío del ruido de las cajas, normalizado al mosaico')
+    parser.add_argument('--metrica', default='mixta', choices=METRICAS)
+    args = parser.parse_args()
+
+    ancho, alto = args.resolucion_fuente
+    mosaicos = grilla(ancho, alto, args.mosaico_tam, args.solape)
+    completo = np.asarray([(0, 0, ancho, alto)], dtype=np.int32)
+    print(f"🧩 {len(mosaicos)} mosaicos sobre {ancho}x{alto}: {mosaicos.tolist()}")
+    rng = np.random.default_rng(0)
+
+    # 1) El mapeo de ida y vuelta es exacto para cajas dentro de cada mosaico
+    error_mapeo = 0.0
+    for i in range(len(mosaicos)):
+        x, y, w, h = mosaicos[i]
+        dentro = rng.uniform(0.05, 0.45, (50, 2))
+        locales = np.concatenate([dentro, dentro + rng.uniform(0.05, 0.5, (50, 2))], axis=1)
+        ida = mapear_a_fuente(locales, np.full(50, i), mosaicos, ancho, alto)
+        pixeles = ida * np.array([ancho, alto] * 2)
+        esperado = locales * np.array([w, h] * 2) + np.array([x, y] * 2)
+        error_mapeo = max(error_mapeo, float(np.abs(pixeles - esperado).max()),
+                          float(np.abs(mapear_a_mosaico(ida, i, mosaicos, ancho, alto) - locales).max()))
+    print(f"📐 Error máximo de mapeo: {error_mapeo:.2e} px")
+
+    # 2) Frames sintéticos: mosaicos + fusión contra solo el frame completo escalado
+    totales = {"mosaicos": [0, 0, 0], "completo": [0, 0, 0]}
+    tiempo = 0.0
+    for _ in range(args.frames):
+        cajas = cajas_sinteticas(rng, args.objetos, ancho, alto)
+        partes = {i: detector_simulado(rng, cajas, i, mosaicos, ancho, alto, ruido=args.ruido)
+                  for i in range(len(mosaicos))}
+        inicio = time.perf_counter()
+        fusion = fusionar(partes, mosaicos, ancho, alto, metrica=args.metrica)
+        tiempo += time.perf_counter() - inicio
+        solo = detector_simulado(rng, cajas, 0, completo, ancho, alto, ruido=args.ruido)
+        for nombre, dets in (("mosaicos", fusion), ("completo", solo)):
+            r = evaluar(cajas, dets)
+            totales[nombre][0] += r["reales"]
+            totales[nombre][1] += r["aciertos"]
+            totales[nombre][2] += r["sobrantes"]
+
+    resultado = {nombre: {"recall": round(a / r, 3), "sobrantes_por_frame": round(s / args.frames, 2)}
+                 for nombre, (r, a, s) in totales.items()}
+    resultado["us_por_fusion"] = round(tiempo * 1e6 / args.frames, 1)
+    print(json.dumps(resultado, indent=1, ensure_ascii=False))
+
+    ok = (error_mapeo < 1e-2 and resultado["mosaicos"]["recall"] > resultado["completo"]["recall"]
+          and resultado["mosaicos"]["sobrantes_por_frame"] < 0.05 * args.objetos)
+    print("✅ Mapeo y fusión correctos" if ok else "❌ Mapeo o fusión fuera de lo esperado")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst, GLib
+except (ImportError, ValueError):
+    Gst = None
+    GLib = None
+
+from pipelines import cola, crear_elemento, enlazar
+
+# Marca en los 16 bits altos de buffer.offset: el resto es el índice de la fuente.
+# hailonet copia los metadatos del buffer (pts, offset...), así que la marca llega al callback.
+_MARCA = 0x5A5A << 48
+_MASCARA_MARCA = 0xFFFF << 48
+
+# Separación de PTS entre fuentes de prueba (timestamp-offset) para verificar el ruteo
+_SEPARACION_PTS = 10 ** 12
+
+
+def elementos_fuente(fuente, indice, fps_max=15, ancho=640, alto=640, cola_buffers=1,
+                     separar_pts=False):
+    """Rama de una fuente hasta la cola que la conecta al planificador
+
+    fuente puede ser "test" o "test:FPS" (videotestsrc a ese framerate),
+    "camera", /dev/videoN o un archivo de video. videorate limita cada fuente
+    a fps_max y la cola de 1 buffer con descarte hace que una cámara rápida no
+    acumule frames ni le quite turnos a las demás.
+    """
+    if fuente == "test" or fuente.startswith("test:"):
+        elementos = [f"videotestsrc is-live=true pattern={indice % 20}"]
+        if separar_pts:
+            elementos[0] += f" timestamp-offset={indice * _SEPARACION_PTS}"
+        if ":" in fuente:
+            elementos.append(f"video/x-raw,width=640,height=480,framerate={fuente.split(':')[1]}/1")
+    elif fuente == "camera":
+        elementos = ["libcamerasrc"]
+    elif fuente.startswith("/dev/video"):
+        elementos = [f"v4l2src device={fuente}"]
+    elif os.path.isfile(fuente):
+        elementos = [f"filesrc location={fuente}", "decodebin"]
+    else:
+        raise ValueError(f"Fuente no válida: {fuente}")
+    return elementos + [
+        f"videorate drop-only=true max-rate={fps_max}",
+        "videoconvert",
+        "videoscale",
+        f"video/x-raw,format=RGB,width={ancho},height={alto}",
+        cola(f"q_fuente_{indice}", cola_buffers),
+    ]
+
+
+def construir_multifuente(fuentes, modelo=None, postproceso=None, funcion="yolov5", fps_max=15,
+                          ancho=640, alto=640, cola_buffers=1, inferencia_simulada_us=None,
+                          separar_pts=False):
+    """Un pipeline con N fuentes que comparten una sola rama de inferencia
+
+    Las ramas entran a hailoroundrobin (turnos entre fuentes) si está
+    instalado; si no, o con el NPU simulado, a un funnel. Con
+    inferencia_simulada_us, un identity con sleep-time reemplaza a hailonet.
+    """
+    pipeline = Gst.Pipeline.new("multifuente")
+
+    if inferencia_simulada_us is None and Gst.ElementFactory.find("hailoroundrobin") is not None:
+        planificador = crear_elemento("hailoroundrobin name=planificador")
+    else:
+        planificador = crear_elemento("funnel name=planificador")
+    pipeline.add(planificador)
+
+    for indice, fuente in enumerate(fuentes):
+        anterior = None
+        for texto in elementos_fuente(fuente, indice, fps_max, ancho, alto, cola_buffers, separar_pts):
+            elemento = crear_elemento(texto)
+            pipeline.add(elemento)
+            if anterior is not None:
+                enlazar(anterior, elemento)
+            anterior = elemento
+        enlazar(anterior, planificador)
+
+    if inferencia_simulada_us is not None:
+        compartida = [f"identity name=inferencia sleep-time={inferencia_simulada_us}"]
+    else:
+        compartida = [f"hailonet hef-path={modelo} force-writable=true"]
+        if postproceso:
+            compartida.append(f"hailofilter function-name={funcion} so-path={postproceso}")
+    compartida += ["identity name=identity_callback", "fakesink sync=false"]
+
+    anterior = planificador
+    for texto in compartida:
+        elemento = crear_elemento(texto)
+        pipeline.add(elemento)
+        enlazar(anterior, elemento)
+        anterior = elemento
+    return pipeline
+
+
+class RuteadorFuentes:
+    """Marca cada buffer con su fuente antes del planificador y lo entrega al callback de esa fuente
+
+    callbacks[i] recibe (pad, info, datos[i]) igual que un callback de una sola
+    fuente; datos[i].fuente queda con el nombre de la fuente.
+    """
+
+    def __init__(self, fuentes, callbacks, datos, verificar=None):
+        self.fuentes = list(fuentes)
+        self.callbacks = list(callbacks)
+        self.datos = list(datos)
+        self.verificar = verificar
+        for fuente, dato in zip(self.fuentes, self.datos):
+            dato.fuente = fuente
+        self.marcados = [0] * len(self.fuentes)
+        self.entregados = [0] * len(self.fuentes)
+        self.sin_fuente = 0
+        self.mal_ruteados = 0
+        self.inicio = None
+
+    def instalar(self, pipeline, callback="identity_callback", prefijo="q_fuente_"):
+        for indice in range(len(self.fuentes)):
+            pad = pipeline.get_by_name(f"{prefijo}{indice}").get_static_pad("src")
+            pad.add_probe(Gst.PadProbeType.BUFFER, self._marcar, indice)
+        pad = pipeline.get_by_name(callback).get_static_pad("src")
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._rutear)
+
+    def _marcar(self, pad, info, indice):
+        buffer = info.get_buffer()
+        if buffer is not None:
+            try:
+                buffer.offset = _MARCA | indice
+                self.marcados[indice] += 1
+            except (AttributeError, TypeError):
+                pass
+        return Gst.PadProbeReturn.OK
+
+    def fuente_de(self, buffer):
+        offset = buffer.offset
+        if offset & _MASCARA_MARCA != _MARCA:
+            return None
+        indice = offset & 0xFFFF
+        return indice if indice < len(self.fuentes) else None
+
+    def _rutear(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer is None:
+            return Gst.PadProbeReturn.OK
+        if self.inicio is None:
+            self.inicio = time.monotonic()
+        indice = self.fuente_de(buffer)
+        if indice is None:
+            self.sin_fuente += 1
+            return Gst.PadProbeReturn.OK
+        if self.verificar is not None and not self.verificar(buffer, indice):
+            self.mal_ruteados += 1
+        self.entregados[indice] += 1
+        return self.callbacks[indice](pad, info, self.datos[indice])
+
+    def estadisticas(self):
+        duracion = time.monotonic() - self.inicio if self.inicio else 0.0
+        fps = [n / duracion if duracion else 0.0 for n in self.entregados]
+        # Índice de equidad de Jain: 1.0 = todas las fuentes reciben el mismo caudal
+        cuadrados = sum(f * f for f in fps)
+        equidad = sum(fps) ** 2 / (len(fps) * cuadrados) if cuadrados else None
+        return {
+            "fuentes": {f: {"marcados": m, "entregados": e, "fps": round(r, 2)}
+                        for f, m, e, r in zip(self.fuentes, self.marcados, self.entregados, fps)},
+            "fps_total": round(sum(fps), 2),
+            "equidad": round(equidad, 3) if equidad is not None else None,
+            "sin_fuente": self.sin_fuente,
+            "mal_ruteados": self.mal_ruteados,
+        }
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--sources', nargs='+',
+                        help='Varias fuentes (test[:fps], camera, /dev/videoN o archivo) '
+                             'que comparten un solo hailonet')
+    parser.add_argument('--fps-max', type=int, default=15,
+                        help='Frames por segundo máximos por fuente en modo multi-fuente')
+
+
+# -----------------------------------------------------------------------------------------------
+# Prueba con videotestsrc: ruteo por fuente y throughput total con NPU simulado
+# -----------------------------------------------------------------------------------------------
+class _Contador:
+    def __init__(self):
+        self.frames = 0
+
+
+def _contar(pad, info, datos):
+    datos.frames += 1
+    return Gst.PadProbeReturn.OK
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Varias fuentes videotestsrc sobre una inferencia compartida')
+    parser.add_argument('--fuentes', nargs='+', default=['test:30', 'test:60', 'test:15'],
+                        help='Fuentes test:FPS a combinar')
+    parser.add_argument('--fps-max', type=int, default=15)
+    parser.add_argument('--inferencia-us', type=int, default=20000,
+                        help='Tiempo simulado de hailonet por frame')
+    parser.add_argument('--segundos', type=float, default=5.0)
+    args = parser.parse_args()
+
+    if Gst is None:
+        raise SystemExit("❌ GStreamer (gi) no está disponible")
+    Gst.init(None)
+
+    pipeline = construir_multifuente(args.fuentes, fps_max=args.fps_max,
+                                     inferencia_simulada_us=args.inferencia_us, separar_pts=True)
+    datos = [_Contador() for _ in args.fuentes]
+    ruteador = RuteadorFuentes(args.fuentes, [_contar] * len(args.fuentes), datos,
+                               verificar=lambda buffer, i: buffer.pts // _SEPARACION_PTS == i)
+    ruteador.instalar(pipeline)
+
+    loop = GLib.MainLoop()
+    GLib.timeout_add(int(args.segundos * 1000), loop.quit)
+    pipeline.set_state(Gst.State.PLAYING)
+    loop.run()
+    pipeline.set_state(Gst.State.NULL)
+
+    estadisticas = ruteador.estadisticas()
+    estadisticas["capacidad_inferencia_fps"] = round(1e6 / args.inferencia_us, 1)
+    print(json.dumps(estadisticas, indent=1, ensure_ascii=False))
+
+    ok = (estadisticas["mal_ruteados"] == 0 and estadisticas["sin_fuente"] == 0
+          and all(d.frames == e for d, e in zip(datos, ruteador.entregados)))
+    print("✅ Ruteo correcto" if ok else "❌ Hay buffers sin fuente o mal ruteados")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
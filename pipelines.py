@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import argparse
+import tempfile
+
+# GStreamer es opcional: armar y reescribir las cadenas no lo necesita
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst, GLib
+except (ImportError, ValueError):
+    Gst = None
+    GLib = None
+
+ETAPAS = ("captura", "preproceso", "inferencia", "postproceso", "callback")
+
+# Elemento -> etapa. Lo que no figura (identity, fakesink, appsink...) va a "callback"
+_ETAPA_POR_FABRICA = {
+    "v4l2src": "captura",
+    "libcamerasrc": "captura",
+    "videotestsrc": "captura",
+    "filesrc": "captura",
+    "qtdemux": "captura",
+    "matroskademux": "captura",
+    "h264parse": "captura",
+    "avdec_h264": "captura",
+    "v4l2h264dec": "captura",
+    "decodebin": "captura",
+    "jpegdec": "captura",
+    "v4l2jpegdec": "captura",
+    "videoconvert": "preproceso",
+    "videoscale": "preproceso",
+    "videoconvertscale": "preproceso",
+    "videorate": "preproceso",
+    "videocrop": "preproceso",
+    "hailonet": "inferencia",
+    "hailofilter": "postproceso",
+}
+
+# Elementos con conversión en varios hilos (propiedad n-threads)
+_CON_HILOS = ("videoconvert", "videoscale", "videoconvertscale")
+_soporte_hilos = {}
+
+
+def _partes(elemento):
+    """(fábrica, propiedades) de un elemento escrito como 'fabrica prop=valor ...'"""
+    tokens = elemento.split()
+    propiedades = dict(t.split("=", 1) for t in tokens[1:] if "=" in t)
+    return tokens[0], propiedades
+
+
+def etapa_de(elemento):
+    """Etapa de un elemento de la cadena; los caps pertenecen al elemento anterior (None)
+
+    Un identity con name=inferencia/postproceso cuenta como esa etapa: así se
+    puede simular el NPU con 'identity name=inferencia sleep-time=...'.
+    """
+    fabrica, propiedades = _partes(elemento)
+    if "/" in fabrica:
+        return None
+    if fabrica == "queue":
+        return "cola"
+    if propiedades.get("name") in ETAPAS:
+        return propiedades["name"]
+    return _ETAPA_POR_FABRICA.get(fabrica, "callback")
+
+
+def soporta_hilos(fabrica):
+    """True si el elemento instalado tiene la propiedad n-threads"""
+    if fabrica not in _soporte_hilos:
+        soporta = False
+        if Gst is not None:
+            Gst.init(None)
+            fabrica_gst = Gst.ElementFactory.find(fabrica)
+            if fabrica_gst is not None:
+                elemento = fabrica_gst.create(None)
+                soporta = elemento is not None and elemento.find_property("n-threads") is not None
+        _soporte_hilos[fabrica] = soporta
+    return _soporte_hilos[fabrica]
+
+
+def cola(nombre, max_buffers=3, leaky="downstream"):
+    """Cola acotada por buffers (sin límite de bytes ni tiempo) que descarta lo más viejo"""
+    return (f"queue name={nombre} max-size-buffers={max_buffers} max-size-bytes=0 "
+            f"max-size-time=0 leaky={leaky}")
+
+
+def insertar_colas(pipeline_str, colas=True, max_buffers=3, leaky="downstream", hilos_conversion=0):
+    """Reescribir una cadena lineal 'a ! b ! c' desacoplando sus etapas
+
+    Con colas=True agrega una cola antes de cada cambio de etapa (captura,
+    preproceso, inferencia, postproceso, callback): cada etapa corre en su
+    propio hilo y, con leaky=downstream, un callback lento descarta frames
+    viejos en lugar de frenar la cámara. hilos_conversion > 0 agrega
+    n-threads a videoconvert/videoscale cuando el elemento lo soporta. Si la
+    cadena ya tiene una cola en ese punto no se agrega otra.
+    """
+    elementos = [" ".join(e.split()) for e in pipeline_str.split("!")]
+    elementos = [e for e in elementos if e]
+    resultado = []
+    anterior = None
+    for elemento in elementos:
+        etapa = etapa_de(elemento)
+        fabrica, propiedades = _partes(elemento)
+
+        if (hilos_conversion > 0 and fabrica in _CON_HILOS and "n-threads" not in propiedades
+                and soporta_hilos(fabrica)):
+            elemento = f"{elemento} n-threads={hilos_conversion}"
+
+        if colas and etapa not in (None, "cola") and anterior not in (None, "cola", etapa):
+            resultado.append(cola(f"q_{etapa}", max_buffers, leaky))
+        resultado.append(elemento)
+        if etapa is not None:
+            anterior = etapa
+    return " ! ".join(resultado)
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos para desacoplar las etapas del pipeline"""
+    parser.add_argument('--colas', action='store_true',
+                        help='Insertar colas con descarte entre captura, preproceso, inferencia, '
+                             'postproceso y callback (cada etapa en su propio hilo)')
+    parser.add_argument('--cola-buffers', type=int, default=3,
+                        help='Buffers máximos por cola antes de descartar los más viejos')
+    parser.add_argument('--hilos-conversion', type=int, default=0,
+                        help='Hilos para videoconvert/videoscale (n-threads; 0 = valor del elemento)')
+
+
+def desde_args(pipeline_str, args):
+    return insertar_colas(pipeline_str, args.colas, args.cola_buffers,
+                          hilos_conversion=args.hilos_conversion)
+
+
+# -----------------------------------------------------------------------------------------------
+# Especificación declarativa y construcción programática
+# -----------------------------------------------------------------------------------------------
+class EspecPipeline:
+    """Descripción de un pipeline de detección: fuente, caps, preproceso, modelo, postproceso y sink
+
+    fuente y preproceso son listas de elementos escritos como en gst-launch
+    ("v4l2src device=/dev/video0"); los caps son cadenas de caps. Se puede
+    guardar como dict (JSON) y reconstruir igual en el próximo arranque.
+    """
+
+    def __init__(self, nombre, fuente, caps_fuente=None, preproceso=("videoconvert",),
+                 caps_modelo=None, modelo=None, propiedades_modelo=None, postproceso=None,
+                 funcion=None, callback="identity_callback", sink="fakesink sync=false"):
+        self.nombre = nombre
+        self.fuente = list(fuente)
+        self.caps_fuente = caps_fuente
+        self.preproceso = list(preproceso)
+        self.caps_modelo = caps_modelo
+        self.modelo = modelo
+        self.propiedades_modelo = dict(propiedades_modelo or {})
+        self.postproceso = postproceso
+        self.funcion = funcion
+        self.callback = callback
+        self.sink = sink
+
+    def elementos_previos(self):
+        """Fuente y preproceso hasta los caps que recibe el modelo"""
+        elementos = list(self.fuente)
+        if self.caps_fuente:
+            elementos.append(self.caps_fuente)
+        elementos += self.preproceso
+        if self.caps_modelo:
+            elementos.append(self.caps_modelo)
+        return elementos
+
+    def elementos_modelo(self):
+        """hailonet y hailofilter (vacío si no hay modelo)"""
+        elementos = []
+        if self.modelo:
+            propiedades = "".join(f" {k}={v}" for k, v in self.propiedades_modelo.items())
+            elementos.append(f"hailonet hef-path={self.modelo}{propiedades}")
+        if self.postproceso:
+            elementos.append(f"hailofilter function-name={self.funcion} so-path={self.postproceso}")
+        return elementos
+
+    def elementos_finales(self):
+        return [f"identity name={self.callback}", self.sink]
+
+    def elementos(self):
+        return self.elementos_previos() + self.elementos_modelo() + self.elementos_finales()
+
+    def a_cadena(self):
+        return " ! ".join(self.elementos())
+
+    def a_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def desde_dict(cls, datos):
+        return cls(**datos)
+
+
+def crear_elemento(texto):
+    """Crear un Gst.Element a partir de 'fabrica prop=valor ...' o de una cadena de caps"""
+    fabrica, propiedades = _partes(texto)
+    if "/" in fabrica:
+        elemento = Gst.ElementFactory.make("capsfilter", None)
+        elemento.set_property("caps", Gst.Caps.from_string(texto))
+        return elemento
+    elemento = Gst.ElementFactory.make(fabrica, propiedades.pop("name", None))
+    if elemento is None:
+        raise RuntimeError(f"Elemento no disponible: {fabrica}")
+    for clave, valor in propiedades.items():
+        Gst.util_set_object_arg(elemento, clave, valor)
+    return elemento
+
+
+def enlazar(anterior, elemento):
+    """Enlazar dos elementos; si el de arriba tiene pads dinámicos (qtdemux), al aparecer el pad"""
+    if anterior.link(elemento):
+        return
+    dinamico = any(t.presence == Gst.PadPresence.SOMETIMES and t.direction == Gst.PadDirection.SRC
+                   for t in anterior.get_pad_template_list())
+    if not dinamico:
+        raise RuntimeError(f"No se pudo enlazar {anterior.get_name()} -> {elemento.get_name()}")
+
+    def pad_agregado(_, pad):
+        sink = elemento.get_static_pad("sink")
+        if not sink.is_linked():
+            pad.link(sink)
+    anterior.connect("pad-added", pad_agregado)
+
+
+def construir(espec, opciones=None):
+    """Crear el Gst.Pipeline elemento por elemento (con colas si opciones lo pide)"""
+    cadena = espec.a_cadena()
+    if opciones is not None:
+        cadena = desde_args(cadena, opciones)
+    pipeline = Gst.Pipeline.new(espec.nombre)
+    anterior = None
+    for texto in cadena.split(" ! "):
+        elemento = crear_elemento(texto)
+        pipeline.add(elemento)
+        if anterior is not None:
+            enlazar(anterior, elemento)
+        anterior = elemento
+    return pipeline
+
+
+def derivar(pipeline, antes_de, rama, nombre_tee=None):
+    """Insertar un tee antes del elemento antes_de y colgar de él la rama (lista de elementos)
+
+    Se usa con el pipeline armado y todavía en NULL. La rama debería empezar
+    con una cola con descarte para no frenar la rama principal. Devuelve el
+    último elemento de la rama.
+    """
+    destino = pipeline.get_by_name(antes_de)
+    if destino is None:
+        raise RuntimeError(f"No existe el elemento {antes_de}")
+    sink = destino.get_static_pad("sink")
+    origen = sink.get_peer()
+    if origen is None:
+        raise RuntimeError(f"{antes_de} no está enlazado")
+    origen.unlink(sink)
+
+    tee = crear_elemento(f"tee name={nombre_tee or 'tee_' + antes_de}")
+    pipeline.add(tee)
+    origen.link(tee.get_static_pad("sink"))
+    tee.link(destino)
+    return agregar_rama(pipeline, rama, tee)
+
+
+def agregar_rama(pipeline, rama, anterior=None):
+    """Agregar y enlazar en cadena los elementos de rama; sin anterior, la rama empieza en su fuente
+
+    Devuelve el último elemento de la rama.
+    """
+    for texto in rama:
+        elemento = crear_elemento(texto)
+        pipeline.add(elemento)
+        if anterior is not None:
+            enlazar(anterior, elemento)
+        anterior = elemento
+    return anterior
+
+
+def validar(espec):
+    """Chequeos baratos antes de construir (sin cargar el HEF); devuelve el error o None
+
+    Verifica que existan los elementos y archivos y que la fuente en vivo
+    pueda entregar caps_fuente: el dispositivo se abre en READY y se
+    consultan sus caps, sin negociar el pipeline completo.
+    """
+    for texto in espec.elementos():
+        fabrica, propiedades = _partes(texto)
+        if "/" in fabrica:
+            continue
+        if Gst.ElementFactory.find(fabrica) is None:
+            return f"Falta el elemento {fabrica}"
+        if fabrica == "filesrc" and not os.path.isfile(propiedades.get("location", "")):
+            return f"No existe {propiedades.get('location')}"
+    for archivo in (espec.modelo, espec.postproceso):
+        if archivo and not os.path.exists(archivo):
+            return f"No existe {archivo}"
+
+    fabrica, _ = _partes(espec.fuente[0])
+    if espec.caps_fuente and fabrica in ("v4l2src", "libcamerasrc"):
+        fuente = crear_elemento(espec.fuente[0])
+        try:
+            if fuente.set_state(Gst.State.READY) == Gst.StateChangeReturn.FAILURE:
+                return f"No se pudo abrir {espec.fuente[0]}"
+            ofrecidos = fuente.get_static_pad("src").query_caps(None)
+            if not ofrecidos.can_intersect(Gst.Caps.from_string(espec.caps_fuente)):
+                return f"La fuente no ofrece {espec.caps_fuente}"
+        finally:
+            fuente.set_state(Gst.State.NULL)
+    return None
+
+
+class CachePipelines:
+    """Configuración que funcionó, por fuente/modelo, en un JSON chico en disco"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.expanduser("~"), ".cache", "hailo_detector",
+                                         "pipelines.json")
+
+    def _leer(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _escribir(self, datos):
+        carpeta = os.path.dirname(self.path) or "."
+        os.makedirs(carpeta, exist_ok=True)
+        fd, temporal = tempfile.mkstemp(dir=carpeta, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(datos, f, indent=1)
+        os.replace(temporal, self.path)
+
+    def obtener(self, clave):
+        datos = self._leer().get(clave)
+        return EspecPipeline.desde_dict(datos) if datos else None
+
+    def guardar(self, clave, espec):
+        datos = self._leer()
+        datos[clave] = espec.a_dict()
+        self._escribir(datos)
+
+    def olvidar(self, clave):
+        datos = self._leer()
+        if datos.pop(clave, None) is not None:
+            self._escribir(datos)
+
+
+def agregar_argumentos_cache(parser):
+    """Opciones de línea de comandos para la configuración de pipeline guardada"""
+    parser.add_argument('--sin-cache', action='store_true',
+                        help='No usar ni guardar la configuración de pipeline que funcionó')
+    parser.add_argument('--pipeline-cache',
+                        help='Archivo JSON de configuraciones guardadas '
+                             '(default: ~/.cache/hailo_detector/pipelines.json)')
+
+
+def cache_desde_args(args):
+    if args.sin_cache:
+        return None
+    return CachePipelines(args.pipeline_cache)
+
+
+def clave_cache(fuente, modelo, postproceso=None):
+    return f"{fuente}|{modelo}|{postproceso or ''}"
+
+
+def construir_con_cache(candidatos, clave, cache=None, opciones=None):
+    """Construir la configuración guardada o, si no hay, la primera candidata válida
+
+    Devuelve (pipeline, espec, desde_cache). Las candidatas que fallan la
+    validación se descartan sin cargar el modelo. Una configuración guardada
+    que ya no está entre las candidatas (porque cambió el código) se ignora.
+    Acá no se guarda nada: construir no garantiza que negocie ni que hailonet
+    arranque, así que quien la usa llama a cache.guardar() cuando el pipeline
+    llega a PLAYING y a cache.olvidar() si el bus trae un error.
+    """
+    if cache is not None:
+        espec = cache.obtener(clave)
+        if espec is not None and all(espec.a_dict() != c.a_dict() for c in candidatos):
+            cache.olvidar(clave)
+            espec = None
+        if espec is not None:
+            try:
+                return construir(espec, opciones), espec, True
+            except RuntimeError as e:
+                print(f"⚠️  La configuración guardada ya no sirve ({e}), probando candidatas")
+                cache.olvidar(clave)
+
+    for espec in candidatos:
+        error = validar(espec)
+        if error:
+            print(f"❌ Descartada {espec.nombre}: {error}")
+            continue
+        try:
+            pipeline = construir(espec, opciones)
+        except RuntimeError as e:
+            print(f"❌ Falló {espec.nombre}: {e}")
+            continue
+        return pipeline, espec, False
+    raise RuntimeError("No se pudo crear ningún pipeline válido")
+
+
+def cuello_de_botella(metricas):
+    """Etapa más lenta según los tiempos por elemento de un MetricasPipeline
+
+    Suma el tiempo medio de los elementos de cada etapa (las colas se
+    cuentan aparte: su tiempo es espera) y agrega la ocupación media
+    muestreada de cada cola; la cola llena está justo antes de la etapa lenta.
+    """
+    etapas = {}
+    colas = {}
+    for elemento in metricas._elementos():
+        nombre = elemento.get_name()
+        fabrica = elemento.get_factory().get_name() if elemento.get_factory() else ""
+        hist = metricas.registro.histogramas.get(
+            ("tiempo_elemento_segundos", (("elemento", nombre),)))
+        if hist is None:
+            continue
+        resumen = hist.resumen()
+        if not resumen["cantidad"]:
+            continue
+        medio = resumen["suma"] / resumen["cantidad"]
+        if fabrica == "queue":
+            colas[nombre] = {"espera_media_ms": round(medio * 1000, 3),
+                             "ocupacion": metricas.registro.gauges.get(
+                                 ("ocupacion_cola_ratio", (("cola", nombre),)))}
+            continue
+        propiedades = f"name={nombre}" if nombre in ETAPAS else ""
+        etapa = etapa_de(f"{fabrica} {propiedades}")
+        etapas[etapa] = etapas.get(etapa, 0.0) + medio
+    if not etapas:
+        return None
+    peor = max(etapas, key=etapas.get)
+    return {
+        "etapa": peor,
+        "tiempo_medio_ms": {e: round(t * 1000, 3) for e, t in etapas.items()},
+        "colas": colas,
+    }
+
+
+# -----------------------------------------------------------------------------------------------
+# Benchmark con videotestsrc: identity sleep-time hace de NPU y postproceso
+# -----------------------------------------------------------------------------------------------
+def pipeline_prueba(fps=60, inferencia_us=12000, postproceso_us=3000):
+    return (
+        f"videotestsrc is-live=true pattern=ball ! "
+        f"video/x-raw,format=YUY2,width=640,height=480,framerate={fps}/1 ! "
+        f"videoconvert ! videoscale ! video/x-raw,format=RGB,width=640,height=640 ! "
+        f"identity name=inferencia sleep-time={inferencia_us} ! "
+        f"identity name=postproceso sleep-time={postproceso_us} ! "
+        f"identity name=identity_callback ! fakesink sync=false"
+    )
+
+
+def medir(pipeline_str, segundos, callback_ms):
+    """Correr el pipeline y devolver fps en el callback, latencia y cuello de botella"""
+    from metricas import MetricasPipeline
+
+    pipeline = Gst.parse_launch(pipeline_str)
+    metricas = MetricasPipeline(pipeline)
+    metricas.instrumentar()
+    metricas.iniciar_muestreo(100)
+
+    def callback_lento(pad, info):
+        # Simula el trabajo en Python del app_callback
+        time.sleep(callback_ms / 1000.0)
+        return Gst.PadProbeReturn.OK
+
+    pipeline.get_by_name("identity_callback").get_static_pad("src").add_probe(
+        Gst.PadProbeType.BUFFER, callback_lento)
+
+    loop = GLib.MainLoop()
+    GLib.timeout_add(int(segundos * 1000), loop.quit)
+    pipeline.set_state(Gst.State.PLAYING)
+    loop.run()
+    pipeline.set_state(Gst.State.NULL)
+    metricas.detener()
+
+    reporte = metricas.reporte()
+    latencia = reporte["histogramas"].get("latencia_captura_callback_segundos", {})
+    fuente = sum(v for k, v in reporte["contadores"].items() if k.startswith("buffers_fuente_total"))
+    callbacks = reporte["contadores"].get("buffers_callback_total", 0)
+    return {
+        "fps_fuente": round(fuente / segundos, 1),
+        "fps_callback": round(callbacks / segundos, 1),
+        "latencia_p50_ms": round(latencia["p50"] * 1000, 2) if latencia.get("p50") else None,
+        "latencia_p95_ms": round(latencia["p95"] * 1000, 2) if latencia.get("p95") else None,
+        "cuello_de_botella": cuello_de_botella(metricas),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput y latencia con y sin colas entre etapas')
+    parser.add_argument('--segundos', type=float, default=5.0)
+    parser.add_argument('--fps', type=int, default=60)
+    parser.add_argument('--inferencia-us', type=int, default=12000,
+                        help='Tiempo simulado de hailonet por frame')
+    parser.add_argument('--postproceso-us', type=int, default=3000,
+                        help='Tiempo simulado de hailofilter por frame')
+    parser.add_argument('--callback-ms', type=float, default=8.0,
+                        help='Tiempo simulado del callback de Python por frame')
+    agregar_argumentos(parser)
+    args = parser.parse_args()
+
+    if Gst is None:
+        raise SystemExit("❌ GStreamer (gi) no está disponible")
+    Gst.init(None)
+
+    base = pipeline_prueba(args.fps, args.inferencia_us, args.postproceso_us)
+    resultados = {}
+    for nombre, con_colas in (("lineal", False), ("con_colas", True)):
+        pipeline_str = insertar_colas(base, con_colas, args.cola_buffers,
+                                      hilos_conversion=args.hilos_conversion)
+        print(f"⏱️  {nombre}: {pipeline_str}")
+        resultados[nombre] = medir(pipeline_str, args.segundos, args.callback_ms)
+    print(json.dumps(resultados, indent=1, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
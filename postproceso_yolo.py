@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from detecciones import Detecciones, DeteccionSimulada, ROISimulado, extraer_detecciones, hailo
+from mosaico import nms
+
+# Las 80 clases de COCO; el class_id es el índice + 1 (0 es fondo), como en el post-proceso de hailo
+NOMBRES_COCO = (
+    "person", "bicycle", "car", "motorbike", "aeroplane", "bus", "train", "truck", "boat",
+    "traffic light", "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat", "dog",
+    "horse", "sheep", "cow", "elephant", "bear", "zebra", "giraffe", "backpack", "umbrella",
+    "handbag", "tie", "suitcase", "frisbee", "skis", "snowboard", "sports ball", "kite",
+    "baseball bat", "baseball glove", "skateboard", "surfboard", "tennis racket", "bottle",
+    "wine glass", "cup", "fork", "knife", "spoon", "bowl", "banana", "apple", "sandwich", "orange",
+    "broccoli", "carrot", "hot dog", "pizza", "donut", "cake", "chair", "sofa", "pottedplant", "bed",
+    "diningtable", "toilet", "tvmonitor", "laptop", "mouse", "remote", "keyboard", "cell phone",
+    "microwave", "oven", "toaster", "sink", "refrigerator", "book", "clock", "vase", "scissors",
+    "teddy bear", "hair drier", "toothbrush",
+)
+
+# Anclas (ancho, alto en píxeles de la entrada) por stride, las de COCO de YOLOv5
+ANCLAS_YOLOV5 = {
+    8: ((10, 13), (16, 30), (33, 23)),
+    16: ((30, 61), (62, 45), (59, 119)),
+    32: ((116, 90), (156, 198), (373, 326)),
+}
+# Bins de la distribución de cada distancia en las cabezas DFL de YOLOv8/YOLOv11
+REG_MAX = 16
+
+# Familia -> (tipo de cabeza, anclas). "anclas": una salida por stride con
+# 3 x (x, y, w, h, obj, clases...); "dfl": dos salidas por stride, 4 x REG_MAX
+# bins de distancia y las clases. Las HEF de hailo ya aplican la sigmoide en
+# el chip, así que por defecto no se vuelve a aplicar.
+FAMILIAS = {
+    "yolov5": ("anclas", ANCLAS_YOLOV5),
+    "yolov5m_wo_spp": ("anclas", ANCLAS_YOLOV5),
+    "yolov8": ("dfl", None),
+    "yolov8s": ("dfl", None),
+    "yolov8m": ("dfl", None),
+    "yolov11": ("dfl", None),
+}
+
+
+def familia_de_modelo(path):
+    """Familia según el nombre del .hef (la más específica que aparezca), o None"""
+    nombre = os.path.basename(path or "").lower()
+    for familia in sorted(FAMILIAS, key=len, reverse=True):
+        if familia in nombre:
+            return familia
+    # yolov11n, yolov8n...: el prefijo alcanza para saber el tipo de cabeza
+    for prefijo in ("yolov11", "yolov8", "yolov5"):
+        if prefijo in nombre:
+            return prefijo
+    return None
+
+
+def _cuantizado(tensor):
+    """(datos, escala, punto cero): un array float va con escala 1 y cero 0"""
+    if isinstance(tensor, tuple):
+        return tensor
+    return tensor, 1.0, 0.0
+
+
+def _umbral_crudo(umbral, escala, cero, sigmoide):
+    """Umbral en las unidades del tensor (cuantizado y, si hace falta, antes de la sigmoide)
+
+    Comparar contra el valor crudo evita descuantizar y activar todo el
+    tensor: solo se convierten las celdas que pasan.
+    """
+    if sigmoide:
+        umbral = np.log(umbral / (1.0 - umbral))
+    return umbral / escala + cero
+
+
+def _descuantizar(datos, escala, cero):
+    return (datos.astype(np.float32) - np.float32(cero)) * np.float32(escala)
+
+
+def _sigmoide(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def tensores_de_roi(roi):
+    """Tensores de salida que hailonet deja en el ROI: {nombre: (datos HxWxC, escala, cero)}
+
+    Los datos son vistas sin copia de la memoria del tensor; la
+    descuantización se hace después, solo sobre las celdas candidatas.
+    """
+    tensores = {}
+    for tensor in roi.get_tensors():
+        datos = np.array(tensor, copy=False)
+        escala, cero = 1.0, 0.0
+        if np.issubdtype(datos.dtype, np.integer):
+            cuantizacion = tensor.vstream_info().quant_info
+            escala, cero = cuantizacion.qp_scale, cuantizacion.qp_zp
+        tensores[tensor.name()] = (datos.reshape(datos.shape[-3:]), escala, cero)
+    return tensores
+
+
+def agregar_a_roi(roi, detecciones):
+    """Agregar las detecciones al ROI como HailoDetection, igual que el post-proceso en C++
+
+    Así el resto del callback (extraer_detecciones, tracker, overlays) no
+    distingue de dónde salieron. Sin el módulo hailo se usa DeteccionSimulada.
+    """
+    for i in range(len(detecciones)):
+        x1, y1, x2, y2 = (float(v) for v in detecciones.xyxy[i])
+        caja = (x1, y1, x2 - x1, y2 - y1)
+        class_id = int(detecciones.class_id[i])
+        label = detecciones.etiqueta(i)
+        confianza = float(detecciones.confianza[i])
+        if hailo is not None:
+            deteccion = hailo.HailoDetection(hailo.HailoBBox(*caja), class_id, label, confianza)
+        else:
+            deteccion = DeteccionSimulada(label, class_id, confianza, caja)
+        roi.add_object(deteccion)
+
+
+class PostprocesoYolo:
+    """Decodificación YOLO + NMS en NumPy para cuando no hay libyolo_hailortpp_post.so
+
+    decodificar() recibe los tensores de salida (HxWxC, float o cuantizados
+    como (datos, escala, cero)) y devuelve Detecciones con xyxy normalizadas
+    a la entrada del modelo y class_id de COCO (1..80), lo mismo que deja el
+    post-proceso de hailo. Las celdas se filtran por umbral sobre los valores
+    crudos antes de descuantizar; antes del NMS quedan a lo sumo
+    max_candidatos.
+    """
+
+    def __init__(self, familia, umbral=0.3, umbral_nms=0.45, max_candidatos=300, max_detecciones=100,
+                 entrada=(640, 640), nombres=NOMBRES_COCO, sigmoide=False):
+        if familia not in FAMILIAS:
+            raise ValueError(f"Familia no válida: {familia}")
+        self.familia = familia
+        self.tipo, self.anclas = FAMILIAS[familia]
+        self.umbral = umbral
+        self.umbral_nms = umbral_nms
+        self.max_candidatos = max_candidatos
+        self.max_detecciones = max_detecciones
+        self.ancho, self.alto = entrada
+        self.nombres = {i + 1: nombre for i, nombre in enumerate(nombres)}
+        self.sigmoide = sigmoide
+
+        # Contadores
+        self.frames = 0
+        self.candidatos = 0
+        self.detecciones = 0
+        self.segundos = 0.0
+
+    # -------------------------------------------------------------------------
+    # Decodificación por tipo de cabeza
+    # -------------------------------------------------------------------------
+    def _stride(self, datos):
+        return self.alto // datos.shape[0]
+
+    def _decodificar_anclas(self, tensores):
+        """YOLOv5: xy = (2 s - 0.5 + celda) * stride, wh = (2 s)^2 * ancla, score = obj * clase"""
+        cajas, scores, clases = [], [], []
+        for tensor in tensores:
+            datos, escala, cero = _cuantizado(tensor)
+            stride = self._stride(datos)
+            anclas = np.asarray(self.anclas[stride], dtype=np.float32)
+            alto, ancho = datos.shape[:2]
+            filas = datos.reshape(alto * ancho * len(anclas), -1)
+            # obj acota al score: si no pasa el umbral, ninguna clase de esa celda pasa
+            indices = np.flatnonzero(filas[:, 4] > _umbral_crudo(self.umbral, escala, cero, self.sigmoide))
+            if not len(indices):
+                continue
+            valores = _descuantizar(filas[indices], escala, cero)
+            if self.sigmoide:
+                valores = _sigmoide(valores)
+            clase = np.argmax(valores[:, 5:], axis=1)
+            score = valores[:, 4] * valores[np.arange(len(valores)), 5 + clase]
+            pasan = score > self.umbral
+            if not pasan.any():
+                continue
+            indices, valores, clase, score = indices[pasan], valores[pasan], clase[pasan], score[pasan]
+            celda, ancla = np.divmod(indices, len(anclas))
+            gy, gx = np.divmod(celda, ancho)
+            cx = (valores[:, 0] * 2 - 0.5 + gx) * stride
+            cy = (valores[:, 1] * 2 - 0.5 + gy) * stride
+            w = (valores[:, 2] * 2) ** 2 * anclas[ancla, 0]
+            h = (valores[:, 3] * 2) ** 2 * anclas[ancla, 1]
+            cajas.append(np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1))
+            scores.append(score)
+            clases.append(clase)
+        return cajas, scores, clases
+
+    def _decodificar_dfl(self, tensores):
+        """YOLOv8/v11: distancias a los bordes como esperanza de un softmax de REG_MAX bins"""
+        por_stride = {}
+        for tensor in tensores:
+            datos = _cuantizado(tensor)[0]
+            # La salida de cajas tiene 4 x REG_MAX canales; la otra es la de clases
+            parte = "cajas" if datos.shape[-1] == 4 * REG_MAX else "clases"
+            por_stride.setdefault(self._stride(datos), {})[parte] = tensor
+        bins = np.arange(REG_MAX, dtype=np.float32)
+        cajas, scores, clases = [], [], []
+        for stride, partes in por_stride.items():
+            datos, escala, cero = _cuantizado(partes["clases"])
+            alto, ancho = datos.shape[:2]
+            filas = datos.reshape(alto * ancho, -1)
+            maximo = filas.max(axis=1)
+            indices = np.flatnonzero(maximo > _umbral_crudo(self.umbral, escala, cero, self.sigmoide))
+            if not len(indices):
+                continue
+            valores = _descuantizar(filas[indices], escala, cero)
+            if self.sigmoide:
+                valores = _sigmoide(valores)
+            clase = np.argmax(valores, axis=1)
+            score = valores[np.arange(len(valores)), clase]
+
+            datos, escala, cero = _cuantizado(partes["cajas"])
+            distribucion = _descuantizar(datos.reshape(alto * ancho, 4, REG_MAX)[indices], escala, cero)
+            distribucion = np.exp(distribucion - distribucion.max(axis=2, keepdims=True))
+            distancias = (distribucion @ bins) / distribucion.sum(axis=2)
+            gy, gx = np.divmod(indices, ancho)
+            cx, cy = gx + 0.5, gy + 0.5
+            cajas.append(np.stack([cx - distancias[:, 0], cy - distancias[:, 1],
+                                   cx + distancias[:, 2], cy + distancias[:, 3]], axis=1) * stride)
+            scores.append(score)
+            clases.append(clase)
+        return cajas, scores, clases
+
+    # -------------------------------------------------------------------------
+    # API pública
+    # -------------------------------------------------------------------------
+    def decodificar(self, tensores):
+        """Tensores de salida (lista o dict por nombre) -> Detecciones después del NMS"""
+        inicio = time.perf_counter()
+        if isinstance(tensores, dict):
+            tensores = list(tensores.values())
+        if self.tipo == "anclas":
+            cajas, scores, clases = self._decodificar_anclas(tensores)
+        else:
+            cajas, scores, clases = self._decodificar_dfl(tensores)
+        self.frames += 1
+        if not cajas:
+            self.segundos += time.perf_counter() - inicio
+            return Detecciones.vacias(self.nombres)
+
+        xyxy = np.concatenate(cajas).astype(np.float32)
+        score = np.concatenate(scores).astype(np.float32)
+        class_id = (np.concatenate(clases) + 1).astype(np.int32)
+        self.candidatos += len(score)
+        if len(score) > self.max_candidatos:
+            mejores = np.argpartition(-score, self.max_candidatos)[:self.max_candidatos]
+            xyxy, score, class_id = xyxy[mejores], score[mejores], class_id[mejores]
+        quedan = nms(xyxy, score, class_id, umbral=self.umbral_nms, metrica="iou")[:self.max_detecciones]
+        xyxy = np.clip(xyxy[quedan] / np.array([self.ancho, self.alto] * 2, dtype=np.float32), 0.0, 1.0)
+        detecciones = Detecciones(class_id[quedan], score[quedan], xyxy, nombres=self.nombres)
+        self.detecciones += len(detecciones)
+        self.segundos += time.perf_counter() - inicio
+        return detecciones
+
+    def procesar(self, roi):
+        """Decodificar los tensores del ROI y agregarle las detecciones (en el callback)"""
+        detecciones = self.decodificar(tensores_de_roi(roi))
+        agregar_a_roi(roi, detecciones)
+        return detecciones
+
+    def estadisticas(self):
+        return {
+            "familia": self.familia,
+            "frames": self.frames,
+            "candidatos": self.candidatos,
+            "detecciones": self.detecciones,
+            "ms_por_frame": round(self.segundos * 1000 / max(1, self.frames), 3),
+        }
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--postproceso-numpy', default='auto', choices=['auto', 'no'] + list(FAMILIAS),
+                        help='Decodificación YOLO + NMS en NumPy si no hay librería de post-proceso '
+                             '(auto: familia según el nombre del .hef; no: desactivado)')
+
+
+def desde_argumentos(args, modelo, umbral=0.3):
+    """PostprocesoYolo para el modelo, o None si está desactivado o la familia no se reconoce"""
+    familia = args.postproceso_numpy
+    if familia == 'no':
+        return None
+    if familia == 'auto':
+        familia = familia_de_modelo(modelo)
+        if familia is None:
+            print(f"⚠️  No se reconoce la familia YOLO de {os.path.basename(modelo)}: "
+                  f"usar --postproceso-numpy {{{','.join(FAMILIAS)}}}")
+            return None
+    return PostprocesoYolo(familia, umbral=umbral)
+
+
+# -----------------------------------------------------------------------------------------------
+# Tensores sintéticos: cajas conocidas codificadas al revés de la decodificación
+# -----------------------------------------------------------------------------------------------
+def _logit(p):
+    p = np.clip(p, 1e-6, 1 - 1e-6)
+    return np.log(p / (1 - p))
+
+
+def tensores_sinteticos(familia, cajas, class_id, confianza, entrada=640, clases=80, rng=None,
+                        ruido=0, vecinos=False, sigmoide=False):
+    """Tensores de salida (float) que decodifican a las cajas dadas (xyxy en píxeles)
+
+    ruido agrega esa cantidad de cajas al azar con confianza apenas sobre el
+    umbral (los candidatos del benchmark). vecinos repite cada caja en la celda de al lado para que la suprima el
+    NMS. Con sigmoide los valores van como logits.
+    """
+    rng = rng or np.random.default_rng(0)
+    tipo, anclas = FAMILIAS[familia]
+    strides = (8, 16, 32)
+    if tipo == "anclas":
+        tensores = {s: np.zeros((entrada // s, entrada // s, 3, 5 + clases), np.float32) for s in strides}
+    else:
+        tensores = {s: (np.zeros((entrada // s, entrada // s, 4, REG_MAX), np.float32),
+                        np.zeros((entrada // s, entrada // s, clases), np.float32)) for s in strides}
+
+    def escribir(caja, cid, conf, desplazamiento=0):
+        x1, y1, x2, y2 = caja
+        w, h = x2 - x1, y2 - y1
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        if tipo == "anclas":
+            # El stride y el ancla cuya forma más se parece a la caja
+            opciones = [(abs(np.log(w / aw)) + abs(np.log(h / ah)), s, a)
+                        for s in strides for a, (aw, ah) in enumerate(anclas[s])]
+            _, s, a = min(opciones)
+            aw, ah = anclas[s][a]
+            gx, gy = int(cx // s) + desplazamiento, int(cy // s)
+            gx = min(gx, entrada // s - 1)
+            fila = tensores[s][gy, gx, a]
+            fila[0] = (cx / s - gx + 0.5) / 2
+            fila[1] = (cy / s - gy + 0.5) / 2
+            fila[2] = np.sqrt(w / aw) / 2
+            fila[3] = np.sqrt(h / ah) / 2
+            fila[4] = 1.0
+            fila[5:] = 0.0
+            fila[5 + cid - 1] = conf
+        else:
+            # Stride más chico que deja las distancias dentro de los REG_MAX bins
+            s = next(s for s in strides if max(w, h) / 2 / s < REG_MAX - 1.5)
+            gx, gy = int(cx // s) + desplazamiento, int(cy // s)
+            gx = min(gx, entrada // s - 1)
+            distancias = np.array([gx + 0.5 - x1 / s, gy + 0.5 - y1 / s,
+                                   x2 / s - gx - 0.5, y2 / s - gy - 0.5])
+            distribucion = np.full((4, REG_MAX), 1e-9)
+            piso = np.clip(np.floor(distancias).astype(int), 0, REG_MAX - 2)
+            fraccion = np.clip(distancias - piso, 0, 1)
+            distribucion[np.arange(4), piso] = 1 - fraccion + 1e-9
+            distribucion[np.arange(4), piso + 1] = fraccion + 1e-9
+            cajas_s, clases_s = tensores[s]
+            cajas_s[gy, gx] = np.log(distribucion)
+            clases_s[gy, gx] = 0.0
+            clases_s[gy, gx, cid - 1] = conf
+
+    for caja, cid, conf in zip(cajas, class_id, confianza):
+        escribir(caja, int(cid), float(conf))
+        if vecinos:
+            escribir(caja, int(cid), float(conf) * 0.9, desplazamiento=1)
+    for _ in range(ruido):
+        lado = rng.uniform(16, 200, 2)
+        esquina = rng.uniform(0, entrada - lado)
+        escribir((*esquina, *(esquina + lado)), int(rng.integers(1, clases + 1)), rng.uniform(0.31, 0.5))
+
+    salida = []
+    for s in strides:
+        if tipo == "anclas":
+            datos = tensores[s]
+            if sigmoide:
+                datos = _logit(datos)
+            salida.append(datos.reshape(entrada // s, entrada // s, -1))
+        else:
+            cajas_s, clases_s = tensores[s]
+            salida.append(cajas_s.reshape(entrada // s, entrada // s, -1))
+            salida.append(_logit(clases_s) if sigmoide else clases_s)
+    return salida
+
+
+def cuantizar(tensor, bits=8):
+    """(datos uint8, escala, cero) como los entrega hailonet"""
+    minimo, maximo = float(tensor.min()), float(tensor.max())
+    escala = (maximo - minimo) / (2 ** bits - 1) or 1.0
+    cero = round(-minimo / escala)
+    datos = np.clip(np.round(tensor / escala + cero), 0, 2 ** bits - 1).astype(np.uint8)
+    return datos, escala, cero
+
+
+def _iou_max(a, b):
+    """IoU de cada caja de a con la mejor de b"""
+    if not len(a) or not len(b):
+        return np.zeros(len(a))
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return (inter / (area_a[:, None] + area_b[None, :] - inter)).max(axis=1)
+
+
+def probar(familia):
+    """Errores de decodificar cajas conocidas (float, logits, cuantizado y duplicadas en vecinos)"""
+    rng = np.random.default_rng(1)
+    cajas = np.array([[100, 120, 220, 200], [300, 300, 340, 330], [50, 400, 450, 620],
+                      [500, 40, 600, 90]], dtype=np.float32)
+    class_id = np.array([3, 8, 6, 1])
+    confianza = np.array([0.9, 0.8, 0.7, 0.6], dtype=np.float32)
+    errores = []
+    casos = {
+        "float": (tensores_sinteticos(familia, cajas, class_id, confianza, rng=rng), False, 0.97, 0.01),
+        "logits": (tensores_sinteticos(familia, cajas, class_id, confianza, rng=rng, sigmoide=True),
+                   True, 0.97, 0.01),
+        # Con uint8 la precisión baja: las cajas se comparan con más tolerancia
+        "uint8": ([cuantizar(t) for t in tensores_sinteticos(familia, cajas, class_id, confianza, rng=rng)],
+                  False, 0.85, 0.02),
+        "vecinos": (tensores_sinteticos(familia, cajas, class_id, confianza, rng=rng, vecinos=True),
+                    False, 0.97, 0.01),
+    }
+    for caso, (tensores, sigmoide, iou_minimo, tolerancia) in casos.items():
+        postproceso = PostprocesoYolo(familia, sigmoide=sigmoide)
+        detecciones = postproceso.decodificar(tensores)
+        if len(detecciones) != len(cajas):
+            errores.append(f"{familia}/{caso}: {len(detecciones)} detecciones, esperadas {len(cajas)}")
+            continue
+        orden = np.argsort(-detecciones.confianza)
+        xyxy = detecciones.xyxy[orden] * 640
+        if _iou_max(cajas, xyxy).min() < iou_minimo:
+            errores.append(f"{familia}/{caso}: IoU mínimo {_iou_max(cajas, xyxy).min():.3f}")
+        if not np.array_equal(detecciones.class_id[orden], class_id):
+            errores.append(f"{familia}/{caso}: clases {detecciones.class_id[orden]} != {class_id}")
+        if np.abs(detecciones.confianza[orden] - confianza).max() > tolerancia:
+            errores.append(f"{familia}/{caso}: confianzas {detecciones.confianza[orden]}")
+
+    # Mismo formato que el post-proceso en C++: el ROI queda con HailoDetection legibles
+    roi = ROISimulado()
+    agregar_a_roi(roi, PostprocesoYolo(familia).decodificar(
+        tensores_sinteticos(familia, cajas, class_id, confianza)))
+    extraidas = extraer_detecciones(roi, nombres={})
+    if sorted(extraidas.etiquetas()) != sorted(NOMBRES_COCO[c - 1] for c in class_id):
+        errores.append(f"{familia}/roi: etiquetas {extraidas.etiquetas()}")
+    return errores
+
+
+def medir(familia, candidatos, frames):
+    """ms por frame de decodificación + NMS con tantas celdas sobre el umbral"""
+    rng = np.random.default_rng(2)
+    tensores = [cuantizar(t) for t in tensores_sinteticos(familia, [], [], [], rng=rng, ruido=candidatos)]
+    postproceso = PostprocesoYolo(familia)
+    for _ in range(frames):
+        postproceso.decodificar(tensores)
+    return postproceso.estadisticas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decodificación YOLO + NMS en NumPy: pruebas y benchmark')
+    parser.add_argument('--familias', nargs='+', default=['yolov5m_wo_spp', 'yolov8s'],
+                        choices=list(FAMILIAS))
+    parser.add_argument('--candidatos', type=int, nargs='+', default=[0, 10, 100, 1000, 3000],
+                        help='Celdas por encima del umbral en los tensores del benchmark')
+    parser.add_argument('--frames', type=int, default=50)
+    args = parser.parse_args()
+
+    errores = []
+    for familia in args.familias:
+        errores += probar(familia)
+    for error in errores:
+        print(f"❌ {error}")
+    if not errores:
+        print(f"✅ Cajas, clases y confianzas recuperadas en {', '.join(args.familias)} "
+              f"(float, logits, uint8 y duplicados suprimidos por NMS)")
+
+    for familia in args.familias:
+        for candidatos in args.candidatos:
+            estadisticas = medir(familia, candidatos, args.frames)
+            print(f"⏱️  {familia:<15} {candidatos:>5} candidatos: {estadisticas['ms_por_frame']:.3f} ms/frame "
+                  f"({estadisticas['detecciones'] // args.frames} detecciones después del NMS)")
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
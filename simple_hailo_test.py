@@ -7,12 +7,22 @@ gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GLib
 import os
 import sys
+import json
 import time
 import argparse
 import signal
-import numpy as np
-import cv2
 import hailo
+from frame_handle import FrameHandle
+from detecciones import extraer_detecciones, filtrar
+from eventos import registro, agregar_argumentos, configurar_desde_args
+import metricas
+import pipelines
+import indice_artefactos
+import multifuente
+import mosaico
+import letterbox
+import captura
+import postproceso_yolo
 
 # Intentar importar desde la infraestructura de Hailo
 try:
@@ -36,8 +46,12 @@ except ImportError:
         return format_str, width, height
     
     def get_numpy_from_buffer(buffer, format_str, width, height):
-        # Implementación básica - retorna None si no se puede procesar
-        return None
+        # Copia del frame: sigue siendo válida después de desmapear el buffer
+        try:
+            with FrameHandle(buffer, format_str, width, height) as frame:
+                return frame.copiar().array
+        except (RuntimeError, ValueError):
+            return None
     
     # Clase base simple
     class app_callback_class:
@@ -65,6 +79,8 @@ class user_app_callback_class(app_callback_class):
         self.fps_counter = 0
         self.detection_count = 0
         self.confidence_threshold = 0.3  # Umbral de confianza más bajo
+        # Decodificación en NumPy cuando el pipeline corre sin hailofilter
+        self.postproceso = None
 
     def new_function(self):  # New function example
         return "The meaning of life is: "
@@ -74,7 +90,8 @@ class user_app_callback_class(app_callback_class):
         if self.fps_counter % 30 == 0:  # Cada 30 frames
             elapsed = time.time() - self.start_time
             fps = self.fps_counter / elapsed
-            print(f"📊 FPS: {fps:.2f} | Total detections: {self.detection_count}")
+            registro().evento("fps", f"📊 FPS: {fps:.2f} | Total detections: {self.detection_count}",
+                              fps=round(fps, 2), detecciones=self.detection_count)
 
 # -----------------------------------------------------------------------------------------------
 # User-defined callback function
@@ -89,8 +106,7 @@ def app_callback(pad, info, user_data):
     # Using the user_data to count the number of frames
     user_data.increment()
     user_data.calculate_fps()
-    
-    string_to_print = f"Frame count: {user_data.get_count()}\n"
+    eventos = registro()
 
     # Get the caps from the pad
     format, width, height = get_caps_from_pad(pad)
@@ -104,79 +120,87 @@ def app_callback(pad, info, user_data):
     # Get the detections from the buffer
     try:
         roi = hailo.get_roi_from_buffer(buffer)
-        detections = roi.get_objects_typed(hailo.HAILO_DETECTION)
+        if user_data.postproceso is not None:
+            # Sin hailofilter el ROI solo trae los tensores crudos: decodificarlos aquí
+            user_data.postproceso.procesar(roi)
+        detections = extraer_detecciones(roi, con_track_id=True)
     except Exception as e:
         # Si no hay ROI o detecciones disponibles, seguir procesando
         if user_data.get_count() % 30 == 0:  # Mostrar cada 30 frames
-            print(f"Frame {user_data.get_count()}: Sin detecciones procesadas (esperado con algunos modelos)")
+            eventos.evento("sin_detecciones",
+                           f"Frame {user_data.get_count()}: Sin detecciones procesadas "
+                           f"(esperado con algunos modelos)", frame=user_data.get_count())
         return Gst.PadProbeReturn.OK
 
-    # Parse the detections
-    detection_count = 0
-    total_detections = 0
-    
+    procesar_detecciones(detections, user_data, eventos)
+    return Gst.PadProbeReturn.OK
+
+
+def mosaico_callback(pts, detections, user_data):
+    """Detecciones ya fusionadas de todos los mosaicos de un frame (coordenadas de la fuente)"""
+    user_data.increment()
+    user_data.calculate_fps()
+    procesar_detecciones(detections, user_data, registro())
+
+
+def procesar_detecciones(detections, user_data, eventos):
     # Umbral de confianza configurable
     confidence_threshold = getattr(user_data, 'confidence_threshold', 0.3)  # Reducido a 0.3
-    
-    for detection in detections:
-        try:
-            label = detection.get_label()
-            bbox = detection.get_bbox()
-            confidence = detection.get_confidence()
-            total_detections += 1
-            
-            # Debug: mostrar todas las detecciones cada cierto tiempo
-            if user_data.get_count() % 60 == 0:  # Cada 60 frames
-                print(f"🔍 Debug - Label: {label}, Confidence: {confidence:.3f}")
-            
-            # Filtrar por personas con umbral más bajo
-            if label == "person" and confidence > confidence_threshold:
-                # Get track ID
-                track_id = 0
-                try:
-                    track = detection.get_objects_typed(hailo.HAILO_UNIQUE_ID)
-                    if len(track) == 1:
-                        track_id = track[0].get_id()
-                except:
-                    track_id = detection_count  # Usar contador si no hay tracking
-                
-                string_to_print += (f"🧑 Person detected! ID: {track_id} "
-                                  f"Confidence: {confidence:.3f} "
-                                  f"BBox: ({bbox.xmin():.0f},{bbox.ymin():.0f},"
-                                  f"{bbox.width():.0f},{bbox.height():.0f})\n")
-                detection_count += 1
-                user_data.detection_count += 1
-                
-            # También detectar otras clases relevantes con umbral bajo
-            elif confidence > confidence_threshold and label in ["car", "bicycle", "motorbike", "bus", "truck"]:
-                string_to_print += (f"🚗 {label.title()} detected! Confidence: {confidence:.3f}\n")
-                
-        except Exception as e:
-            # Error procesando una detección específica
-            continue
 
-    # Mostrar estadísticas cada cierto tiempo
-    if user_data.get_count() % 60 == 0:
-        print(f"📊 Frame {user_data.get_count()}: {total_detections} detecciones totales, "
-              f"{detection_count} personas válidas (umbral: {confidence_threshold})")
+    total_detections = len(detections)
 
-    # Imprimir si hay detecciones de personas
-    if detection_count > 0:
-        print(string_to_print)
+    # Filtrar por personas con umbral más bajo (máscaras sobre todo el frame)
+    personas = detections[filtrar(detections, ["person"], confidence_threshold)]
+    vehiculos = detections[filtrar(detections, ["car", "bicycle", "motorbike", "bus", "truck"],
+                                   confidence_threshold)]
+    detection_count = len(personas)
+    user_data.detection_count += detection_count
 
-    return Gst.PadProbeReturn.OK
+    # Las detecciones se agregan por clase; en debug se registra cada una con límite por clase
+    if eventos.habilitado():
+        eventos.detecciones(personas.etiquetas(), personas.confianza)
+        eventos.detecciones(vehiculos.etiquetas(), vehiculos.confianza)
+
+    # Mostrar estadísticas cada cierto tiempo
+    if user_data.get_count() % 60 == 0:
+        eventos.evento("estadisticas",
+                       f"📊 Frame {user_data.get_count()}: {total_detections} detecciones totales, "
+                       f"{detection_count} personas válidas (umbral: {confidence_threshold})",
+                       frame=user_data.get_count(), total=total_detections,
+                       personas=detection_count, umbral=confidence_threshold)
 
 # -----------------------------------------------------------------------------------------------
 # Headless Detection App Class
 # -----------------------------------------------------------------------------------------------
 class HeadlessDetectionApp:
-    def __init__(self, callback_func, user_data, source="camera", model_path=None):
+    def __init__(self, callback_func, user_data, source="camera", model_path=None, args_metricas=None,
+                 opciones_pipeline=None, cache=None, fuentes=None, fps_max=15, mosaicos=None,
+                 resolucion_fuente=(1920, 1080), args_postproceso=None):
         Gst.init(None)
         self.callback_func = callback_func
         self.user_data = user_data
         self.source = source
         self.pipeline = None
         self.loop = None
+        self.args_metricas = args_metricas
+        self.opciones_pipeline = opciones_pipeline
+        self.cache = cache
+        self.clave_cache = None
+        # Configuración a guardar cuando el pipeline llegue a PLAYING (None = nada pendiente)
+        self.espec_pendiente = None
+        # Modo multi-fuente: user_data es una lista con un objeto por fuente
+        self.fuentes = fuentes
+        self.fps_max = fps_max
+        self.ruteador = None
+        # Modo mosaico: una inferencia por recorte de la fuente a resolución completa
+        self.mosaicos = mosaicos
+        self.resolucion_fuente = resolucion_fuente
+        self.agregador = None
+        self.metricas = None
+        self.exportadores = []
+        
+        # Modelos, librerías y formatos V4L2 salen del índice persistente
+        self.indice = indice_artefactos.indice()
         
         # Buscar modelos disponibles automáticamente
         if model_path is None:
@@ -188,13 +212,25 @@ class HeadlessDetectionApp:
         
         # Verificar que los archivos existen
         self._verify_files()
+
+        # Sin librería de post-proceso, decodificar los tensores en Python
+        self.postproceso = None
+        if self.post_process_so is None and args_postproceso is not None:
+            umbral = min(d.confidence_threshold for d in (user_data if isinstance(user_data, list)
+                                                          else [user_data]))
+            self.postproceso = postproceso_yolo.desde_argumentos(args_postproceso, self.model_path,
+                                                                 umbral)
+            if self.postproceso is not None:
+                print(f"🐍 Post-proceso en NumPy: {self.postproceso.familia}")
+                for datos in (user_data if isinstance(user_data, list) else [user_data]):
+                    datos.postproceso = self.postproceso
         
         # Si es dispositivo v4l2, verificar formatos disponibles
         if self.source.startswith('/dev/video'):
             self._check_v4l2_formats()
         
     def _find_available_model(self):
-        """Buscar automáticamente un modelo disponible"""
+        """Buscar automáticamente un modelo disponible (en el índice, sin recorrer el disco)"""
         # Modelos encontrados en tu sistema
         possible_paths = [
             "/home/jose/hailo-rpi5-examples/resources/yolov5m_wo_spp_h8l.hef",
@@ -205,26 +241,15 @@ class HeadlessDetectionApp:
             "/home/jose/hailo-rpi5-examples/resources/yolov11n_h8l.hef",
             "/home/jose/hailo-rpi5-examples/resources/yolov11s_h8l.hef",
         ]
-        
-        for path in possible_paths:
-            if os.path.exists(path):
-                print(f"✅ Modelo encontrado: {path}")
-                return path
-        
-        # Buscar en el directorio de recursos de jose
-        hailo_dir = "/home/jose/hailo-rpi5-examples/resources/"
-        if os.path.exists(hailo_dir):
-            for file in os.listdir(hailo_dir):
-                if file.endswith('.hef') and 'yolo' in file.lower():
-                    full_path = os.path.join(hailo_dir, file)
-                    print(f"✅ Modelo encontrado: {full_path}")
-                    return full_path
-            
-        raise FileNotFoundError("No se encontró ningún modelo .hef en el sistema")
+        path = self.indice.buscar("modelo", possible_paths,
+                                  lambda p: "yolo" in os.path.basename(p).lower())
+        if path is None:
+            raise FileNotFoundError("No se encontró ningún modelo .hef en el sistema")
+        print(f"✅ Modelo encontrado: {path}")
+        return path
     
     def _find_post_process_lib(self):
         """Buscar la librería de post-procesamiento"""
-        # Buscar en directorios comunes de hailo-rpi5-examples
         possible_libs = [
             "/home/jose/hailo-rpi5-examples/libs/libyolo_hailortpp_post.so",
             "/home/jose/hailo-rpi5-examples/libs/post_processes/libyolo_hailortpp_post.so",
@@ -233,33 +258,13 @@ class HeadlessDetectionApp:
             "/usr/lib/hailo/post_processes/libyolo_hailortpp_post.so",
             "/usr/lib/gstreamer-1.0/libyolo_hailortpp_post.so",
         ]
-        
-        for lib in possible_libs:
-            if os.path.exists(lib):
-                print(f"✅ Post-process lib encontrada: {lib}")
-                return lib
-        
-        # Buscar en el directorio de jose
-        search_dirs = [
-            "/home/jose/hailo-rpi5-examples/",
-            "/home/jose/hailo-rpi5-examples/libs/",
-        ]
-        
-        for directory in search_dirs:
-            if os.path.exists(directory):
-                import subprocess
-                try:
-                    result = subprocess.run(['find', directory, '-name', '*yolo*post*.so', '-type', 'f'], 
-                                          capture_output=True, text=True, timeout=10)
-                    if result.stdout.strip():
-                        libs = result.stdout.strip().split('\n')
-                        print(f"✅ Post-process lib encontrada: {libs[0]}")
-                        return libs[0]
-                except:
-                    pass
-            
-        print("⚠️  No se encontró librería de post-procesamiento, usando pipeline básico")
-        return None
+        path = self.indice.buscar("postproceso", possible_libs,
+                                  lambda p: "yolo" in os.path.basename(p))
+        if path is None:
+            print("⚠️  No se encontró librería de post-procesamiento, usando pipeline básico")
+            return None
+        print(f"✅ Post-process lib encontrada: {path}")
+        return path
         
     def _verify_files(self):
         """Verificar que los archivos del modelo existen"""
@@ -267,19 +272,13 @@ class HeadlessDetectionApp:
             print(f"❌ Error: Modelo no encontrado en {self.model_path}")
             
             # Mostrar modelos disponibles
-            print("💡 Buscando modelos disponibles...")
-            import subprocess
-            try:
-                result = subprocess.run(['find', '/opt', '-name', '*.hef', '-type', 'f'], 
-                                      capture_output=True, text=True, timeout=15)
-                if result.stdout.strip():
-                    print("Modelos encontrados:")
-                    for model in result.stdout.strip().split('\n')[:10]:  # Mostrar solo los primeros 10
-                        print(f"   - {model}")
-                else:
-                    print("No se encontraron modelos .hef en el sistema")
-            except:
-                print("No se pudo buscar modelos automáticamente")
+            modelos = self.indice.artefactos("modelo")
+            if modelos:
+                print("Modelos encontrados:")
+                for model in modelos[:10]:  # Mostrar solo los primeros 10
+                    print(f"   - {model}")
+            else:
+                print("No se encontraron modelos .hef en el sistema")
             
             sys.exit(1)
             
@@ -289,218 +288,125 @@ class HeadlessDetectionApp:
             self.post_process_so = None
             
     def _check_v4l2_formats(self):
-        """Verificar formatos disponibles en dispositivo V4L2"""
-        try:
-            import subprocess
-            print(f"🔍 Verificando formatos de {self.source}...")
-            
-            # Verificar si el dispositivo existe
-            if not os.path.exists(self.source):
-                print(f"❌ Dispositivo {self.source} no existe")
-                return
-                
-            # Obtener formatos disponibles
-            result = subprocess.run(['v4l2-ctl', '--device', self.source, '--list-formats-ext'], 
-                                  capture_output=True, text=True, timeout=10)
-            if result.returncode == 0:
-                print("📷 Formatos disponibles:")
-                lines = result.stdout.split('\n')[:10]  # Mostrar solo las primeras 10 líneas
-                for line in lines:
-                    if line.strip():
-                        print(f"   {line}")
-            else:
-                print("⚠️  No se pudieron obtener los formatos del dispositivo")
-                
-        except FileNotFoundError:
-            print("⚠️  v4l2-ctl no instalado. Instala con: sudo apt install v4l-utils")
-        except Exception as e:
-            print(f"⚠️  Error verificando formatos: {e}")
-            
-    def create_camera_pipeline(self):
-        """Crear pipeline para cámara"""
-        if self.post_process_so:
-            pipeline_str = f"""
-                libcamerasrc ! 
-                video/x-raw,width=640,height=640,framerate=30/1 ! 
-                videoconvert ! 
-                hailonet hef-path={self.model_path} ! 
-                hailofilter function-name=yolov5 so-path={self.post_process_so} ! 
-                identity name=identity_callback ! 
-                fakesink sync=false
-            """
+        """Mostrar los formatos del dispositivo V4L2 guardados en el índice"""
+        if not os.path.exists(self.source):
+            print(f"❌ Dispositivo {self.source} no existe")
+            return
+        consulta = self.indice.formatos_v4l2(self.source)
+        if consulta is None:
+            # La consulta a v4l2-ctl corre en segundo plano y queda para el próximo arranque
+            print(f"🔍 Consultando formatos de {self.source} en segundo plano...")
+        elif consulta["error"]:
+            print(f"⚠️  {consulta['error']}")
         else:
-            pipeline_str = f"""
-                libcamerasrc ! 
-                video/x-raw,width=640,height=640,framerate=30/1 ! 
-                videoconvert ! 
-                hailonet hef-path={self.model_path} ! 
-                identity name=identity_callback ! 
-                fakesink sync=false
-            """
-    def create_v4l2_pipeline_alt1(self):
-        """Pipeline alternativo 1 para V4L2 - con post-procesamiento si está disponible"""
-        if self.post_process_so:
-            pipeline_str = f"""
-                v4l2src device={self.source} ! 
-                videoconvert ! 
-                videoscale ! 
-                video/x-raw,format=RGB,width=640,height=640,framerate=15/1 ! 
-                hailonet hef-path={self.model_path} ! 
-                hailofilter function-name=yolov5 so-path={self.post_process_so} ! 
-                identity name=identity_callback ! 
-                fakesink sync=false
-            """
-        else:
-            pipeline_str = f"""
-                v4l2src device={self.source} ! 
-                videoconvert ! 
-                videoscale ! 
-                video/x-raw,format=RGB,width=640,height=640,framerate=15/1 ! 
-                hailonet hef-path={self.model_path} ! 
-                identity name=identity_callback ! 
-                fakesink sync=false
-            """
-    def create_v4l2_pipeline_alt2(self):
-        """Pipeline alternativo 2 para V4L2 - formato YUYV nativo sin post-proc"""
-        pipeline_str = f"""
-            v4l2src device={self.source} ! 
-            video/x-raw,format=YUY2,width=640,height=480,framerate=15/1 ! 
-            videoconvert ! 
-            videoscale ! 
-            video/x-raw,format=RGB,width=640,height=640 ! 
-            hailonet hef-path={self.model_path} ! 
-            identity name=identity_callback ! 
-            fakesink sync=false
-        """
-        return pipeline_str
-        
-    def create_v4l2_pipeline_with_correct_postproc(self):
-        """Pipeline V4L2 con post-procesamiento correcto para yolov5m_wo_spp_h8l"""
-        if self.post_process_so and "yolov5m_wo_spp_h8l" in self.model_path:
-            # Para el modelo yolov5m_wo_spp_h8l, usar la función correcta
-            pipeline_str = f"""
-                v4l2src device={self.source} ! 
-                video/x-raw,format=YUY2,width=640,height=480,framerate=15/1 ! 
-                videoconvert ! 
-                videoscale ! 
-                video/x-raw,format=RGB,width=640,height=640 ! 
-                hailonet hef-path={self.model_path} ! 
-                hailofilter function-name=yolov5m_wo_spp so-path={self.post_process_so} ! 
-                identity name=identity_callback ! 
-                fakesink sync=false
-            """
-        else:
-            # Para otros modelos, usar función genérica
-            pipeline_str = f"""
-                v4l2src device={self.source} ! 
-                video/x-raw,format=YUY2,width=640,height=480,framerate=15/1 ! 
-                videoconvert ! 
-                videoscale ! 
-                video/x-raw,format=RGB,width=640,height=640 ! 
-                hailonet hef-path={self.model_path} ! 
-                hailofilter function-name=yolov5 so-path={self.post_process_so} ! 
-                identity name=identity_callback ! 
-                fakesink sync=false
-            """
-        return pipeline_str
-        
-    def create_file_pipeline(self):
-        """Crear pipeline para archivo de video"""
-        pipeline_str = f"""
-            filesrc location={self.source} ! 
-            qtdemux ! h264parse ! avdec_h264 ! 
-            videoconvert ! videoscale ! 
-            video/x-raw,width=640,height=640 ! 
-            hailonet hef-path={self.model_path} ! 
-            hailofilter function-name=yolov5 so-path={self.post_process_so} ! 
-            identity name=identity_callback ! 
-            fakesink sync=false
-        """
-        return pipeline_str
-        
-    def create_v4l2_pipeline(self):
-        """Crear pipeline para dispositivo V4L2 (como /dev/video0)"""
-        # Para modelos h8l, intentar sin post-procesamiento específico primero
-        pipeline_str = f"""
-            v4l2src device={self.source} ! 
-            video/x-raw,framerate=15/1 ! 
-            videoconvert ! 
-            videoscale ! 
-            video/x-raw,format=RGB,width=640,height=640 ! 
-            hailonet hef-path={self.model_path} ! 
-            identity name=identity_callback ! 
-            fakesink sync=false
-        """
-        return pipeline_str
-        
-    def create_test_pipeline(self):
-        """Crear pipeline de test con videotestsrc"""
-        pipeline_str = f"""
-            videotestsrc pattern=ball ! 
-            video/x-raw,width=640,height=640,framerate=30/1 ! 
-            videoconvert ! 
-            hailonet hef-path={self.model_path} ! 
-            hailofilter function-name=yolov5 so-path={self.post_process_so} ! 
-            identity name=identity_callback ! 
-            fakesink sync=false
-        """
-        return pipeline_str
-        
+            print("📷 Formatos disponibles:")
+            for line in consulta["formatos"].split('\n')[:10]:  # Mostrar solo las primeras 10 líneas
+                if line.strip():
+                    print(f"   {line}")
+            
+    def _candidatos(self):
+        """Configuraciones a probar según la fuente, en orden de preferencia"""
+        modelo = self.model_path
+        postproc = self.post_process_so
+        # Las fuentes 4:3 o de archivo entran al modelo con letterbox (sin deformar)
+        rgb_640 = letterbox.caps_modelo(640, 640)
+        preproceso = letterbox.elementos_letterbox()
+        yuyv_480 = "video/x-raw,format=YUY2,width=640,height=480,framerate=15/1"
+
+        if self.source == "camera":
+            return [pipelines.EspecPipeline(
+                "Camera (libcamera)", ["libcamerasrc"],
+                caps_fuente="video/x-raw,width=640,height=640,framerate=30/1",
+                modelo=modelo, postproceso=postproc, funcion="yolov5")]
+        if self.source == "test":
+            return [pipelines.EspecPipeline(
+                "Test pattern", ["videotestsrc pattern=ball"],
+                caps_fuente="video/x-raw,width=640,height=640,framerate=30/1",
+                modelo=modelo, postproceso=postproc, funcion="yolov5")]
+        if self.source.startswith('/dev/video'):
+            fuente = [f"v4l2src device={self.source}"]
+            # Para yolov5m_wo_spp_h8l la función de post-procesamiento es otra
+            funcion = "yolov5m_wo_spp" if "yolov5m_wo_spp_h8l" in modelo else "yolov5"
+            candidatos = []
+            if postproc:
+                # Un candidato por camino de captura (NV12/YUY2/MJPEG), del más barato al más caro
+                modo = getattr(self.opciones_pipeline, "captura", "auto")
+                candidatos += captura.candidatos("V4L2 con post-proc correcto", fuente, modo,
+                                                 caps_modelo=rgb_640, modelo=modelo,
+                                                 postproceso=postproc, funcion=funcion)
+            candidatos.append(pipelines.EspecPipeline(
+                "V4L2 sin post-proc", fuente, "video/x-raw,framerate=15/1",
+                preproceso, rgb_640, modelo))
+            if postproc:
+                candidatos.append(pipelines.EspecPipeline(
+                    "V4L2 con post-proc genérico", fuente, None, preproceso,
+                    f"{rgb_640},framerate=15/1", modelo, postproceso=postproc, funcion="yolov5"))
+            candidatos.append(pipelines.EspecPipeline(
+                "V4L2 formato YUYV", fuente, yuyv_480, preproceso, rgb_640, modelo))
+            return candidatos
+        if os.path.isfile(self.source):
+            return [pipelines.EspecPipeline(
+                "Archivo de video",
+                [f"filesrc location={self.source}", "qtdemux", "h264parse", "avdec_h264"],
+                None, preproceso, letterbox.caps_modelo(640, 640, "RGB"),
+                modelo, postproceso=postproc, funcion="yolov5")]
+        raise ValueError(f"Fuente no válida: {self.source}")
+
     def create_pipeline(self):
-        """Crear el pipeline según el tipo de fuente"""
+        """Crear el pipeline según el tipo de fuente (la configuración que funcionó queda en caché)"""
         print(f"🚀 Creando pipeline para fuente: {self.source}")
         print(f"📦 Usando modelo: {os.path.basename(self.model_path)}")
-        
-        pipeline_attempts = []
-        
-        if self.source == "camera":
-            pipeline_attempts.append(("Camera (libcamera)", self.create_camera_pipeline))
-        elif self.source == "test":
-            pipeline_attempts.append(("Test pattern", self.create_test_pipeline))
-        elif self.source.startswith('/dev/video'):
-            # Múltiples intentos para dispositivos V4L2, empezando con post-procesamiento correcto
-            pipeline_attempts.extend([
-                ("V4L2 con post-proc correcto", self.create_v4l2_pipeline_with_correct_postproc),
-                ("V4L2 sin post-proc", self.create_v4l2_pipeline),
-                ("V4L2 con post-proc genérico", self.create_v4l2_pipeline_alt1),
-                ("V4L2 formato YUYV", self.create_v4l2_pipeline_alt2)
-            ])
-        elif os.path.isfile(self.source):
-            pipeline_attempts.append(("Archivo de video", self.create_file_pipeline))
-        else:
-            raise ValueError(f"Fuente no válida: {self.source}")
-        
-        # Intentar crear pipeline
-        for attempt_name, pipeline_func in pipeline_attempts:
-            try:
-                print(f"🔧 Intentando: {attempt_name}")
-                pipeline_str = pipeline_func()
-                print(f"   Pipeline: {pipeline_str.replace('            ', '').strip()}")
-                
-                self.pipeline = Gst.parse_launch(pipeline_str)
-                
-                # Añadir probe al identity element
-                identity = self.pipeline.get_by_name("identity_callback")
-                if identity is None:
-                    raise RuntimeError("No se pudo encontrar el elemento 'identity_callback'")
-                    
-                pad = identity.get_static_pad("src")
-                pad.add_probe(Gst.PadProbeType.BUFFER, self.callback_func, self.user_data)
-                
-                print(f"✅ Pipeline creado exitosamente con: {attempt_name}")
-                return
-                
-            except Exception as e:
-                print(f"❌ Falló {attempt_name}: {e}")
-                if self.pipeline:
-                    self.pipeline.set_state(Gst.State.NULL)
-                    self.pipeline = None
-                continue
-        
-        raise RuntimeError("No se pudo crear ningún pipeline válido")
-    
+
+        if self.fuentes:
+            self.create_multisource_pipeline()
+            return
+        if self.mosaicos is not None:
+            self.create_tiled_pipeline()
+            return
+
+        self.clave_cache = pipelines.clave_cache(self.source, self.model_path, self.post_process_so)
+        self.pipeline, espec, desde_cache = pipelines.construir_con_cache(
+            self._candidatos(), self.clave_cache, self.cache, self.opciones_pipeline)
+        if not desde_cache:
+            self.espec_pendiente = espec
+        print(f"   Pipeline: {espec.a_cadena()}")
+
+        # Añadir probe al identity element
+        identity = self.pipeline.get_by_name("identity_callback")
+        if identity is None:
+            raise RuntimeError("No se pudo encontrar el elemento 'identity_callback'")
+        pad = identity.get_static_pad("src")
+        pad.add_probe(Gst.PadProbeType.BUFFER, self.callback_func, self.user_data)
+
+        origen = "configuración guardada" if desde_cache else "primera candidata válida"
+        print(f"✅ Pipeline creado con: {espec.nombre} ({origen})")
+
+    def create_multisource_pipeline(self):
+        """Un pipeline con todas las fuentes turnándose en un solo hailonet"""
+        self.pipeline = multifuente.construir_multifuente(
+            self.fuentes, self.model_path, self.post_process_so, fps_max=self.fps_max)
+        self.ruteador = multifuente.RuteadorFuentes(
+            self.fuentes, [self.callback_func] * len(self.fuentes), self.user_data)
+        self.ruteador.instalar(self.pipeline)
+        print(f"✅ Pipeline multi-fuente creado: {len(self.fuentes)} fuentes, "
+              f"máx {self.fps_max} fps cada una")
+
+    def create_tiled_pipeline(self):
+        """Un pipeline que infiere cada mosaico por separado y fusiona las detecciones por frame"""
+        ancho, alto = self.resolucion_fuente
+        funcion = "yolov5m_wo_spp" if "yolov5m_wo_spp_h8l" in self.model_path else "yolov5"
+        self.pipeline = mosaico.construir_mosaico(
+            self.source, self.mosaicos, ancho, alto, self.model_path, self.post_process_so,
+            funcion, fps_max=self.fps_max)
+        self.agregador = mosaico.AgregadorMosaicos(self.mosaicos, ancho, alto, mosaico_callback,
+                                                   self.user_data)
+        self.ruteador = mosaico.instalar(self.pipeline, self.mosaicos, self.agregador)
+        print(f"✅ Pipeline por mosaicos creado: {len(self.mosaicos)} recortes sobre {ancho}x{alto}")
+
     def on_message(self, bus, message):
         """Manejar mensajes del bus de GStreamer"""
+        if self.metricas is not None:
+            self.metricas.procesar_mensaje(message)
         if message.type == Gst.MessageType.EOS:
             print("🏁 End of stream")
             self.loop.quit()
@@ -509,10 +415,21 @@ class HeadlessDetectionApp:
             print(f"❌ Error: {err}")
             if debug:
                 print(f"🐛 Debug: {debug}")
+            # No volver a intentar esta configuración en el próximo arranque
+            self.espec_pendiente = None
+            if self.cache is not None and self.clave_cache is not None:
+                self.cache.olvidar(self.clave_cache)
             self.loop.quit()
         elif message.type == Gst.MessageType.WARNING:
             warn, debug = message.parse_warning()
             print(f"⚠️  Warning: {warn}")
+        elif message.type == Gst.MessageType.STATE_CHANGED and message.src == self.pipeline:
+            # Las fuentes en vivo arrancan en ASYNC: la configuración sirve recién en PLAYING
+            _, nuevo, _ = message.parse_state_changed()
+            if nuevo == Gst.State.PLAYING and self.espec_pendiente is not None:
+                if self.cache is not None:
+                    self.cache.guardar(self.clave_cache, self.espec_pendiente)
+                self.espec_pendiente = None
             
     def signal_handler(self, signum, frame):
         """Manejar señales del sistema"""
@@ -524,6 +441,9 @@ class HeadlessDetectionApp:
         """Ejecutar la aplicación"""
         try:
             self.create_pipeline()
+            if self.args_metricas is not None:
+                self.metricas, self.exportadores = metricas.iniciar_desde_args(self.args_metricas,
+                                                                               self.pipeline)
             
             # Configurar señales
             signal.signal(signal.SIGINT, self.signal_handler)
@@ -541,6 +461,10 @@ class HeadlessDetectionApp:
             print("▶️  Iniciando pipeline...")
             ret = self.pipeline.set_state(Gst.State.PLAYING)
             if ret == Gst.StateChangeReturn.FAILURE:
+                # No volver a intentar esta configuración en el próximo arranque
+                self.espec_pendiente = None
+                if self.cache is not None and self.clave_cache is not None:
+                    self.cache.olvidar(self.clave_cache)
                 raise RuntimeError("No se pudo iniciar el pipeline")
                 
             print("✅ Pipeline iniciado. Presiona Ctrl+C para salir.")
@@ -561,6 +485,17 @@ class HeadlessDetectionApp:
         print("🧹 Limpiando recursos...")
         if self.pipeline:
             self.pipeline.set_state(Gst.State.NULL)
+        if self.metricas is not None:
+            self.metricas.detener()
+            print(f"📈 Métricas finales: {json.dumps(self.metricas.reporte())}")
+        for exportador in self.exportadores:
+            exportador.detener()
+        if self.ruteador is not None:
+            print(f"📡 Fuentes: {json.dumps(self.ruteador.estadisticas(), ensure_ascii=False)}")
+        if self.agregador is not None:
+            print(f"🧩 Mosaicos: {json.dumps(self.agregador.estadisticas())}")
+        if self.postproceso is not None:
+            print(f"🐍 Post-proceso NumPy: {json.dumps(self.postproceso.estadisticas())}")
         print("✅ Aplicación cerrada correctamente")
 
 # -----------------------------------------------------------------------------------------------
@@ -578,10 +513,17 @@ def main():
                        help='Deshabilitar procesamiento de frames (máximo rendimiento)')
     parser.add_argument('--confidence', '-c', type=float, default=0.3,
                        help='Umbral de confianza para detecciones (default: 0.3)')
-    parser.add_argument('--debug', action='store_true',
-                       help='Mostrar información de debug de todas las detecciones')
+    agregar_argumentos(parser)
+    metricas.agregar_argumentos(parser)
+    pipelines.agregar_argumentos(parser)
+    pipelines.agregar_argumentos_cache(parser)
+    multifuente.agregar_argumentos(parser)
+    mosaico.agregar_argumentos(parser)
+    captura.agregar_argumentos(parser)
+    postproceso_yolo.agregar_argumentos(parser)
     
     args = parser.parse_args()
+    configurar_desde_args(args)
     
     # Manejar --input como alias de --source
     if args.input:
@@ -590,15 +532,16 @@ def main():
     print("🤖 Hailo Detection Headless")
     print("=" * 50)
     
-    # Crear instancia de la clase de usuario
-    user_data = user_app_callback_class()
+    # Crear instancia de la clase de usuario (una por fuente en modo multi-fuente)
+    fuentes = args.sources if args.sources and len(args.sources) > 1 else None
+    if args.sources and not fuentes:
+        args.source = args.sources[0]
+    datos = [user_app_callback_class() for _ in (fuentes or [args.source])]
     
     # Configurar opciones
-    user_data.use_frame = not args.no_frame_processing
-    user_data.confidence_threshold = args.confidence
-    
-    if args.debug:
-        print(f"🔧 Modo debug activado - Umbral de confianza: {args.confidence}")
+    for user_data in datos:
+        user_data.use_frame = not args.no_frame_processing
+        user_data.confidence_threshold = args.confidence
     
     if args.no_frame_processing:
         print("🏃 Modo de máximo rendimiento: Sin procesamiento de frames")
@@ -606,9 +549,17 @@ def main():
     # Crear y ejecutar la aplicación
     app = HeadlessDetectionApp(
         callback_func=app_callback,
-        user_data=user_data,
-        source=args.source,
-        model_path=args.model
+        user_data=datos if fuentes else datos[0],
+        source=fuentes[0] if fuentes else args.source,
+        model_path=args.model,
+        args_metricas=args,
+        opciones_pipeline=args,
+        cache=pipelines.cache_desde_args(args),
+        fuentes=fuentes,
+        fps_max=args.fps_max,
+        mosaicos=mosaico.mosaicos_desde_args(args),
+        resolucion_fuente=args.resolucion_fuente,
+        args_postproceso=args
     )
     
     app.run()
@@ -5,8 +5,14 @@ gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GLib
 import sys
 import signal
+import argparse
 import hailo
 import time
+import numpy as np
+from detecciones import extraer_detecciones, filtrar
+from eventos import agregar_argumentos, configurar_desde_args
+import pipelines
+import captura
 
 def detection_callback(pad, info, user_data):
     buffer = info.get_buffer()
@@ -18,39 +24,36 @@ def detection_callback(pad, info, user_data):
     
     try:
         roi = hailo.get_roi_from_buffer(buffer)
-        detections = roi.get_objects_typed(hailo.HAILO_DETECTION)
-        
-        person_count = 0
-        high_conf_detections = []
-        
-        for detection in detections:
-            label = detection.get_label()
-            confidence = detection.get_confidence()
-            bbox = detection.get_bbox()
-            
-            if confidence > 0.3:  # Solo mostrar detecciones con confianza razonable
-                high_conf_detections.append((label, confidence))
-                
-                if label == "person":
-                    person_count += 1
-                    print(f"🧑 Person detected! Confidence: {confidence:.3f} "
-                          f"BBox: ({bbox.xmin():.0f},{bbox.ymin():.0f},{bbox.width():.0f},{bbox.height():.0f})")
-                elif label in ["car", "truck", "bicycle", "motorbike", "bus"]:
-                    print(f"🚗 {label.title()} detected! Confidence: {confidence:.3f}")
-                elif label in ["cat", "dog", "bird"]:
-                    print(f"🐾 {label.title()} detected! Confidence: {confidence:.3f}")
-        
+        detections = extraer_detecciones(roi)
+
+        # Solo mostrar detecciones con confianza razonable
+        confiables = detections[detections.confianza > 0.3]
+        personas = confiables[filtrar(confiables, ["person"])]
+        vehiculos = confiables[filtrar(confiables, ["car", "truck", "bicycle", "motorbike", "bus"])]
+        animales = confiables[filtrar(confiables, ["cat", "dog", "bird"])]
+        person_count = len(personas)
+
+        eventos = user_data['eventos']
+        if eventos.habilitado():
+            for grupo in (personas, vehiculos, animales):
+                eventos.detecciones(grupo.etiquetas(), grupo.confianza)
+
         # Calcular FPS cada 30 frames
         if user_data['frame_count'] % 30 == 0:
             elapsed = current_time - user_data['start_time']
             fps = user_data['frame_count'] / elapsed
-            print(f"📊 Frame {user_data['frame_count']}: {len(detections)} detections, "
-                  f"{person_count} persons | FPS: {fps:.1f}")
-            
-            if high_conf_detections:
+            eventos.evento("estadisticas",
+                           f"📊 Frame {user_data['frame_count']}: {len(detections)} detections, "
+                           f"{person_count} persons | FPS: {fps:.1f}",
+                           frame=user_data['frame_count'], detecciones=len(detections),
+                           personas=person_count, fps=round(fps, 1))
+
+            if len(confiables):
                 # Mostrar top 3 detecciones
-                sorted_detections = sorted(high_conf_detections, key=lambda x: x[1], reverse=True)[:3]
-                print(f"   🏆 Top detections: {sorted_detections}")
+                top = np.argsort(-confiables.confianza)[:3]
+                sorted_detections = [(confiables.etiqueta(i), round(float(confiables.confianza[i]), 3))
+                                     for i in top]
+                eventos.debug("top", f"   🏆 Top detections: {sorted_detections}")
             
     except Exception as e:
         if user_data['frame_count'] % 60 == 0:
@@ -67,9 +70,17 @@ def main():
         ("/home/jose/hailo-rpi5-examples/resources/yolov11n_h8l.hef", "yolov8s", "YOLOv11 Nano"),
     ]
     
+    parser = argparse.ArgumentParser(description='Prueba de modelos YOLO en /dev/video0')
+    parser.add_argument('model', nargs='?', help='Ruta al .hef (por defecto, el primero de la lista)')
+    agregar_argumentos(parser)
+    pipelines.agregar_argumentos(parser)
+    captura.agregar_argumentos(parser)
+    args = parser.parse_args()
+    eventos = configurar_desde_args(args)
+
     # Usar el primer argumento si se proporciona, sino usar el primero de la lista
-    if len(sys.argv) > 1:
-        model_path = sys.argv[1]
+    if args.model:
+        model_path = args.model
         # Determinar función basada en el nombre del modelo
         if "yolov8s" in model_path or "yolov11s" in model_path or "yolov11n" in model_path:
             function_name = "yolov8s"
@@ -86,23 +97,16 @@ def main():
     
     Gst.init(None)
     
-    pipeline_str = f"""
-        v4l2src device={device} ! 
-        video/x-raw,format=YUY2,width=640,height=480,framerate=15/1 ! 
-        videoconvert ! 
-        videoscale ! 
-        video/x-raw,format=RGB,width=640,height=640 ! 
-        hailonet hef-path={model_path} ! 
-        hailofilter function-name={function_name} so-path={postprocess_lib} ! 
-        identity name=callback ! 
-        fakesink sync=false
-    """
+    espec = captura.elegir(captura.candidatos(
+        "prueba_modelo", [f"v4l2src device={device}"], args.captura,
+        modelo=model_path, postproceso=postprocess_lib, funcion=function_name, callback="callback"))
     
     try:
-        pipeline = Gst.parse_launch(pipeline_str)
+        pipeline = pipelines.construir(espec, args)
         user_data = {
             'frame_count': 0, 
-            'start_time': time.time()
+            'start_time': time.time(),
+            'eventos': eventos,
         }
         
         identity = pipeline.get_by_name("callback")
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import argparse
+
+import numpy as np
+
+CRITERIOS_MEJOR = ("confianza", "centrado")
+
+
+def iou_matriz(a, b):
+    """IoU entre todas las cajas de a (Nx4) y b (Mx4) en formato xyxy"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0).astype(np.float32)
+
+
+def asignacion_voraz(costo_iou, umbral):
+    """Asignación greedy por IoU descendente: devuelve pares (fila, columna)"""
+    if costo_iou.size == 0:
+        return []
+    filas, columnas = np.nonzero(costo_iou >= umbral)
+    if filas.size == 0:
+        return []
+    orden = np.argsort(-costo_iou[filas, columnas], kind="stable")
+    usadas_f = set()
+    usadas_c = set()
+    pares = []
+    for k in orden:
+        f, c = int(filas[k]), int(columnas[k])
+        if f in usadas_f or c in usadas_c:
+            continue
+        usadas_f.add(f)
+        usadas_c.add(c)
+        pares.append((f, c))
+    return pares
+
+
+def _liberar_dato(dato):
+    if hasattr(dato, "liberar"):
+        dato.liberar()
+
+
+class Track:
+    def __init__(self, track_id, clase, bbox):
+        self.id = track_id
+        self.clase = clase
+        self.bbox = bbox
+        self.hits = 1
+        self.perdidos = 0
+        self.edad = 1
+        self.emitido = False
+        self.mejor_puntaje = -1.0
+        self.mejor_confianza = 0.0
+        self.mejor_dato = None
+
+
+class RastreadorIoU:
+    """Tracker multi-objeto por IoU con asignación greedy vectorizada
+
+    Cada track guarda solo su mejor observación (mayor confianza o caja más
+    centrada). El dato de esa observación se pide a demanda con la función
+    crear_dato, así que los frames que no mejoran nada no cuestan copias.
+    Un track se emite una sola vez: al perderse o, si sigue visible, tras
+    max_frames_espera frames.
+    """
+
+    def __init__(self, umbral_iou=0.3, max_perdidos=10, min_hits=3,
+                 criterio="confianza", max_frames_espera=150, centro=(0.5, 0.5),
+                 escala=1.0):
+        if criterio not in CRITERIOS_MEJOR:
+            raise ValueError(f"Criterio no válido: {criterio}")
+        self.umbral_iou = umbral_iou
+        self.max_perdidos = max_perdidos
+        self.min_hits = min_hits
+        self.criterio = criterio
+        self.max_frames_espera = max_frames_espera
+        self.centro = np.asarray(centro, dtype=np.float32)
+        self.escala = escala
+        self.tracks = {}
+        self._siguiente_id = 1
+
+    def _puntajes(self, xyxy, confianzas):
+        if self.criterio == "confianza":
+            return confianzas
+        centros = (xyxy[:, :2] + xyxy[:, 2:]) / 2.0
+        distancia = np.linalg.norm((centros - self.centro) / self.escala, axis=1)
+        return 1.0 - distancia
+
+    def actualizar(self, xyxy, confianzas, clases, ids_externos=None, crear_dato=None):
+        """Procesar las detecciones de un frame
+
+        xyxy Nx4, confianzas N, clases N. ids_externos (p.ej. HAILO_UNIQUE_ID de
+        hailotracker) reemplaza la asociación por IoU cuando está presente.
+        crear_dato(i) se llama solo cuando la detección i pasa a ser la mejor de
+        su track. Devuelve (ids por detección, tracks listos para emitir).
+        """
+        xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        confianzas = np.asarray(confianzas, dtype=np.float32).reshape(-1)
+        clases = np.asarray(clases).reshape(-1)
+        n = len(xyxy)
+        ids = np.zeros(n, dtype=np.int64)
+
+        if ids_externos is not None:
+            pares = self._asociar_por_id(np.asarray(ids_externos).reshape(-1), clases, xyxy)
+        else:
+            pares = self._asociar_por_iou(xyxy, clases)
+
+        vistos = set()
+        for i, track in pares:
+            track.bbox = xyxy[i]
+            track.hits += 1
+            track.perdidos = 0
+            ids[i] = track.id
+            vistos.add(track.id)
+
+        # Detecciones sin track: crear uno nuevo
+        asignadas = {i for i, _ in pares}
+        for i in range(n):
+            if i in asignadas:
+                continue
+            if ids_externos is not None and int(ids_externos[i]) > 0:
+                track_id = int(ids_externos[i])
+            else:
+                track_id = self._siguiente_id
+                self._siguiente_id += 1
+            track = Track(track_id, clases[i], xyxy[i])
+            self.tracks[track_id] = track
+            ids[i] = track_id
+            vistos.add(track_id)
+            pares.append((i, track))
+
+        # Actualizar la mejor observación de cada track
+        if n:
+            puntajes = self._puntajes(xyxy, confianzas)
+            for i, track in pares:
+                if not track.emitido and puntajes[i] > track.mejor_puntaje:
+                    track.mejor_puntaje = float(puntajes[i])
+                    track.mejor_confianza = float(confianzas[i])
+                    if crear_dato is not None:
+                        _liberar_dato(track.mejor_dato)
+                        track.mejor_dato = crear_dato(i)
+
+        return ids, self._recolectar(vistos)
+
+    def _asociar_por_iou(self, xyxy, clases):
+        activos = list(self.tracks.values())
+        if not activos or not len(xyxy):
+            return []
+        cajas = np.stack([t.bbox for t in activos])
+        clases_tracks = np.array([t.clase for t in activos])
+        iou = iou_matriz(xyxy, cajas)
+        # No mezclar clases distintas
+        iou[clases[:, None] != clases_tracks[None, :]] = 0.0
+        return [(i, activos[j]) for i, j in asignacion_voraz(iou, self.umbral_iou)]
+
+    def _asociar_por_id(self, ids_externos, clases, xyxy):
+        pares = []
+        for i, track_id in enumerate(ids_externos):
+            track = self.tracks.get(int(track_id))
+            if track is not None and track_id > 0:
+                pares.append((i, track))
+        return pares
+
+    def _recolectar(self, vistos):
+        """Avanzar la edad de los tracks y devolver los que hay que emitir"""
+        listos = []
+        for track_id in list(self.tracks):
+            track = self.tracks[track_id]
+            track.edad += 1
+            if track_id not in vistos:
+                track.perdidos += 1
+            confirmado = track.hits >= self.min_hits
+            if track.perdidos > self.max_perdidos:
+                del self.tracks[track_id]
+                if confirmado and not track.emitido:
+                    track.emitido = True
+                    listos.append(track)
+                else:
+                    _liberar_dato(track.mejor_dato)
+                    track.mejor_dato = None
+            elif confirmado and not track.emitido and track.edad >= self.max_frames_espera:
+                track.emitido = True
+                listos.append(track)
+        return listos
+
+    def finalizar(self):
+        """Emitir los tracks confirmados que quedan (al cerrar la aplicación)"""
+        listos = []
+        for track in self.tracks.values():
+            if track.hits >= self.min_hits and not track.emitido:
+                track.emitido = True
+                listos.append(track)
+            else:
+                _liberar_dato(track.mejor_dato)
+                track.mejor_dato = None
+        self.tracks = {}
+        return listos
+
+
+# -----------------------------------------------------------------------------------------------
+# Reproducción offline de secuencias de detecciones
+# -----------------------------------------------------------------------------------------------
+def cargar_secuencia(path):
+    """Leer un JSONL con una lista [x1, y1, x2, y2, confianza, clase] por frame"""
+    frames = []
+    with open(path) as f:
+        for linea in f:
+            linea = linea.strip()
+            if linea:
+                frames.append(json.loads(linea).get("detecciones", []))
+    return frames
+
+
+def generar_secuencia(vehiculos=20, frames=900, duracion=45, seed=0):
+    """Autos cruzando la imagen de izquierda a derecha con ruido en caja y confianza"""
+    rng = np.random.default_rng(seed)
+    inicios = np.sort(rng.integers(0, frames - duracion, vehiculos))
+    secuencia = [[] for _ in range(frames)]
+    for inicio in inicios:
+        y = rng.uniform(0.3, 0.7)
+        for k in range(duracion):
+            x = k / duracion
+            ruido = rng.normal(0, 0.005, 4)
+            caja = [x, y, x + 0.15, y + 0.1] + ruido
+            secuencia[inicio + k].append(list(map(float, caja)) + [float(rng.uniform(0.4, 0.95)), "car"])
+    return secuencia
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reproducir detecciones grabadas con el tracker')
+    parser.add_argument('--secuencia', help='JSONL de detecciones por frame (por defecto, sintética)')
+    parser.add_argument('--criterio', default='confianza', choices=CRITERIOS_MEJOR)
+    parser.add_argument('--umbral-iou', type=float, default=0.3)
+    args = parser.parse_args()
+
+    secuencia = cargar_secuencia(args.secuencia) if args.secuencia else generar_secuencia()
+    rastreador = RastreadorIoU(umbral_iou=args.umbral_iou, criterio=args.criterio)
+
+    detecciones = 0
+    capturas = 0
+    inicio = time.perf_counter()
+    for dets in secuencia:
+        detecciones += len(dets)
+        if dets:
+            arr = np.array([d[:5] for d in dets], dtype=np.float32)
+            clases = [d[5] for d in dets]
+        else:
+            arr = np.zeros((0, 5), dtype=np.float32)
+            clases = []
+        _, listos = rastreador.actualizar(arr[:, :4], arr[:, 4], clases)
+        capturas += len(listos)
+    capturas += len(rastreador.finalizar())
+    duracion = time.perf_counter() - inicio
+
+    print(f"📊 Frames: {len(secuencia)} | Detecciones: {detecciones} | Capturas por track: {capturas}")
+    print(f"⏱️  {duracion * 1e6 / max(1, len(secuencia)):.1f} µs/frame en el tracker")
+
+
+if __name__ == "__main__":
+    main()